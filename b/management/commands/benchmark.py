@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from scripts import benchmark
+
+
+class Command(BaseCommand):
+    help = "Times each stage of a release step on synthetic seasons of given scales and saves the results as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scales", type=float, nargs="+", default=[1, 10, 100], help="Season sizes relative to one week of ours"
+        )
+        parser.add_argument("--output", default="benchmark.json", help="Path of the JSON file with results")
+        parser.add_argument("--compare", help="Path of earlier results to compare with")
+        parser.add_argument(
+            "--repeat", type=int, default=1, help="Runs per scale; the fastest time of each stage is kept"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--db", action="store_true", help="Also time writing the rows to temporary tables in the DB"
+        )
+
+    def handle(self, *args, **options):
+        results = benchmark.run_benchmark(
+            options["scales"], repeat=options["repeat"], seed=options["seed"], db=options["db"]
+        )
+        benchmark.save_results(options["output"], results)
+        for run in results["runs"]:
+            self.stdout.write(f"Scale {run['scale']}: {run['total']:.2f} s")
+            for stage, seconds in run["stages"].items():
+                self.stdout.write(f"  {stage}: {seconds:.3f} s")
+        if options["compare"]:
+            for line in benchmark.compare_results(benchmark.load_results(options["compare"]), results):
+                self.stdout.write(line)
@@ -1,17 +1,73 @@
 from django.core.management.base import BaseCommand
 import datetime
 
-from scripts import main, tools
+from scripts import data_sources, main, tools
+from scripts.snapshots import SnapshotStore
 
 
 class Command(BaseCommand):
     help = "Calculates all releases since September 2021."
 
     def add_arguments(self, parser):
-        parser.add_argument("--first_to_calc", default=tools.FIRST_NEW_RELEASE.strftime("%Y-%m-%d"))
-        parser.add_argument("--last_to_calc", default=datetime.date.today().strftime("%Y-%m-%d"))
+        # By default, the releases since FIRST_NEW_RELEASE until today, or all releases of the bundle.
+        parser.add_argument("--first_to_calc")
+        parser.add_argument("--last_to_calc")
+        parser.add_argument(
+            "--no_chain",
+            action="store_true",
+            help="Read every previous release from the DB instead of passing it in memory",
+        )
+        parser.add_argument("--diff", action="store_true", help="Update only changed rows of changed tables")
+        parser.add_argument(
+            "--force", action="store_true", help="Recalculate releases even if their inputs did not change"
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Calculate ratings of teams in tournaments in this many processes",
+        )
+        parser.add_argument(
+            "--pipeline",
+            action="store_true",
+            help="Read the next tournaments and write the previous release while calculating a release",
+        )
+        parser.add_argument(
+            "--snapshot_dir",
+            help="Save the state of calculated releases to this directory and read previous releases from it",
+        )
+        parser.add_argument(
+            "--bundle",
+            help="Read the inputs from this bundle (see dump_inputs) instead of the DB, and write nothing",
+        )
+        parser.add_argument(
+            "--profile",
+            metavar="DIR",
+            help="Profile the calculation of every release with cProfile and save the stats to DIR/<release date>.prof",
+        )
 
     def handle(self, *args, **options):
-        first_to_calc = datetime.date(*map(int, options["first_to_calc"].split("-")))
-        last_to_calc = datetime.date(*map(int, options["last_to_calc"].split("-")))
-        main.calc_all_releases(first_to_calc, last_to_calc)
+        source = (
+            data_sources.BundleDataSource.load(options["bundle"]) if options["bundle"] else data_sources.DEFAULT_SOURCE
+        )
+        if options["first_to_calc"]:
+            first_to_calc = datetime.date(*map(int, options["first_to_calc"].split("-")))
+        else:
+            first_to_calc = source.first_to_calc if options["bundle"] else tools.FIRST_NEW_RELEASE
+        if options["last_to_calc"]:
+            last_to_calc = datetime.date(*map(int, options["last_to_calc"].split("-")))
+        else:
+            last_to_calc = source.last_to_calc if options["bundle"] else datetime.date.today()
+        snapshots = SnapshotStore(options["snapshot_dir"]) if options["snapshot_dir"] else None
+        main.calc_all_releases(
+            first_to_calc,
+            last_to_calc,
+            chained=not options["no_chain"],
+            diff=options["diff"],
+            force=options["force"],
+            workers=options["workers"],
+            pipelined=options["pipeline"],
+            snapshots=snapshots,
+            source=source,
+            profile_dir=options["profile"],
+        )
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+import datetime
+
+from scripts import main, tools
+
+
+class Command(BaseCommand):
+    help = "Calculates all releases starting from the earliest one whose inputs changed."
+
+    def add_arguments(self, parser):
+        # The release after the last old one is calculated from the tables of the old rating system,
+        # so there is nothing to compare its inputs with.
+        parser.add_argument(
+            "--first_to_check",
+            default=(tools.FIRST_NEW_RELEASE + datetime.timedelta(days=7)).strftime("%Y-%m-%d"),
+        )
+        parser.add_argument("--last_to_calc", default=datetime.date.today().strftime("%Y-%m-%d"))
+        parser.add_argument("--diff", action="store_true", help="Update only changed rows of changed tables")
+
+    def handle(self, *args, **options):
+        first_to_check = datetime.date(*map(int, options["first_to_check"].split("-")))
+        last_to_calc = datetime.date(*map(int, options["last_to_calc"].split("-")))
+        first_to_calc = main.find_first_changed_release(first_to_check, last_to_calc)
+        if first_to_calc is None:
+            self.stdout.write("All releases are up to date.")
+            return
+        self.stdout.write(f"Inputs of release {first_to_calc} changed; calculating releases from it.")
+        main.calc_all_releases(first_to_calc, last_to_calc, diff=options["diff"])
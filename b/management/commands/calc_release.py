@@ -1,7 +1,8 @@
 from django.core.management.base import BaseCommand
 import datetime
 
-from scripts import main
+from scripts import main, timing
+from scripts.snapshots import SnapshotStore
 
 
 class Command(BaseCommand):
@@ -9,7 +10,34 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("new_release_date")
+        parser.add_argument("--diff", action="store_true", help="Update only changed rows of changed tables")
+        parser.add_argument(
+            "--force", action="store_true", help="Recalculate releases even if their inputs did not change"
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Calculate ratings of teams in tournaments in this many processes",
+        )
+        parser.add_argument(
+            "--snapshot_dir",
+            help="Save the state of calculated releases to this directory and read previous releases from it",
+        )
+        parser.add_argument(
+            "--profile",
+            metavar="DIR",
+            help="Profile the calculation with cProfile and save the stats to DIR/<release date>.prof",
+        )
 
     def handle(self, *args, **options):
         new_release_date = datetime.date(*map(int, options["new_release_date"].split("-")))
-        main.calc_release(new_release_date)
+        snapshots = SnapshotStore(options["snapshot_dir"]) if options["snapshot_dir"] else None
+        with timing.profiled(options["profile"], new_release_date):
+            main.calc_release(
+                new_release_date,
+                diff=options["diff"],
+                force=options["force"],
+                workers=options["workers"],
+                snapshots=snapshots,
+            )
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+import datetime
+
+from scripts import data_sources, tools
+
+
+class Command(BaseCommand):
+    help = "Exports everything calc_all_releases reads from the DB for given releases to a bundle file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("bundle", help="Path of the bundle to write, e.g. inputs.npz")
+        parser.add_argument("--first_to_calc", default=tools.FIRST_NEW_RELEASE.strftime("%Y-%m-%d"))
+        parser.add_argument("--last_to_calc", default=datetime.date.today().strftime("%Y-%m-%d"))
+
+    def handle(self, *args, **options):
+        first_to_calc = datetime.date(*map(int, options["first_to_calc"].split("-")))
+        last_to_calc = datetime.date(*map(int, options["last_to_calc"].split("-")))
+        data_sources.dump_bundle(options["bundle"], first_to_calc, last_to_calc)
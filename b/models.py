@@ -1,7 +1,5 @@
 from django.db import models
 
-from scripts import constants
-
 
 ### Tables from 'public' scheme. Read-only.
 
@@ -168,6 +166,25 @@ class Release(models.Model):
         db_table = "release"
 
 
+# Fingerprints of the rows we wrote: one per table of a release and, for tournament_result, one per
+# tournament (with empty release). They let us rewrite only the tables and tournaments that changed.
+class Fingerprint(models.Model):
+    release = models.ForeignKey(Release, verbose_name="Релиз", on_delete=models.CASCADE, null=True)
+    tournament = models.ForeignKey(Tournament, verbose_name="Турнир", on_delete=models.PROTECT, null=True)
+    table_name = models.CharField(verbose_name="Таблица", max_length=50)
+    hash = models.BigIntegerField(verbose_name="Hash of the rows of this table in this release or tournament")
+
+    class Meta:
+        db_table = "fingerprint"
+        unique_together = (
+            (
+                "release",
+                "tournament",
+                "table_name",
+            ),
+        )
+
+
 class Team_rating(models.Model):
     release = models.ForeignKey(Release, verbose_name="Релиз", on_delete=models.CASCADE)
     team = models.ForeignKey(Team, verbose_name="Команда", on_delete=models.PROTECT, null=True)
@@ -329,7 +346,6 @@ class Player_rating_by_tournament(models.Model):
     initial_score = models.IntegerField(verbose_name="Бонус игрока за турнир", null=True)
     weeks_since_tournament = models.SmallIntegerField(verbose_name="Число недель, прошедших после турнира, начиная с 0")
     cur_score = models.IntegerField(verbose_name="Вклад в рейтинг игрока в этом релизе")
-    raw_cur_score = None  # Float value for better precision
 
     class Meta:
         db_table = "player_rating_by_tournament"
@@ -341,11 +357,6 @@ class Player_rating_by_tournament(models.Model):
             ["release", "player", "cur_score"],
         ]
 
-    def recalc_cur_score(self):
-        self.weeks_since_tournament += 1
-        self.raw_cur_score = self.initial_score * (constants.J**self.weeks_since_tournament)
-        self.cur_score = round(self.raw_cur_score)
-
 
 # Stores all tournaments that were counted in given release.
 class Tournament_in_release(models.Model):
@@ -0,0 +1,5 @@
+#!/bin/bash
+# Calculates releases starting from the earliest one whose inputs changed
+uv run /app/manage.py calc_changed
+
+/app/cron_scripts/refresh_views.sh
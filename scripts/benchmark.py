@@ -0,0 +1,329 @@
+import datetime
+import json
+import logging
+import platform
+from dataclasses import asdict, dataclass, replace
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from django.db import connection, transaction
+
+from b import models
+
+from . import main
+from .constants import SCHEMA_NAME
+from .data_sources import BundleDataSource, datetime_column
+from .db_tools import fast_insert
+from .row_batch import RowBatch
+from .timing import StageTimer
+
+logger = logging.getLogger(__name__)
+
+# The release that synthetic seasons are calculated for, and the one before it. The season starts more than
+# 90 days before, so main.teams_to_dump needs no previous season.
+PREV_RELEASE_DATE = datetime.date(2025, 1, 9)
+RELEASE_DATE = datetime.date(2025, 1, 16)
+SEASON_START = datetime.date(2024, 9, 1)
+SEASON_END = datetime.date(2025, 8, 31)
+
+
+@dataclass
+class SeasonConfig:
+    """
+    Size of a synthetic season: the teams and players in the rating and the tournaments of one release.
+    The defaults are roughly one week of our current volume.
+    """
+
+    n_teams: int = 8000
+    n_players: int = 60000
+    # Tournaments of each type in the release, and the mean number of teams in a tournament of that type.
+    n_regular: int = 5
+    n_synchronous: int = 60
+    n_strictly_synchronous: int = 15
+    regular_size: int = 40
+    synchronous_size: int = 25
+    strictly_synchronous_size: int = 30
+    # Share of the teams in the rating whose players have top bonuses, and of teams in tournaments
+    # that are not in the rating yet.
+    rated_share: float = 0.8
+    new_team_share: float = 0.05
+    max_legionnaires: int = 2
+
+    def scaled(self, scale: float) -> "SeasonConfig":
+        return replace(
+            self,
+            n_teams=round(self.n_teams * scale),
+            n_players=round(self.n_players * scale),
+            n_regular=round(self.n_regular * scale),
+            n_synchronous=round(self.n_synchronous * scale),
+            n_strictly_synchronous=round(self.n_strictly_synchronous * scale),
+        )
+
+
+# Generates a synthetic season as the tables of an input bundle (see data_sources.BundleDataSource):
+# the state of the previous release, the tournaments of the release with results and rosters, and
+# base rosters. Every team has 6-8 base players; a team plays with 4-6 of them and up to
+# max_legionnaires players of other teams, some of which also play for their own teams.
+def generate_season(config: SeasonConfig, seed: int = 0) -> Dict[str, RowBatch]:
+    rng = np.random.default_rng(seed)
+    n_base_players = rng.integers(6, 9, size=config.n_teams)
+    n_base_total = min(int(n_base_players.sum()), config.n_players)
+    # The last teams may get fewer base players if there are not enough players.
+    base_team_idx = np.repeat(np.arange(config.n_teams), n_base_players)[:n_base_total]
+    n_base_players = np.bincount(base_team_idx, minlength=config.n_teams)
+    base_offsets = np.concatenate([[0], np.cumsum(n_base_players)])
+    team_ids = np.arange(1, config.n_teams + 1) * 10
+    player_ids = rng.permutation(np.arange(1, config.n_players + 1) * 7)
+    # Stronger teams (with lower numbers) play more and better.
+    strength = rng.normal(0, 1, size=config.n_teams) - np.arange(config.n_teams) / config.n_teams
+
+    tables = {
+        "bundle": RowBatch(
+            columns={
+                "first_to_calc": np.array([RELEASE_DATE.toordinal()]),
+                "last_to_calc": np.array([RELEASE_DATE.toordinal()]),
+            }
+        ),
+        "release": RowBatch(columns={"id": np.array([1]), "date": np.array([PREV_RELEASE_DATE.toordinal()])}),
+        "seasons": RowBatch(
+            columns={
+                "id": np.array([1]),
+                "start": np.array([SEASON_START.toordinal()]),
+                "end": np.array([SEASON_END.toordinal()]),
+            }
+        ),
+        "season_rosters": RowBatch(
+            columns={
+                "season_id": np.ones(n_base_total, dtype=np.int64),
+                "team_id": team_ids[base_team_idx],
+                "player_id": player_ids[:n_base_total],
+                "start_date": np.full(n_base_total, SEASON_START.toordinal()),
+                "end_date": np.zeros(n_base_total, dtype=np.int64),
+            },
+            nulls={
+                "start_date": np.zeros(n_base_total, dtype=bool),
+                "end_date": np.ones(n_base_total, dtype=bool),
+            },
+        ),
+    }
+    tables.update(_generate_previous_release(config, rng, team_ids, player_ids, strength))
+    tables.update(_generate_tournaments(config, rng, team_ids, player_ids, strength, base_offsets))
+    return tables
+
+
+def _generate_previous_release(config: SeasonConfig, rng, team_ids, player_ids, strength) -> Dict[str, RowBatch]:
+    n_rated_teams = round(config.n_teams * (1 - config.new_team_share))
+    ratings = np.sort(np.round(6000 + 1500 * strength[:n_rated_teams]).clip(0))[::-1].astype(np.int64)
+    rated_players = player_ids[rng.random(len(player_ids)) < config.rated_share]
+    n_bonuses = rng.integers(1, 8, size=len(rated_players))
+    bonus_players = np.repeat(rated_players, n_bonuses)
+    initial_scores = rng.integers(100, 2500, size=len(bonus_players))
+    weeks = rng.integers(0, 200, size=len(bonus_players))
+    cur_scores = np.rint(initial_scores * 0.99**weeks).astype(np.int64)
+    return {
+        "team_rating": RowBatch(
+            columns={
+                "release_id": np.ones(n_rated_teams, dtype=np.int64),
+                "team_id": team_ids[:n_rated_teams],
+                "rating": ratings,
+                "trb": np.round(ratings * rng.uniform(0.8, 1.1, size=n_rated_teams)).astype(np.int64),
+                "place": np.arange(1, n_rated_teams + 1, dtype=np.float64),
+            }
+        ),
+        "player_rating": RowBatch(
+            columns={
+                "release_id": np.ones(len(rated_players), dtype=np.int64),
+                "player_id": rated_players,
+                "rating": np.bincount(np.repeat(np.arange(len(rated_players)), n_bonuses), weights=cur_scores).astype(
+                    np.int64
+                ),
+            }
+        ),
+        "player_rating_by_tournament": RowBatch(
+            columns={
+                "release_id": np.ones(len(bonus_players), dtype=np.int64),
+                "player_id": bonus_players,
+                "tournament_id": rng.integers(1, 10000, size=len(bonus_players)),
+                "tournament_result_id": np.zeros(len(bonus_players), dtype=np.int64),
+                "initial_score": initial_scores,
+                "weeks_since_tournament": weeks,
+                "cur_score": cur_scores,
+            }
+        ),
+    }
+
+
+def _generate_tournaments(
+    config: SeasonConfig, rng, team_ids, player_ids, strength, base_offsets
+) -> Dict[str, RowBatch]:
+    types = (
+        [models.TRNMT_TYPE_REGULAR] * config.n_regular
+        + [models.TRNMT_TYPE_SYNCHRONOUS] * config.n_synchronous
+        + [models.TRNMT_TYPE_STRICT_SYNCHRONOUS] * config.n_strictly_synchronous
+    )
+    mean_sizes = {
+        models.TRNMT_TYPE_REGULAR: config.regular_size,
+        models.TRNMT_TYPE_SYNCHRONOUS: config.synchronous_size,
+        models.TRNMT_TYPE_STRICT_SYNCHRONOUS: config.strictly_synchronous_size,
+    }
+    end = datetime.datetime.combine(RELEASE_DATE - datetime.timedelta(days=2), datetime.time(12), datetime.timezone.utc)
+    play_weights = np.exp(strength) / np.exp(strength).sum()
+    tournament_ids = np.arange(1, len(types) + 1) + 100000
+    scores = {column: [] for column in ["id", "tournament_id", "team_id", "total", "position"]}
+    renamed = []
+    rosters = {column: [] for column in ["tournament_id", "team_id", "player_id"]}
+    flags = []
+    for tournament_id, typeoft_id in zip(tournament_ids, types):
+        n_teams = int(np.clip(rng.lognormal(np.log(mean_sizes[typeoft_id]), 0.5), 2, len(team_ids)))
+        team_idx = rng.choice(len(team_ids), size=n_teams, replace=False, p=play_weights)
+        totals = rng.binomial(45, 1 / (1 + np.exp(-strength[team_idx] / 2)))
+        scores["id"].append(tournament_id * 10000 + np.arange(n_teams))
+        scores["tournament_id"].append(np.full(n_teams, tournament_id))
+        scores["team_id"].append(team_ids[team_idx])
+        scores["total"].append(totals)
+        # Teams with equal totals share their places, e.g. 2.5 for two teams after the first one.
+        scores["position"].append(pd.Series(-totals).rank(method="average").values)
+        renamed.append(rng.random(n_teams) < 0.05)
+        for i in team_idx:
+            base = player_ids[base_offsets[i] : base_offsets[i + 1]]
+            n_base = min(rng.integers(4, 7), len(base))
+            legionnaires = rng.choice(player_ids, size=rng.integers(0, config.max_legionnaires + 1), replace=False)
+            legionnaires = legionnaires[~np.isin(legionnaires, base)]
+            roster = np.concatenate([rng.choice(base, size=n_base, replace=False), legionnaires])
+            rosters["tournament_id"].append(np.full(len(roster), tournament_id))
+            rosters["team_id"].append(np.full(len(roster), team_ids[i]))
+            rosters["player_id"].append(roster)
+            flags += ["Б"] * n_base + ["Л"] * len(legionnaires)
+
+    scores = {column: np.concatenate(values) for column, values in scores.items()}
+    team_names = np.array([f"Команда {team_id}" for team_id in scores["team_id"]])
+    renamed = np.concatenate(renamed)
+    titles = np.where(renamed, np.char.add(team_names, " 2"), team_names)
+    return {
+        "tournaments": RowBatch(
+            columns={
+                "id": tournament_ids,
+                "title": np.array([f"Турнир {tournament_id}" for tournament_id in tournament_ids]),
+                "typeoft_id": np.array(types, dtype=np.int64),
+                "maii_rating": np.ones(len(types), dtype=bool),
+                "start_datetime": datetime_column([end - datetime.timedelta(days=1)] * len(types)),
+                "end_datetime": datetime_column([end] * len(types)),
+            }
+        ),
+        "team_scores": RowBatch(
+            columns={
+                "id": scores["id"],
+                "tournament_id": scores["tournament_id"],
+                "team_id": scores["team_id"],
+                "title": titles,
+                "total": scores["total"],
+                "position": scores["position"],
+                "team_name": team_names,
+            },
+            nulls={"position": np.zeros(len(titles), dtype=bool)},
+        ),
+        "rosters": RowBatch(
+            columns={**{column: np.concatenate(values) for column, values in rosters.items()}, "flag": np.array(flags)},
+            nulls={"flag": np.zeros(len(flags), dtype=bool)},
+        ),
+    }
+
+
+class _RecordingSource(BundleDataSource):
+    """
+    A bundle source that also keeps every batch of rows written, so they can be written to the DB afterwards.
+    """
+
+    def __init__(self, tables: Dict[str, RowBatch]):
+        super().__init__(tables)
+        self.written: List[Tuple[str, RowBatch]] = []
+
+    def rewrite_rows(self, table: str, rows: RowBatch, key_column: str, key_value: int, diff: bool = False):
+        super().rewrite_rows(table, rows, key_column, key_value, diff)
+        self.written.append((table, rows))
+
+
+# Calculates the release of a synthetic season with main.calc_release (forced, as a bundle has no
+# stored fingerprints anyway) and returns the time of each of its stages. With db, also times writing
+# the written rows with fast_insert into temporary copies of our tables, which are rolled back afterwards.
+def time_release_step(tables: Dict[str, RowBatch], db: bool = False) -> Dict[str, float]:
+    timer = StageTimer()
+    source = _RecordingSource(tables)
+    main.calc_release(RELEASE_DATE, force=True, source=source, timer=timer)
+    if db:
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for table in {table for table, _ in source.written}:
+                    # Own ids instead of the ones from the sequences of our tables, and no foreign keys.
+                    cursor.execute(f"CREATE TEMP TABLE {table} (LIKE {SCHEMA_NAME}.{table} INCLUDING INDEXES)")
+                    cursor.execute(f"ALTER TABLE pg_temp.{table} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY")
+            with timer("fast_insert"):
+                for table, rows in source.written:
+                    fast_insert(table, rows, schema="pg_temp")
+            transaction.set_rollback(True)
+    return timer.seconds
+
+
+# Times the release step on synthetic seasons of given scales of config, repeat times each (keeping
+# the fastest time of every stage), and returns the results ready to be saved as JSON.
+def run_benchmark(
+    scales: List[float], config: SeasonConfig = SeasonConfig(), repeat: int = 1, seed: int = 0, db: bool = False
+) -> dict:
+    results = {
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "runs": [],
+    }
+    for scale in scales:
+        scaled = config.scaled(scale)
+        tables = generate_season(scaled, seed)
+        stages = {}
+        for _ in range(repeat):
+            for stage, seconds in time_release_step(tables, db).items():
+                stages[stage] = min(seconds, stages.get(stage, seconds))
+        run = {
+            "scale": scale,
+            "config": asdict(scaled),
+            "n_tournaments": len(tables["tournaments"]),
+            "n_team_results": len(tables["team_scores"]),
+            "n_roster_entries": len(tables["rosters"]),
+            "stages": stages,
+            "total": sum(stages.values()),
+        }
+        logger.info(
+            f"Scale {scale}: {run['total']:.2f} s in total, "
+            + ", ".join(f"{stage} {seconds:.3f} s" for stage, seconds in stages.items())
+        )
+        results["runs"].append(run)
+    return results
+
+
+# Returns lines comparing the stages of results with the same scales in baseline (both as run_benchmark returns them).
+def compare_results(baseline: dict, results: dict) -> List[str]:
+    baseline_runs = {run["scale"]: run for run in baseline["runs"]}
+    lines = []
+    for run in results["runs"]:
+        baseline_run: Optional[dict] = baseline_runs.get(run["scale"])
+        if baseline_run is None:
+            continue
+        lines.append(f"Scale {run['scale']}:")
+        for stage, seconds in {**run["stages"], "total": run["total"]}.items():
+            baseline_seconds = baseline_run["stages"].get(stage, baseline_run["total"] if stage == "total" else None)
+            if baseline_seconds:
+                lines.append(
+                    f"  {stage}: {baseline_seconds:.3f} s -> {seconds:.3f} s ({seconds / baseline_seconds:.2f}x)"
+                )
+    return lines
+
+
+def save_results(path: str, results: dict):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
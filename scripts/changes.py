@@ -1,13 +1,64 @@
-from typing import Dict, List
+from typing import Dict
 
 import mmh3
+import numpy as np
+import numpy.typing as npt
+
+from .row_batch import RowBatch
 
 _MASK64 = (1 << 64) - 1
 
+# Stands for NULL in place of a column value; any fixed value works as it is mixed with the column salt.
+_NULL_BITS = np.uint64(0x9E3779B97F4A7C15)
+
+
+# splitmix64 finalizer, applied element-wise (uint64 arithmetic wraps around).
+def _mix(values: npt.NDArray) -> npt.NDArray:
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def _column_bits(values: npt.NDArray, is_null: npt.NDArray) -> npt.NDArray:
+    if values.dtype.kind == "f":
+        # + 0.0 turns -0.0 into 0.0: both are written as the same value.
+        bits = (values + 0.0).view(np.uint64)
+    elif values.dtype.kind in "UO":
+        # Strings (None for NULLs in object columns) are replaced with their hashes.
+        bits = np.array(
+            [mmh3.hash64("" if value is None else str(value), signed=False)[0] for value in values], dtype=np.uint64
+        )
+    else:
+        bits = values.astype(np.int64).view(np.uint64)
+    return np.where(is_null, _NULL_BITS, bits)
+
+
+def row_hashes(table: str, batch: RowBatch) -> npt.NDArray:
+    """
+    returns a 64-bit hash of every row of the batch. Each value is salted with its table and column name
+    and mixed, then a row's mixed values are summed and mixed once more.
+    """
+    combined = np.zeros(len(batch), dtype=np.uint64)
+    for column, values in batch.columns.items():
+        salt = np.uint64(mmh3.hash64(f"{table}\x1f{column}", signed=False)[0])
+        combined += _mix(_column_bits(values, batch.is_null(column)) ^ salt)
+    return _mix(combined)
+
+
+def _sum_of_row_hashes(table: str, batch: RowBatch) -> int:
+    return int(np.sum(row_hashes(table, batch), dtype=np.uint64))
+
+
+def _to_signed(value: int) -> int:
+    return value - (1 << 64) if value >= (1 << 63) else value
+
 
-def _row_hash(table: str, row: dict) -> int:
-    payload = table + "\x1f" + "\x1f".join(str(row[column]) for column in row)
-    return mmh3.hash64(payload, signed=False)[0]
+def table_fingerprint(table: str, batch: RowBatch) -> int:
+    """
+    fingerprints the rows of one table (or its part, e.g. results of one tournament); fingerprint()
+    of several tables is the sum of their table fingerprints (modulo 2**64)
+    """
+    return _to_signed(_sum_of_row_hashes(table, batch))
 
 
 # Fingerprints the exact rows that would be written for a release, so every written
@@ -15,9 +66,8 @@ def _row_hash(table: str, row: dict) -> int:
 # hashes are summed (commutative), making the result independent of row order; the
 # table name is folded into each row hash so identical rows in different tables do
 # not collide. The result is mapped into signed 64-bit range for Postgres bigint.
-def fingerprint(table_rows: Dict[str, List[dict]]) -> int:
+def fingerprint(table_rows: Dict[str, RowBatch]) -> int:
     total = 0
-    for table, rows in table_rows.items():
-        for row in rows:
-            total = (total + _row_hash(table, row)) & _MASK64
-    return total - (1 << 64) if total >= (1 << 63) else total
+    for table, batch in table_rows.items():
+        total = (total + _sum_of_row_hashes(table, batch)) & _MASK64
+    return _to_signed(total)
@@ -0,0 +1,729 @@
+import contextlib
+from abc import ABC, abstractmethod
+import datetime
+import decimal
+import logging
+from typing import ContextManager, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from b import models
+
+from . import db_tools
+from . import tools
+from .row_batch import RowBatch
+from .constants import SCHEMA_NAME
+
+logger = logging.getLogger(__name__)
+
+# Columns that identify a row of each table we write.
+ROW_KEYS = {
+    "tournament_result": ["tournament_id", "team_id"],
+    "player_rating": ["release_id", "player_id"],
+    "team_rating": ["release_id", "team_id"],
+    "player_rating_by_tournament": ["release_id", "player_id", "tournament_id", "tournament_result_id"],
+    "tournament_in_release": ["release_id", "tournament_id"],
+}
+
+# Columns that we write as NULL and set later (see DataSource.save_ratings_for_next_release), so updating the changed
+# rows in place must leave their stored values alone.
+COLUMNS_SET_LATER = {
+    "team_rating": ["rating_for_next_release"],
+}
+
+# Columns of the bonuses returned by DataSource.get_player_bonuses; 0 in tournament_id or
+# tournament_result_id means NULL.
+BONUS_COLUMNS = [
+    "player_id",
+    "tournament_id",
+    "tournament_result_id",
+    "initial_score",
+    "weeks_since_tournament",
+    "cur_score",
+]
+
+# (release_id, table_name, tournament_id, hash) of a stored fingerprint, see main.FingerprintKey.
+FingerprintRow = Tuple[Optional[int], str, Optional[int], int]
+
+
+class DataSource(ABC):
+    """
+    Everything the rating engine reads and writes outside of itself. DjangoDataSource works with our DB;
+    BundleDataSource reads an input bundle made by dump_bundle and needs no DB at all.
+    Rows are returned in the shapes our DB returns them, so the engine does not know which source it uses.
+    """
+
+    @abstractmethod
+    def get_release(self, release_date: datetime.date, create: bool = False) -> models.Release:
+        """
+        returns the release for given date; if there is none, creates it if create is set, and raises
+        models.Release.DoesNotExist otherwise
+        """
+
+    @abstractmethod
+    def get_releases(self, first_date: datetime.date, last_date: datetime.date) -> List[models.Release]:
+        pass
+
+    @abstractmethod
+    def get_team_ratings(self, release_id: int) -> List[dict]:
+        """
+        returns team_id, rating, trb and place of all teams in the release, ordered by rating descending
+        """
+
+    @abstractmethod
+    def get_player_ratings(self, release_id: int) -> List[dict]:
+        """
+        returns player_id and rating of all players in the release
+        """
+
+    @abstractmethod
+    def get_player_bonuses(self, release_id: int) -> pd.DataFrame:
+        """
+        returns the top bonuses of players in the release, with BONUS_COLUMNS
+        """
+
+    @abstractmethod
+    def get_old_player_bonuses(self) -> List[dict]:
+        """
+        returns player_id, tournament_id, rating_original and rating_now of the bonuses in the last release
+        of the old rating system
+        """
+
+    @abstractmethod
+    def get_tournament_end_dates(self) -> Dict[int, datetime.date]:
+        pass
+
+    @abstractmethod
+    def get_season(self, release_date: datetime.date) -> models.Season:
+        pass
+
+    @abstractmethod
+    def get_seasons(self, first_date: datetime.date, last_date: datetime.date) -> List[models.Season]:
+        """
+        returns the seasons that overlap [first_date, last_date], ordered by start
+        """
+
+    @abstractmethod
+    def get_season_team_ids(self, season: models.Season) -> Set[int]:
+        """
+        returns ids of teams that have base rosters in the season
+        """
+
+    @abstractmethod
+    def get_base_teams_for_players(self, release_date: datetime.date) -> pd.Series:
+        """
+        returns base team ids of players on given date, indexed by player_id
+        """
+
+    @abstractmethod
+    def get_teams_with_new_players(self, old_release: datetime.date, new_release: datetime.date) -> List[int]:
+        pass
+
+    @abstractmethod
+    def get_base_rosters(self, first_date: datetime.date, last_date: datetime.date) -> List[tuple]:
+        """
+        returns (season_id, team_id, player_id, start_date, end_date) of all base rosters of seasons
+        that overlap [first_date, last_date]
+        """
+
+    @abstractmethod
+    def get_tournament_rows_by_release(
+        self, release_dates: List[datetime.date]
+    ) -> Dict[datetime.date, List[db_tools.TournamentRows]]:
+        """
+        see db_tools.get_tournament_rows_by_release
+        """
+
+    @abstractmethod
+    def get_fingerprints(
+        self, release_ids: List[int], tournament_ids: List[int], table_names: Optional[List[str]] = None
+    ) -> List[FingerprintRow]:
+        """
+        returns fingerprints of given releases and of given tournaments, only of table_names if passed
+        """
+
+    @abstractmethod
+    def rewrite_rows(self, table: str, rows: RowBatch, key_column: str, key_value: int, diff: bool = False):
+        """
+        replaces the rows of table with key_column = key_value with given rows: either deletes them all and
+        inserts the new ones, or (with diff) updates, inserts and deletes only the rows that differ
+        """
+
+    @abstractmethod
+    def save_fingerprints(self, release_id: int, fingerprints: Dict[Tuple[str, Optional[int]], int]):
+        pass
+
+    @abstractmethod
+    def save_ratings_for_next_release(self, release: models.Release, ratings: List[Tuple[int, int]]):
+        """
+        sets team_rating.rating_for_next_release for given (team_id, rating) in the release
+        """
+
+    @abstractmethod
+    def save_release(self, release: models.Release):
+        pass
+
+    @abstractmethod
+    def atomic(self) -> ContextManager:
+        """
+        returns a context in which writes either all succeed or are all undone
+        """
+
+    def close(self):
+        """
+        releases what the current thread holds, e.g. its DB connection; is called by threads other than
+        the main one
+        """
+
+
+class DjangoDataSource(DataSource):
+    def get_release(self, release_date: datetime.date, create: bool = False) -> models.Release:
+        if create:
+            return models.Release.objects.get_or_create(date=release_date)[0]
+        return models.Release.objects.get(date=release_date)
+
+    def get_releases(self, first_date: datetime.date, last_date: datetime.date) -> List[models.Release]:
+        return list(models.Release.objects.filter(date__gte=first_date, date__lte=last_date))
+
+    def get_team_ratings(self, release_id: int) -> List[dict]:
+        return list(
+            models.Team_rating.objects.filter(release_id=release_id)
+            .values("team_id", "rating", "trb", "place")
+            .order_by("-rating")
+        )
+
+    def get_player_ratings(self, release_id: int) -> List[dict]:
+        return list(models.Player_rating.objects.filter(release_id=release_id).values("player_id", "rating"))
+
+    def get_player_bonuses(self, release_id: int) -> pd.DataFrame:
+        return pd.DataFrame.from_records(
+            models.Player_rating_by_tournament.objects.filter(release_id=release_id).values_list(
+                "player_id",
+                Coalesce("tournament_id", 0),
+                Coalesce("tournament_result_id", 0),
+                "initial_score",
+                "weeks_since_tournament",
+                "cur_score",
+            ),
+            columns=BONUS_COLUMNS,
+        )
+
+    def get_old_player_bonuses(self) -> List[dict]:
+        return list(
+            models.Player_rating_by_tournament_old.objects.values(
+                "player_id", "tournament_id", "rating_original", "rating_now"
+            )
+        )
+
+    def get_tournament_end_dates(self) -> Dict[int, datetime.date]:
+        return db_tools.get_tournament_end_dates()
+
+    def get_season(self, release_date: datetime.date) -> models.Season:
+        return db_tools.get_season(release_date)
+
+    def get_seasons(self, first_date: datetime.date, last_date: datetime.date) -> List[models.Season]:
+        return list(models.Season.objects.filter(start__lte=last_date, end__gte=first_date).order_by("start"))
+
+    def get_season_team_ids(self, season: models.Season) -> Set[int]:
+        return set(season.season_roster_set.values_list("team_id", flat=True).distinct())
+
+    def get_base_teams_for_players(self, release_date: datetime.date) -> pd.Series:
+        return db_tools.get_base_teams_for_players(release_date)
+
+    def get_teams_with_new_players(self, old_release: datetime.date, new_release: datetime.date) -> List[int]:
+        return db_tools.get_teams_with_new_players(old_release, new_release)
+
+    def get_base_rosters(self, first_date: datetime.date, last_date: datetime.date) -> List[tuple]:
+        return db_tools.get_base_rosters(first_date, last_date)
+
+    def get_tournament_rows_by_release(
+        self, release_dates: List[datetime.date]
+    ) -> Dict[datetime.date, List[db_tools.TournamentRows]]:
+        return db_tools.get_tournament_rows_by_release(release_dates)
+
+    def get_fingerprints(
+        self, release_ids: List[int], tournament_ids: List[int], table_names: Optional[List[str]] = None
+    ) -> List[FingerprintRow]:
+        fingerprints = models.Fingerprint.objects.filter(
+            Q(release_id__in=release_ids) | Q(tournament_id__in=tournament_ids)
+        )
+        if table_names is not None:
+            fingerprints = fingerprints.filter(table_name__in=table_names)
+        return list(fingerprints.values_list("release_id", "table_name", "tournament_id", "hash"))
+
+    def rewrite_rows(self, table: str, rows: RowBatch, key_column: str, key_value: int, diff: bool = False):
+        where = f"{key_column} = {key_value}"
+        if diff:
+            n_updated, n_inserted, n_deleted = db_tools.write_diff(
+                table, rows, ROW_KEYS[table], where, ignored_columns=COLUMNS_SET_LATER.get(table, [])
+            )
+            logger.debug(f"{table} where {where}: {n_updated} rows updated, {n_inserted} inserted, {n_deleted} deleted")
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f"delete from {SCHEMA_NAME}.{table} where {where}")
+        db_tools.fast_insert(table, rows)
+
+    def save_fingerprints(self, release_id: int, fingerprints: Dict[Tuple[str, Optional[int]], int]):
+        tables = [table for table, tournament_id in fingerprints if tournament_id is None]
+        tournament_ids = [tournament_id for _, tournament_id in fingerprints if tournament_id is not None]
+        models.Fingerprint.objects.filter(release_id=release_id, table_name__in=tables).delete()
+        models.Fingerprint.objects.filter(tournament_id__in=tournament_ids).delete()
+        models.Fingerprint.objects.bulk_create(
+            models.Fingerprint(
+                release_id=None if tournament_id else release_id,
+                tournament_id=tournament_id,
+                table_name=table,
+                hash=hash,
+            )
+            for (table, tournament_id), hash in fingerprints.items()
+        )
+
+    def save_ratings_for_next_release(self, release: models.Release, ratings: List[Tuple[int, int]]):
+        # With --diff, the rows of the release are not rewritten, so the ratings of teams that are not in the list
+        # anymore would stay.
+        release.team_rating_set.exclude(team_id__in=[team_id for team_id, _ in ratings]).exclude(
+            rating_for_next_release=None
+        ).update(rating_for_next_release=None)
+        for team_id, new_rating in ratings:
+            n_changed = release.team_rating_set.filter(team_id=team_id).update(rating_for_next_release=new_rating)
+            if n_changed != 1:
+                logger.warning(
+                    "save_ratings_for_next_release: there is problem with updating team_rating.rating_for_next_release "
+                    + f"for team_id {team_id}, new rating {new_rating}: {n_changed} rows are affected."
+                )
+
+    def save_release(self, release: models.Release):
+        release.save()
+
+    def atomic(self) -> ContextManager:
+        return transaction.atomic()
+
+    def close(self):
+        connection.close()
+
+
+DEFAULT_SOURCE = DjangoDataSource()
+
+
+# Tables of an input bundle. The state tables (STATE_TABLES in main) hold only the release before the
+# first one to calculate; each table is stored as a RowBatch, with dates as ordinals and datetimes as
+# microseconds since the epoch.
+BUNDLE_STATE_TABLES = ("team_rating", "player_rating", "player_rating_by_tournament")
+
+
+def save_bundle(path: str, tables: Dict[str, RowBatch]):
+    arrays = {}
+    for table, rows in tables.items():
+        for column, values in rows.columns.items():
+            arrays[f"{table}.{column}"] = values
+        for column, is_null in rows.nulls.items():
+            arrays[f"{table}.{column}.null"] = is_null
+    with open(path, "wb") as f:
+        np.savez_compressed(f, **arrays)
+
+
+def load_bundle(path: str) -> Dict[str, RowBatch]:
+    tables = {}
+    with np.load(path, allow_pickle=False) as arrays:
+        for name in arrays.files:
+            table, column, *is_null = name.split(".")
+            rows = tables.setdefault(table, RowBatch(columns={}))
+            (rows.nulls if is_null else rows.columns)[column] = arrays[name]
+    return tables
+
+
+def _date_column(dates: List[Optional[datetime.date]]) -> Tuple[npt.NDArray, npt.NDArray]:
+    return (
+        np.array([date.toordinal() if date else 0 for date in dates], dtype=np.int64),
+        np.array([date is None for date in dates], dtype=bool),
+    )
+
+
+def _to_date(ordinal: int, is_null: bool = False) -> Optional[datetime.date]:
+    return None if is_null else datetime.date.fromordinal(int(ordinal))
+
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+# Bundles store datetimes (aware ones) as microseconds since the epoch; e.g. for tournaments.start_datetime.
+def datetime_column(datetimes: List[datetime.datetime]) -> npt.NDArray:
+    return np.array([(value - _EPOCH) // datetime.timedelta(microseconds=1) for value in datetimes], dtype=np.int64)
+
+
+def _to_datetime(microseconds: int) -> datetime.datetime:
+    return _EPOCH + datetime.timedelta(microseconds=int(microseconds))
+
+
+def _to_decimal(value: float, is_null: bool = False) -> Optional[decimal.Decimal]:
+    return None if is_null else decimal.Decimal(f"{value:.1f}")
+
+
+def _rows_from_values(values: Iterable[tuple], columns: Dict[str, type], nullable: Iterable[str] = ()) -> RowBatch:
+    values = list(values)
+    by_column = list(zip(*values)) if values else [()] * len(columns)
+    rows = RowBatch(columns={})
+    for (column, dtype), column_values in zip(columns.items(), by_column):
+        if column in nullable:
+            rows.nulls[column] = np.array([value is None for value in column_values], dtype=bool)
+            empty = "" if dtype is str else 0
+            column_values = [empty if value is None else value for value in column_values]
+        rows.columns[column] = np.array(column_values, dtype=dtype)
+    return rows
+
+
+# Exports everything calc_all_releases(first_to_calc, last_to_calc) reads from our DB into a bundle
+# for BundleDataSource. Stored fingerprints and hashes of releases are not exported: a calculation
+# from a bundle always calculates and "writes" every release.
+def dump_bundle(path: str, first_to_calc: datetime.date, last_to_calc: datetime.date):
+    first_release_date = tools.get_prev_release_date(first_to_calc)
+    last_release_date = last_to_calc + datetime.timedelta(days=7)
+    first_release = models.Release.objects.get(date=first_release_date)
+    tables = {
+        "bundle": RowBatch(
+            columns={
+                "first_to_calc": np.array([first_to_calc.toordinal()], dtype=np.int64),
+                "last_to_calc": np.array([last_to_calc.toordinal()], dtype=np.int64),
+            }
+        )
+    }
+
+    releases = list(
+        models.Release.objects.filter(date__gte=first_release_date, date__lte=last_release_date).values_list(
+            "id", "date"
+        )
+    )
+    tables["release"] = _rows_from_values(
+        [(release_id, date.toordinal()) for release_id, date in releases], {"id": np.int64, "date": np.int64}
+    )
+
+    tables["team_rating"] = _rows_from_values(
+        models.Team_rating.objects.filter(release=first_release).values_list(
+            "release_id", "team_id", "rating", "trb", "place"
+        ),
+        {"release_id": np.int64, "team_id": np.int64, "rating": np.int64, "trb": np.int64, "place": np.float64},
+        nullable=["place"],
+    )
+    tables["player_rating"] = _rows_from_values(
+        models.Player_rating.objects.filter(release=first_release).values_list("release_id", "player_id", "rating"),
+        {"release_id": np.int64, "player_id": np.int64, "rating": np.int64},
+    )
+    bonuses = DEFAULT_SOURCE.get_player_bonuses(first_release.id)
+    tables["player_rating_by_tournament"] = RowBatch(
+        columns={
+            "release_id": np.full(len(bonuses), first_release.id, dtype=np.int64),
+            **{column: bonuses[column].to_numpy(dtype=np.int64) for column in BONUS_COLUMNS},
+        }
+    )
+    if first_release_date == tools.LAST_OLD_RELEASE:
+        old_bonuses = [bonus for bonus in DEFAULT_SOURCE.get_old_player_bonuses() if bonus["player_id"] is not None]
+        tables["player_rating_by_tournament_old"] = _rows_from_values(
+            [tuple(bonus.values()) for bonus in old_bonuses],
+            {"player_id": np.int64, "tournament_id": np.int64, "rating_original": np.int64, "rating_now": np.int64},
+        )
+        old_tournament_ids = {bonus["tournament_id"] for bonus in old_bonuses}
+        tables["tournament_end_date"] = _rows_from_values(
+            [
+                (tournament_id, end_date.toordinal())
+                for tournament_id, end_date in db_tools.get_tournament_end_dates().items()
+                if tournament_id in old_tournament_ids
+            ],
+            {"id": np.int64, "end_date": np.int64},
+        )
+
+    tournaments_qs = models.Tournament.objects.filter(
+        end_datetime__date__gt=first_release_date, end_datetime__date__lte=last_release_date
+    ).order_by("pk")
+    tournaments = list(tournaments_qs)
+    tables["tournaments"] = RowBatch(
+        columns={
+            "id": np.array([tournament.id for tournament in tournaments], dtype=np.int64),
+            "title": np.array([tournament.title for tournament in tournaments], dtype=str),
+            "typeoft_id": np.array([tournament.typeoft_id for tournament in tournaments], dtype=np.int64),
+            "maii_rating": np.array([tournament.maii_rating for tournament in tournaments], dtype=bool),
+            "start_datetime": datetime_column([tournament.start_datetime for tournament in tournaments]),
+            "end_datetime": datetime_column([tournament.end_datetime for tournament in tournaments]),
+        }
+    )
+    team_score_columns = {
+        "id": np.int64,
+        "tournament_id": np.int64,
+        "team_id": np.int64,
+        "title": str,
+        "total": np.int64,
+        "position": np.float64,
+        "team_name": str,
+    }
+    tables["team_scores"] = _rows_from_values(
+        (
+            tuple(team_score[column] for column in team_score_columns)
+            for team_score in db_tools.get_team_scores(tournaments_qs)
+        ),
+        team_score_columns,
+        nullable=["title", "total", "position", "team_name"],
+    )
+    roster_columns = {"tournament_id": np.int64, "team_id": np.int64, "player_id": np.int64, "flag": str}
+    tables["rosters"] = _rows_from_values(
+        (tuple(roster[column] for column in roster_columns) for roster in db_tools.get_rosters(tournaments_qs)),
+        roster_columns,
+        nullable=["flag"],
+    )
+
+    # Base rosters are looked at up to 180 days before a release, see main.teams_to_dump.
+    first_season_date = first_release_date - datetime.timedelta(days=180)
+    seasons = list(
+        models.Season.objects.filter(start__lte=last_release_date, end__gte=first_season_date).values_list(
+            "id", "start", "end"
+        )
+    )
+    tables["seasons"] = _rows_from_values(
+        [(season_id, start.toordinal(), end.toordinal()) for season_id, start, end in seasons],
+        {"id": np.int64, "start": np.int64, "end": np.int64},
+    )
+    base_rosters = list(
+        models.Season_roster.objects.filter(season_id__in=[season[0] for season in seasons])
+        .values_list("season_id", "team_id", "player_id", "start_date", "end_date")
+        .order_by("pk")
+    )
+    start_dates, start_is_null = _date_column([base_roster[3] for base_roster in base_rosters])
+    end_dates, end_is_null = _date_column([base_roster[4] for base_roster in base_rosters])
+    tables["season_rosters"] = RowBatch(
+        columns={
+            **{
+                column: np.array([base_roster[i] for base_roster in base_rosters], dtype=np.int64)
+                for i, column in enumerate(["season_id", "team_id", "player_id"])
+            },
+            "start_date": start_dates,
+            "end_date": end_dates,
+        },
+        nulls={"start_date": start_is_null, "end_date": end_is_null},
+    )
+    save_bundle(path, tables)
+    logger.info(
+        f"Dumped inputs of releases from {first_to_calc} to {last_to_calc}: {len(tournaments)} tournaments, "
+        f"{len(tables['rosters'])} roster entries, {len(tables['season_rosters'])} base roster entries"
+    )
+
+
+class BundleDataSource(DataSource):
+    """
+    Reads the inputs of releases from a bundle made by dump_bundle (or by benchmark.generate_season),
+    without a DB. Writes are kept in
+    memory only as far as the calculation reads them back: releases, fingerprints, and the state
+    tables of the last written release.
+    """
+
+    def __init__(self, tables: Dict[str, RowBatch]):
+        self.tables = tables
+        bundle = self.tables["bundle"].columns
+        self.first_to_calc = datetime.date.fromordinal(int(bundle["first_to_calc"][0]))
+        self.last_to_calc = datetime.date.fromordinal(int(bundle["last_to_calc"][0]))
+        releases = self.tables["release"].columns
+        self.releases = {
+            datetime.date.fromordinal(int(date)): models.Release(
+                id=int(release_id), date=datetime.date.fromordinal(int(date))
+            )
+            for release_id, date in zip(releases["id"], releases["date"])
+        }
+        self.next_release_id = int(releases["id"].max(initial=0)) + 1
+        self.fingerprints: Dict[Tuple[Optional[int], str, Optional[int]], int] = {}
+        # table -> (release_id, rows) of the last release written into each state table.
+        self.written_state: Dict[str, Tuple[int, RowBatch]] = {}
+
+    @classmethod
+    def load(cls, path: str) -> "BundleDataSource":
+        return cls(load_bundle(path))
+
+    def get_release(self, release_date: datetime.date, create: bool = False) -> models.Release:
+        if release_date not in self.releases:
+            if not create:
+                raise models.Release.DoesNotExist(f"There is no release for {release_date} in the bundle")
+            self.releases[release_date] = models.Release(id=self.next_release_id, date=release_date)
+            self.next_release_id += 1
+        return self.releases[release_date]
+
+    def get_releases(self, first_date: datetime.date, last_date: datetime.date) -> List[models.Release]:
+        return [release for date, release in self.releases.items() if first_date <= date <= last_date]
+
+    def _state_rows(self, table: str, release_id: int) -> RowBatch:
+        written_release_id, rows = self.written_state.get(table, (None, None))
+        if written_release_id == release_id:
+            return rows
+        rows = self.tables[table]
+        is_in_release = rows.columns["release_id"] == release_id
+        if not is_in_release.any():
+            raise ValueError(
+                f"{table} of release {release_id} is neither in the bundle nor calculated just before; "
+                "calculations from a bundle must start from its first release"
+            )
+        return rows.take(np.flatnonzero(is_in_release))
+
+    def get_team_ratings(self, release_id: int) -> List[dict]:
+        rows = self._state_rows("team_rating", release_id)
+        order = np.argsort(-rows.columns["rating"], kind="stable")
+        is_null = rows.is_null("place")
+        return [
+            {
+                "team_id": int(rows.columns["team_id"][i]),
+                "rating": int(rows.columns["rating"][i]),
+                "trb": int(rows.columns["trb"][i]),
+                "place": _to_decimal(rows.columns["place"][i], is_null[i]),
+            }
+            for i in order
+        ]
+
+    def get_player_ratings(self, release_id: int) -> List[dict]:
+        rows = self._state_rows("player_rating", release_id)
+        return [
+            {"player_id": int(player_id), "rating": int(rating)}
+            for player_id, rating in zip(rows.columns["player_id"], rows.columns["rating"])
+        ]
+
+    def get_player_bonuses(self, release_id: int) -> pd.DataFrame:
+        rows = self._state_rows("player_rating_by_tournament", release_id)
+        return pd.DataFrame({column: rows.columns[column] for column in BONUS_COLUMNS}, columns=BONUS_COLUMNS)
+
+    def get_old_player_bonuses(self) -> List[dict]:
+        return self.tables["player_rating_by_tournament_old"].to_dicts()
+
+    def get_tournament_end_dates(self) -> Dict[int, datetime.date]:
+        rows = self.tables["tournament_end_date"].columns
+        return {int(tournament_id): _to_date(end_date) for tournament_id, end_date in zip(rows["id"], rows["end_date"])}
+
+    def get_season(self, release_date: datetime.date) -> models.Season:
+        seasons = self.tables["seasons"].columns
+        ordinal = release_date.toordinal()
+        matching = np.flatnonzero((seasons["start"] <= ordinal) & (seasons["end"] >= ordinal))
+        if len(matching) != 1:
+            raise models.Season.DoesNotExist(f"There is no single season for {release_date} in the bundle")
+        i = matching[0]
+        return models.Season(
+            id=int(seasons["id"][i]), start=_to_date(seasons["start"][i]), end=_to_date(seasons["end"][i])
+        )
+
+    def get_seasons(self, first_date: datetime.date, last_date: datetime.date) -> List[models.Season]:
+        seasons = self.tables["seasons"].columns
+        matching = np.flatnonzero(
+            (seasons["start"] <= last_date.toordinal()) & (seasons["end"] >= first_date.toordinal())
+        )
+        return [
+            models.Season(
+                id=int(seasons["id"][i]), start=_to_date(seasons["start"][i]), end=_to_date(seasons["end"][i])
+            )
+            for i in matching[np.argsort(seasons["start"][matching], kind="stable")]
+        ]
+
+    def get_season_team_ids(self, season: models.Season) -> Set[int]:
+        rosters = self.tables["season_rosters"].columns
+        return set(rosters["team_id"][rosters["season_id"] == season.id].tolist())
+
+    def get_base_teams_for_players(self, release_date: datetime.date) -> pd.Series:
+        season = self.get_season(release_date)
+        rosters = self.tables["season_rosters"]
+        ordinal = release_date.toordinal()
+        start_is_null, end_is_null = rosters.is_null("start_date"), rosters.is_null("end_date")
+        is_current = (
+            (rosters.columns["season_id"] == season.id)
+            & ~start_is_null
+            & (rosters.columns["start_date"] <= ordinal)
+            & (end_is_null | (rosters.columns["end_date"] > ordinal))
+        )
+        bs_pd = pd.DataFrame(
+            {
+                "player_id": rosters.columns["player_id"][is_current],
+                "base_team_id": rosters.columns["team_id"][is_current],
+                "start_date": rosters.columns["start_date"][is_current],
+            }
+        )
+        return bs_pd.sort_values("start_date").groupby("player_id").last().base_team_id.astype("Int64")
+
+    def get_teams_with_new_players(self, old_release: datetime.date, new_release: datetime.date) -> List[int]:
+        rosters = self.tables["season_rosters"]
+        start_dates = rosters.columns["start_date"]
+        is_new = (
+            ~rosters.is_null("start_date")
+            & (start_dates > old_release.toordinal())
+            & (start_dates <= new_release.toordinal())
+        )
+        return list(dict.fromkeys(rosters.columns["team_id"][is_new].tolist()))
+
+    def get_base_rosters(self, first_date: datetime.date, last_date: datetime.date) -> List[tuple]:
+        seasons = self.tables["seasons"].columns
+        season_ids = seasons["id"][
+            (seasons["start"] <= last_date.toordinal()) & (seasons["end"] >= first_date.toordinal())
+        ]
+        rosters = self.tables["season_rosters"]
+        start_is_null, end_is_null = rosters.is_null("start_date"), rosters.is_null("end_date")
+        return [
+            (
+                int(rosters.columns["season_id"][i]),
+                int(rosters.columns["team_id"][i]),
+                int(rosters.columns["player_id"][i]),
+                _to_date(rosters.columns["start_date"][i], start_is_null[i]),
+                _to_date(rosters.columns["end_date"][i], end_is_null[i]),
+            )
+            for i in np.flatnonzero(np.isin(rosters.columns["season_id"], season_ids))
+        ]
+
+    def get_tournament_rows_by_release(
+        self, release_dates: List[datetime.date]
+    ) -> Dict[datetime.date, List[db_tools.TournamentRows]]:
+        if release_dates[0] < self.first_to_calc or release_dates[-1] > self.last_to_calc + datetime.timedelta(days=7):
+            raise ValueError(
+                f"Releases from {release_dates[0]} to {release_dates[-1]} are not all in the bundle, which has "
+                f"releases from {self.first_to_calc} to {self.last_to_calc}"
+            )
+        columns = self.tables["tournaments"].columns
+        tournaments = []
+        for i in range(len(columns["id"])):
+            tournament = models.Tournament(
+                id=int(columns["id"][i]),
+                title=str(columns["title"][i]),
+                typeoft_id=int(columns["typeoft_id"][i]),
+                maii_rating=bool(columns["maii_rating"][i]),
+                start_datetime=_to_datetime(columns["start_datetime"][i]),
+                end_datetime=_to_datetime(columns["end_datetime"][i]),
+            )
+            end_date = timezone.localtime(tournament.end_datetime).date()
+            if tools.get_prev_release_date(release_dates[0]) < end_date <= release_dates[-1]:
+                tournaments.append(tournament)
+        tournament_ids = [tournament.id for tournament in tournaments]
+
+        team_scores = self.tables["team_scores"]
+        team_scores = team_scores.take(np.flatnonzero(np.isin(team_scores.columns["tournament_id"], tournament_ids)))
+        rosters = self.tables["rosters"]
+        rosters = rosters.take(np.flatnonzero(np.isin(rosters.columns["tournament_id"], tournament_ids)))
+        return db_tools.group_tournament_rows(release_dates, tournaments, team_scores.to_dicts(), rosters.to_dicts())
+
+    def get_fingerprints(
+        self, release_ids: List[int], tournament_ids: List[int], table_names: Optional[List[str]] = None
+    ) -> List[FingerprintRow]:
+        return [
+            (release_id, table, tournament_id, hash)
+            for (release_id, table, tournament_id), hash in self.fingerprints.items()
+            if (release_id in release_ids or tournament_id in tournament_ids)
+            and (table_names is None or table in table_names)
+        ]
+
+    def rewrite_rows(self, table: str, rows: RowBatch, key_column: str, key_value: int, diff: bool = False):
+        if table in BUNDLE_STATE_TABLES:
+            self.written_state[table] = (key_value, rows)
+
+    def save_fingerprints(self, release_id: int, fingerprints: Dict[Tuple[str, Optional[int]], int]):
+        for (table, tournament_id), hash in fingerprints.items():
+            self.fingerprints[(None if tournament_id else release_id, table, tournament_id)] = hash
+
+    def save_ratings_for_next_release(self, release: models.Release, ratings: List[Tuple[int, int]]):
+        pass
+
+    def save_release(self, release: models.Release):
+        self.releases[release.date] = release
+
+    def atomic(self) -> ContextManager:
+        return contextlib.nullcontext()
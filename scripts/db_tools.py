@@ -1,46 +1,180 @@
+import bisect
 import datetime
-from typing import Dict, List, Iterable
+import io
+from dataclasses import dataclass, field
+from typing import Dict, List, Iterable, Optional, Sequence, Tuple
 from django.db.models import F, Q
+from django.apps import apps
 from django.db import connection
+from django.utils import timezone
 import logging
+import numpy as np
+import numpy.typing as npt
 import pandas as pd
 from b import models
+from scripts import tools
+from .row_batch import RowBatch
 from .constants import SCHEMA_NAME
 
 logger = logging.getLogger(__name__)
 
 
-def fast_insert(table: str, data: Iterable[dict], batch_size: int = 5000):
+def fast_insert(
+    table: str, data: RowBatch, batch_size: int = 5000, use_copy: Optional[bool] = None, schema: str = SCHEMA_NAME
+):
     """
-    Inserts data from all dicts in an iterable.
+    Inserts all rows of a batch. On Postgres rows are streamed with COPY; otherwise (or if use_copy is False)
+    they are inserted with INSERT statements.
     :param table: table to be updated
-    :param data: iterable of uniform dicts
-    :param batch_size: max number of rows to be inserted in a single query
+    :param data: rows to be inserted
+    :param batch_size: max number of rows to be inserted in a single INSERT query
+    :param use_copy: whether to use COPY; by default, whenever the DB driver supports it
+    :param schema: schema of the table
     :return:
     """
-    data_iter = iter(data)
-
-    try:
-        first_item = next(data_iter)
-    except StopIteration:
+    if not len(data):
         return
 
-    columns = first_item.keys()
-    columns_joined = ", ".join(columns)
+    with connection.cursor() as cursor:
+        if use_copy is None:
+            use_copy = connection.vendor == "postgresql" and hasattr(cursor.cursor, "copy_expert")
+        if use_copy:
+            _copy_rows(cursor, f"{schema}.{table}", data)
+        else:
+            _insert_rows(cursor, f"{schema}.{table}", data, batch_size)
+
+
+def _copy_rows(cursor, table: str, data: RowBatch):
+    # All our values are numbers or booleans, so the COPY text format needs no escaping.
+    texts = [
+        _column_texts(values, data.is_null(column), null="\\N", true="t", false="f")
+        for column, values in data.columns.items()
+    ]
+    buffer = io.StringIO()
+    buffer.writelines("\t".join(row) + "\n" for row in zip(*texts))
+    buffer.seek(0)
+    cursor.cursor.copy_expert(f"COPY {table} ({', '.join(data.columns)}) FROM STDIN", buffer)
+
+
+def _insert_rows(cursor, table: str, data: RowBatch, batch_size: int):
+    columns_joined = ", ".join(data.columns)
+    texts = [_column_texts(values, data.is_null(column)) for column, values in data.columns.items()]
+    for start in range(0, len(data), batch_size):
+        values = ",\n".join(
+            f"({','.join(row)})" for row in zip(*(column[start : start + batch_size] for column in texts))
+        )
+        cursor.execute(f"INSERT INTO {table} ({columns_joined}) VALUES {values}")
+
 
+def _column_texts(
+    values: npt.NDArray, is_null: npt.NDArray, null: str = "NULL", true: str = "TRUE", false: str = "FALSE"
+) -> List[str]:
+    if values.dtype == bool:
+        texts = np.where(values, true, false)
+    else:
+        texts = values.astype(str)
+    return np.where(is_null, null, texts).tolist()
+
+
+def write_diff(
+    table: str,
+    data: RowBatch,
+    key_columns: List[str],
+    where: str,
+    batch_size: int = 5000,
+    ignored_columns: Sequence[str] = (),
+) -> Tuple[int, int, int]:
+    """
+    Makes the rows of table that satisfy where equal to data with as few changes as possible: rows are matched
+    by key_columns, changed ones are updated, missing ones are inserted and the rest are deleted.
+    :param table: table to be updated
+    :param data: new rows; each of them must satisfy where
+    :param key_columns: columns that identify a row within where
+    :param where: SQL condition selecting the stored rows to be replaced with data
+    :param batch_size: max number of rows in a single UPDATE or DELETE query
+    :param ignored_columns: columns that are written only into inserted rows; stored values of them are
+        neither compared nor updated, e.g. as they are set by someone else later
+    :return: numbers of updated, inserted and deleted rows
+    """
+    stored_ids, stored = _read_rows(table, data, where)
+    matched = pd.merge(
+        _key_frame(stored, key_columns).reset_index(names="stored_row"),
+        _key_frame(data, key_columns).reset_index(names="new_row"),
+        on=key_columns,
+        how="outer",
+    )
+    both = matched.dropna()
+    stored_rows = both["stored_row"].values.astype(np.int64)
+    new_rows = both["new_row"].values.astype(np.int64)
+    is_changed = np.zeros(len(both), dtype=bool)
+    compared = RowBatch(
+        columns={column: values for column, values in data.columns.items() if column not in ignored_columns},
+        nulls={column: is_null for column, is_null in data.nulls.items() if column not in ignored_columns},
+    )
+    for column, values in compared.columns.items():
+        stored_is_null, new_is_null = stored.is_null(column)[stored_rows], data.is_null(column)[new_rows]
+        is_changed |= (stored_is_null != new_is_null) | (
+            ~new_is_null & (stored.columns[column][stored_rows] != values[new_rows])
+        )
+    to_update = compared.take(new_rows[is_changed])
+    to_insert = data.take(matched.loc[matched["stored_row"].isna(), "new_row"].values.astype(np.int64))
+    to_delete = stored_ids[matched.loc[matched["new_row"].isna(), "stored_row"].values.astype(np.int64)]
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(to_delete), batch_size):
+            ids = ",".join(map(str, to_delete[start : start + batch_size]))
+            cursor.execute(f"DELETE FROM {SCHEMA_NAME}.{table} WHERE id IN ({ids})")
+        _update_rows(cursor, table, stored_ids[stored_rows[is_changed]], to_update, batch_size)
+    fast_insert(table, to_insert, batch_size)
+    return len(to_update), len(to_insert), len(to_delete)
+
+
+def _read_rows(table: str, like: RowBatch, where: str) -> Tuple[npt.NDArray, RowBatch]:
+    """
+    reads ids and the columns of like from the rows of table that satisfy where; values get the dtypes of like
+    """
     with connection.cursor() as cursor:
-        batch = [first_item]
-        for row in data_iter:
-            batch.append(row)
-            if len(batch) >= batch_size:
-                values = ",\n".join(f"({','.join(str(row[column]) for column in columns)})" for row in batch)
-                cursor.execute(f"INSERT INTO {SCHEMA_NAME}.{table} ({columns_joined}) VALUES {values}")
-                batch = []
+        cursor.execute(f"SELECT id, {', '.join(like.columns)} FROM {SCHEMA_NAME}.{table} WHERE {where}")
+        rows = cursor.fetchall()
+    stored_columns = list(zip(*rows)) if rows else [()] * (len(like.columns) + 1)
+    ids = np.array(stored_columns[0], dtype=np.int64)
+    columns, nulls = {}, {}
+    for (column, values), stored_values in zip(like.columns.items(), stored_columns[1:]):
+        nulls[column] = np.array([value is None for value in stored_values], dtype=bool)
+        columns[column] = np.array([0 if value is None else value for value in stored_values], dtype=values.dtype)
+    return ids, RowBatch(columns=columns, nulls=nulls)
 
-        # Process remaining rows in the final batch
-        if batch:
-            values = ",\n".join(f"({','.join(str(row[column]) for column in columns)})" for row in batch)
-            cursor.execute(f"INSERT INTO {SCHEMA_NAME}.{table} ({columns_joined}) VALUES {values}")
+
+# Keys with NULLs replaced by -1 (all our ids are positive), so that they can be matched by pd.merge.
+def _key_frame(data: RowBatch, key_columns: List[str]) -> pd.DataFrame:
+    return pd.DataFrame(
+        {column: np.where(data.is_null(column), -1, data.columns[column]) for column in key_columns},
+        index=pd.RangeIndex(len(data)),
+    )
+
+
+def _update_rows(cursor, table: str, ids: npt.NDArray, data: RowBatch, batch_size: int):
+    if not len(data):
+        return
+    column_types = _column_types(table)
+    # Values in VALUES may be all NULL and then have no type in Postgres, so they are cast explicitly.
+    assignments = ", ".join(f"{column} = CAST(v.{column} AS {column_types[column]})" for column in data.columns)
+    texts = [_column_texts(ids, np.zeros(len(ids), dtype=bool))] + [
+        _column_texts(values, data.is_null(column)) for column, values in data.columns.items()
+    ]
+    for start in range(0, len(data), batch_size):
+        values = ",\n".join(
+            f"({','.join(row)})" for row in zip(*(column[start : start + batch_size] for column in texts))
+        )
+        cursor.execute(
+            f"WITH v (id, {', '.join(data.columns)}) AS (VALUES {values}) "
+            f"UPDATE {SCHEMA_NAME}.{table} AS t SET {assignments} FROM v WHERE t.id = v.id"
+        )
+
+
+def _column_types(table: str) -> Dict[str, str]:
+    model = next(model for model in apps.get_models() if model._meta.db_table == table)
+    return {field.column: field.db_type(connection) for field in model._meta.concrete_fields}
 
 
 def get_season(release_date: datetime.date) -> models.Season:
@@ -69,8 +203,97 @@ def get_teams_with_new_players(old_release: datetime.date, new_release: datetime
     )
 
 
+def get_base_rosters(first_date: datetime.date, last_date: datetime.date) -> List[tuple]:
+    """
+    returns (season_id, team_id, player_id, start_date, end_date) of all base rosters of seasons
+    that overlap [first_date, last_date]
+    """
+    return list(
+        models.Season_roster.objects.filter(season__start__lte=last_date, season__end__gte=first_date)
+        .values_list("season_id", "team_id", "player_id", "start_date", "end_date")
+        .order_by("pk")
+    )
+
+
 def get_tournament_end_dates() -> Dict[int, datetime.date]:
     return {
         tournament["pk"]: tournament["end_datetime"].date()
         for tournament in models.Tournament.objects.all().values("pk", "end_datetime")
     }
+
+
+# Raw DB rows that trnmt.Tournament needs to be built: the tournament itself, its results and its rosters.
+@dataclass
+class TournamentRows:
+    tournament: models.Tournament
+    team_scores: List[dict] = field(default_factory=list)
+    roster: List[dict] = field(default_factory=list)
+
+
+def get_team_scores(tournaments_qs) -> Iterable[dict]:
+    return (
+        models.Team_score.objects.filter(tournament__in=tournaments_qs)
+        .values("id", "tournament_id", "team_id", "title", "total", "position", team_name=F("team__title"))
+        .order_by("tournament_id", "pk")
+    )
+
+
+def get_rosters(tournaments_qs) -> Iterable[dict]:
+    return (
+        models.Roster.objects.filter(tournament__in=tournaments_qs)
+        .values("tournament_id", "team_id", "player_id", "flag")
+        .order_by("tournament_id", "pk")
+    )
+
+
+def get_tournament_rows_by_release(release_dates: List[datetime.date]) -> Dict[datetime.date, List[TournamentRows]]:
+    """
+    Loads all tournaments (with results and rosters) for given consecutive releases in three queries.
+    A tournament belongs to the first release that is on or after its end date, i.e. release R gets
+    the tournaments that end in (previous release, R], as calc_release always did.
+    :param release_dates: sorted consecutive release dates
+    :return: dict release date -> rows of its tournaments, ordered by tournament id
+    """
+    tournaments_qs = models.Tournament.objects.filter(
+        end_datetime__date__gt=tools.get_prev_release_date(release_dates[0]),
+        end_datetime__date__lte=release_dates[-1],
+    )
+    return group_tournament_rows(
+        release_dates, tournaments_qs.order_by("pk"), get_team_scores(tournaments_qs), get_rosters(tournaments_qs)
+    )
+
+
+def group_tournament_rows(
+    release_dates: List[datetime.date],
+    tournaments: Iterable[models.Tournament],
+    team_scores: Iterable[dict],
+    rosters: Iterable[dict],
+) -> Dict[datetime.date, List[TournamentRows]]:
+    """
+    Groups tournaments that end between the release before release_dates[0] and release_dates[-1] (in our
+    time zone), with their results and rosters, by release, as get_tournament_rows_by_release returns them.
+    :param tournaments: ordered by id
+    """
+    rows_by_id = {}
+    res = {release_date: [] for release_date in release_dates}
+    for tournament in tournaments:
+        # The same date as the end_datetime__date lookup above uses, i.e. in our time zone.
+        end_date = timezone.localtime(tournament.end_datetime).date()
+        release_date = release_dates[bisect.bisect_left(release_dates, end_date)]
+        # Before the first new release, we only count tournaments from the MAII rating.
+        if release_date <= tools.FIRST_NEW_RELEASE and not tournament.maii_rating:
+            continue
+        rows_by_id[tournament.id] = TournamentRows(tournament=tournament)
+        res[release_date].append(rows_by_id[tournament.id])
+
+    for team_score in team_scores:
+        if team_score["tournament_id"] in rows_by_id:
+            rows_by_id[team_score["tournament_id"]].team_scores.append(team_score)
+    for roster_entry in rosters:
+        if roster_entry["tournament_id"] in rows_by_id:
+            rows_by_id[roster_entry["tournament_id"]].roster.append(roster_entry)
+    logger.debug(
+        f"Loaded {len(rows_by_id)} tournaments for {len(release_dates)} releases "
+        f"from {release_dates[0]} to {release_dates[-1]}"
+    )
+    return res
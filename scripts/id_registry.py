@@ -0,0 +1,44 @@
+import numpy as np
+import numpy.typing as npt
+
+
+class IdRegistry:
+    """
+    Maps sparse ids from our DB (of players or of teams) to dense numbers 0, 1, 2, ... in the order
+    they are registered (ids registered at once are numbered in increasing order). One registry is
+    kept for a chain of releases, so an id keeps its number from release to release, and anything
+    indexed by these numbers can live in plain arrays.
+    """
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        # self.ids sorted, and the dense numbers of the sorted ids.
+        self._sorted_ids = np.empty(0, dtype=np.int64)
+        self._sorted_numbers = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, ids: npt.ArrayLike) -> npt.NDArray:
+        """
+        returns the dense numbers of ids, -1 for ids that are not registered
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self._sorted_ids, ids), len(self) - 1)
+        return np.where(self._sorted_ids[positions] == ids, self._sorted_numbers[positions], -1)
+
+    def register(self, ids: npt.ArrayLike) -> npt.NDArray:
+        """
+        registers new ids and returns the dense numbers of all ids
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        new_ids = np.setdiff1d(ids, self._sorted_ids)
+        if len(new_ids):
+            new_numbers = np.arange(len(self), len(self) + len(new_ids))
+            positions = np.searchsorted(self._sorted_ids, new_ids)
+            self.ids = np.concatenate([self.ids, new_ids])
+            self._sorted_ids = np.insert(self._sorted_ids, positions, new_ids)
+            self._sorted_numbers = np.insert(self._sorted_numbers, positions, new_numbers)
+        return self.lookup(ids)
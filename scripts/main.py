@@ -4,20 +4,27 @@ import sys
 import pandas as pd
 import numpy as np
 import logging
+from dataclasses import dataclass
 from django.utils import timezone
-from typing import Iterable, List, Tuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 from dotenv import load_dotenv
-from django.db import connection, transaction
 
 from b import models
 
 from . import db_tools
+from .data_sources import DataSource, DEFAULT_SOURCE
 from . import tools
+from . import parallel
 from . import tournament as trnmt
 from .teams import TeamRating
-from .players import PlayerRating
-from .changes import fingerprint
-from .constants import SCHEMA_NAME
+from .players import PlayerRating, TechRatingMemo
+from .player_bonuses import PlayerBonuses
+from .id_registry import IdRegistry
+from .snapshots import SnapshotStore
+from .changes import fingerprint, table_fingerprint
+from .timing import StageTimer, log_release_stages, profiled
+from .row_batch import RowBatch, integer_column, numeric_column
 
 load_dotenv()
 
@@ -25,45 +32,81 @@ logger = logging.getLogger(__name__)
 
 decimal.getcontext().prec = 1
 
+# How many releases calc_all_releases loads tournaments for at once: a year of rosters fits in memory easily.
+RELEASES_PER_LOAD = 53
+# The same with pipelined calc_all_releases: small batches, so that only the first one is read before
+# the calculation starts and every next one is read while the previous releases are calculated.
+PIPELINED_RELEASES_PER_LOAD = 2
+# Input fingerprints cover only the data a release is calculated from. Bump this version after
+# changing the calculation itself, so that all releases are recalculated.
+CALCULATION_VERSION = 2
+
+
+@dataclass
+class ReleaseState:
+    """
+    Everything the next step needs from a calculated release, in exactly the shape get_team_rating
+    and PlayerRating.__init__ would read it back from our DB. Lets calc_all_releases chain the
+    releases in memory instead of re-reading each one.
+    """
+
+    release: models.Release
+    teams_list: List[dict]
+    players_list: List[dict]
+    bonuses: PlayerBonuses
+    n_tournaments: int
+    # Registries of team and player ids (see TeamRating.get_rows) shared by the chain of releases.
+    team_registry: Optional[IdRegistry] = None
+    player_registry: Optional[IdRegistry] = None
+    # True if the state of the release (see state_fingerprint) came out exactly as it is stored in our DB.
+    unchanged: bool = False
+    # The state fingerprint, which the input fingerprint of the next release includes.
+    state_hash: Optional[int] = None
+
 
 # Reads the teams rating for given release_id.
-def get_team_rating(release_id: int) -> TeamRating:
-    teams_list = list(
-        models.Team_rating.objects.filter(release_id=release_id)
-        .values("team_id", "rating", "trb", "place")
-        .order_by("-rating")
-    )
-    return TeamRating(teams_list=teams_list)
+def get_team_rating(release_id: int, source: DataSource = DEFAULT_SOURCE) -> TeamRating:
+    return TeamRating(teams_list=source.get_team_ratings(release_id))
 
 
 # Calculates new teams and players rating based on old rating and provided set of tournaments.
+# With workers > 1, ratings in tournaments are calculated in pool (see parallel.make_pool) or in a new pool.
 def make_step_for_teams_and_players(
     initial_teams: TeamRating,
     initial_players: PlayerRating,
     tournaments: Iterable[trnmt.Tournament],
     new_release: models.Release,
+    workers: int = 1,
+    timer: Optional[StageTimer] = None,
+    pool: Optional[ProcessPoolExecutor] = None,
 ) -> Tuple[TeamRating, PlayerRating]:
-    existing_player_ids = set(initial_players.data.index)
-    new_player_ids = set()
-    for tournament in tournaments:
-        logger.debug(
-            f"Tournament {tournament.id}..." + ("" if tournament.is_in_maii_rating else " (not in MAII rating)")
-        )
-        initial_teams.add_new_teams(tournament, initial_players)
-        tournament.add_ratings(initial_teams, initial_players)
-        tournament.calc_bonuses(initial_teams)
-        new_player_ids |= tournament.get_new_player_ids(existing_player_ids)
+    timer = timer or StageTimer()
+    # Players' ratings do not change until the bonuses are applied, so neither do RTs of rosters.
+    rt_memo = TechRatingMemo(initial_players)
+    with timer("add_new_teams"):
+        initial_teams.add_all_new_teams(tournaments, initial_players, rt_memo)
+    with timer("add_ratings"):
+        if workers > 1:
+            # New teams are added above, so the ratings that the tournaments read are final.
+            parallel.add_ratings(tournaments, initial_teams, initial_players, workers, pool)
+        else:
+            for tournament in tournaments:
+                logger.debug(
+                    f"Tournament {tournament.id}..." + ("" if tournament.is_in_maii_rating else " (not in MAII rating)")
+                )
+                tournament.add_ratings(initial_teams, initial_players, rt_memo)
+    with timer("calc_bonuses"):
+        trnmt.Tournament.calc_all_bonuses(tournaments, initial_teams)
 
-    logger.info("Calculated tournament ratings")
+    logger.info(
+        f"Calculated tournament ratings; RTs of rosters: {rt_memo.n_hits} taken from memo, {rt_memo.n_misses} calculated"
+        + ("" if workers <= 1 else f", the rest in {workers} processes")
+    )
     final_teams = initial_teams.copy()
     final_players = initial_players.copy()
-    if new_player_ids:
-        new_players = (
-            pd.DataFrame(({"player_id": player_id, "rating": 0, "top_bonuses": []} for player_id in new_player_ids))
-            .set_index("player_id")
-            .join(db_tools.get_base_teams_for_players(new_release.date), how="left")
-        )
-        final_players.data = pd.concat([final_players.data, new_players])
+    with timer("add_new_players"):
+        new_player_ids = trnmt.Tournament.get_new_player_ids(tournaments, initial_players.data.index.values)
+        final_players.add_new_players(new_player_ids, new_release.date)
 
     logger.info("Added new players")
 
@@ -71,137 +114,159 @@ def make_step_for_teams_and_players(
     final_teams.data["prev_rating"] = final_teams.data["rating"]
     final_players.data["prev_rating"] = final_players.data["rating"]
 
-    final_players.reduce_rating()
-    for tournament in tournaments:
-        if tournament.is_in_maii_rating:
-            final_teams, final_players = tournament.apply_bonuses(final_teams, final_players)
+    with timer("reduce_rating"):
+        final_players.reduce_rating()
+    with timer("apply_bonuses"):
+        final_teams, final_players = trnmt.Tournament.apply_all_bonuses(
+            [tournament for tournament in tournaments if tournament.is_in_maii_rating], final_teams, final_players
+        )
     logger.info("Applied bonuses")
     # Team rating cannot be negative.
     final_teams.data["rating"] = np.maximum(final_teams.data["rating"], 0)
-    final_players.recalc_rating()
+    with timer("recalc_rating"):
+        final_players.recalc_rating()
     logger.info("Recalculated players rating")
     return final_teams, final_players
 
 
 # The build_* functions below produce the exact rows that would be written for a
-# release. They are used both to fingerprint the release (to decide whether the
-# write can be skipped) and, when it cannot, as the payload for fast_insert.
-
-
-def delete_previous_results(release_id):
-    with connection.cursor() as cursor:
-        cursor.execute(f"delete from {SCHEMA_NAME}.player_rating where release_id = {release_id}")
-        cursor.execute(f"delete from {SCHEMA_NAME}.team_rating where release_id = {release_id}")
-        cursor.execute(f"delete from {SCHEMA_NAME}.player_rating_by_tournament where release_id = {release_id}")
-        cursor.execute(f"delete from {SCHEMA_NAME}.tournament_in_release where release_id = {release_id}")
-
-
-def delete_tournament_result(tournament_id):
-    with connection.cursor() as cursor:
-        cursor.execute(f"delete from {SCHEMA_NAME}.tournament_result where tournament_id = {tournament_id}")
+# release, as column batches. They are used both to fingerprint the release (to decide
+# whether the write can be skipped) and, when it cannot, as the payload for fast_insert.
+
+
+# Fingerprints are keyed by (table, tournament_id): tournament_id is set only for tournament_result,
+# which is fingerprinted tournament by tournament; other tables are fingerprinted per release.
+FingerprintKey = Tuple[str, Optional[int]]
+
+
+def get_stored_fingerprints(
+    release_id: int, tournament_ids: List[int], source: DataSource = DEFAULT_SOURCE
+) -> Dict[FingerprintKey, int]:
+    fingerprints = source.get_fingerprints([release_id], tournament_ids)
+    return {(table, tournament_id): hash for _, table, tournament_id, hash in fingerprints}
+
+
+def build_player_rating_rows(release_id: int, player_rating: PlayerRating) -> RowBatch:
+    players = player_rating.data[player_rating.data["rating"] > 0]
+    prev_rating = players["prev_rating"].values
+    return RowBatch(
+        columns={
+            "release_id": np.full(len(players), release_id, dtype=np.int64),
+            "player_id": players.index.values.astype(np.int64),
+            "rating": integer_column(players["rating"].values),
+            "rating_change": integer_column(players["rating"].values - prev_rating),
+            "place": players["place"].to_numpy(dtype=np.int64, na_value=0),
+        },
+        nulls={"rating_change": pd.isnull(prev_rating) | (prev_rating == 0), "place": players["place"].isna().values},
+    )
 
 
-def build_player_rating_rows(release_id: int, player_rating: PlayerRating) -> List[dict]:
-    return [
-        {
-            "release_id": release_id,
-            "player_id": player_id,
-            "rating": player["rating"],
-            "rating_change": ((player["rating"] - player["prev_rating"]) if player["prev_rating"] else "NULL"),
-            "place": player["place"],
-        }
-        for player_id, player in player_rating.data.iterrows()
-        if player["rating"] > 0
-    ]
+def build_team_rating_rows(release_id: int, teams: pd.DataFrame) -> RowBatch:
+    prev_rating = teams["prev_rating"].values.astype(np.float64)
+    place = teams["place"].values.astype(np.float64)
+    has_prev_place = np.array([bool(prev_place) for prev_place in teams["prev_place"]], dtype=bool)
+    # Decimal arithmetic follows this module's decimal context, so place_change is calculated
+    # team by team; there are only a few thousand teams in a release.
+    place_change = np.array(
+        [
+            float(decimal.Decimal(cur_place) - prev_place) if has_prev else 0.0
+            for cur_place, prev_place, has_prev in zip(place, teams["prev_place"], has_prev_place)
+        ],
+        dtype=np.float64,
+    )
+    return RowBatch(
+        columns={
+            "release_id": np.full(len(teams), release_id, dtype=np.int64),
+            "team_id": teams.index.values.astype(np.int64),
+            "rating": integer_column(teams["rating"].values),
+            "trb": integer_column(teams["trb"].values),
+            "rating_change": integer_column(teams["rating"].values - prev_rating),
+            "place": numeric_column(place),
+            "place_change": place_change,
+            # Is set later, when the next release is calculated.
+            "rating_for_next_release": np.zeros(len(teams), dtype=np.int64),
+        },
+        nulls={
+            "rating_change": np.isnan(prev_rating) | (prev_rating == 0),
+            "place": np.isnan(place) | (place == 0),
+            "place_change": ~has_prev_place,
+            "rating_for_next_release": np.ones(len(teams), dtype=bool),
+        },
+    )
 
 
-def build_team_rating_rows(release_id: int, teams: pd.DataFrame) -> List[dict]:
-    return [
-        {
-            "release_id": release_id,
-            "team_id": team_id,
-            "rating": team["rating"],
-            "trb": team["trb"],
-            "rating_change": ((team["rating"] - team["prev_rating"]) if team["prev_rating"] else "NULL"),
-            "place": team["place"] or "NULL",
-            "place_change": ((decimal.Decimal(team["place"]) - team["prev_place"]) if team["prev_place"] else "NULL"),
-        }
-        for team_id, team in teams.iterrows()
-    ]
+def build_player_rating_by_tournament_rows(release_id: int, player_rating: PlayerRating) -> RowBatch:
+    bonuses = player_rating.bonuses
+    is_rated = (player_rating.data["rating"].values != 0)[bonuses.player_idx]
+    return RowBatch(
+        columns={
+            "release_id": np.full(np.count_nonzero(is_rated), release_id, dtype=np.int64),
+            "player_id": player_rating.data.index.values[bonuses.player_idx[is_rated]].astype(np.int64),
+            "tournament_result_id": bonuses.tournament_result_id[is_rated],
+            "tournament_id": bonuses.tournament_id[is_rated],
+            "initial_score": bonuses.initial_score[is_rated],
+            "weeks_since_tournament": bonuses.weeks_since_tournament[is_rated],
+            "cur_score": bonuses.cur_score[is_rated],
+        },
+        nulls={
+            "tournament_result_id": bonuses.tournament_result_id[is_rated] == 0,
+            "tournament_id": bonuses.tournament_id[is_rated] == 0,
+        },
+    )
 
 
-def build_player_rating_by_tournament_rows(release_id: int, player_rating: PlayerRating) -> List[dict]:
-    return [
-        {
-            "release_id": release_id,
-            "player_id": player_id,
-            "tournament_result_id": rating_by_trnmt.tournament_result_id or "NULL",
-            "tournament_id": rating_by_trnmt.tournament_id or "NULL",
-            "initial_score": rating_by_trnmt.initial_score,
-            "weeks_since_tournament": rating_by_trnmt.weeks_since_tournament,
-            "cur_score": rating_by_trnmt.cur_score,
+def build_tournaments_in_release_rows(release_id: int, tournaments: Iterable[trnmt.Tournament]) -> RowBatch:
+    tournament_ids = [tournament.id for tournament in tournaments if tournament.is_in_maii_rating]
+    return RowBatch(
+        columns={
+            "release_id": np.full(len(tournament_ids), release_id, dtype=np.int64),
+            "tournament_id": np.array(tournament_ids, dtype=np.int64),
         }
-        for player_id, player in player_rating.data.iterrows()
-        if player["rating"] != 0
-        for rating_by_trnmt in player["top_bonuses"]
-    ]
-
-
-def build_tournaments_in_release_rows(release_id: int, tournaments: Iterable[trnmt.Tournament]) -> List[dict]:
-    return [
-        {"release_id": release_id, "tournament_id": tournament.id}
-        for tournament in tournaments
-        if tournament.is_in_maii_rating
-    ]
+    )
 
 
 # Builds the already-calculated tournament bonuses rows (without touching the DB).
-def build_tournament_result_rows(trnmt: trnmt.Tournament) -> List[dict]:
-    return [
-        {
-            "tournament_id": trnmt.id,
-            "team_id": team["team_id"],
-            "mp": team["expected_place"],
-            "bp": team["score_pred"],
-            "m": team["position"],
-            "rating": team["score_real"],
-            "d1": team["D1"],
-            "d2": team["D2"],
-            "rating_change": team["bonus"],
-            "r": team["r"],
-            "rt": team["rt"],
-            "rb": team["rb"],
-            "rg": team["rg"],
-            "is_in_maii_rating": "TRUE" if team["heredity"] else "FALSE",
+def build_tournament_result_rows(trnmt: trnmt.Tournament) -> RowBatch:
+    teams = trnmt.data
+    return RowBatch(
+        columns={
+            "tournament_id": np.full(len(teams), trnmt.id, dtype=np.int64),
+            "team_id": teams["team_id"].values.astype(np.int64),
+            "mp": numeric_column(teams["expected_place"].values),
+            "bp": integer_column(teams["score_pred"].values),
+            "m": numeric_column(teams["position"].values),
+            "rating": integer_column(teams["score_real"].values),
+            "d1": integer_column(teams["D1"].values),
+            "d2": integer_column(teams["D2"].values),
+            "rating_change": integer_column(teams["bonus"].values),
+            "r": integer_column(teams["r"].values),
+            "rt": integer_column(teams["rt"].values),
+            "rb": integer_column(teams["rb"].values),
+            "rg": integer_column(teams["rg"].values),
+            "is_in_maii_rating": teams["heredity"].values.astype(bool),
         }
-        for _, team in trnmt.data.iterrows()
-    ]
-
-
-def dump_rating_for_next_release(old_release: models.Release, teams_with_updated_rating: List[Tuple[int, int]]):
-    for team_id, new_rating in teams_with_updated_rating:
-        n_changed = old_release.team_rating_set.filter(team_id=team_id).update(rating_for_next_release=new_rating)
-        if n_changed != 1:
-            logger.warning(
-                "dump_rating_for_next_release: there is problem with updating team_rating.rating_for_next_release for "
-                + f"team_id {team_id}, new rating {new_rating}: {n_changed} rows are affected."
-            )
+    )
 
 
-# Loads tournaments from our DB that finish between given releases.
-def get_tournaments_for_release(old_release: models.Release, new_release: models.Release) -> List[trnmt.Tournament]:
+# Loads tournaments from source that finish between given releases. tournament_rows can be passed
+# if they were already loaded by source.get_tournament_rows_by_release.
+def get_tournaments_for_release(
+    old_release: models.Release,
+    new_release: models.Release,
+    tournament_rows: Optional[List[db_tools.TournamentRows]] = None,
+    source: DataSource = DEFAULT_SOURCE,
+) -> List[trnmt.Tournament]:
+    if tournament_rows is None:
+        tournament_rows = source.get_tournament_rows_by_release([new_release.date])[new_release.date]
     tournaments = []
     n_counted_in_maii_rating = 0
-    tournaments_qs = models.Tournament.objects.filter(
-        end_datetime__date__gt=old_release.date,
-        end_datetime__date__lte=new_release.date,
-    ).prefetch_related("roster_set", "team_score_set__team")
-    if new_release.date <= tools.FIRST_NEW_RELEASE:
-        tournaments_qs = tournaments_qs.filter(maii_rating=True)
-    for trnmt_from_db in tournaments_qs.order_by("pk"):
+    for rows in tournament_rows:
+        trnmt_from_db = rows.tournament
         # We need only tournaments with available results of at lease some teams.
         try:
-            tournament = trnmt.Tournament(trnmt_from_db=trnmt_from_db, release=new_release)
+            tournament = trnmt.Tournament(
+                trnmt_from_db=trnmt_from_db, release=new_release, team_scores=rows.team_scores, roster=rows.roster
+            )
             tournaments.append(tournament)
             if trnmt_from_db.maii_rating:
                 n_counted_in_maii_rating += 1
@@ -216,14 +281,124 @@ def get_tournaments_for_release(old_release: models.Release, new_release: models
     return tournaments
 
 
+# Converts just calculated ratings into the state that the next release would read from our DB:
+# only dumped teams and players with positive rating, with values rounded as Postgres rounds them.
+def build_release_state(
+    release: models.Release, dumped_teams: pd.DataFrame, players: PlayerRating, n_tournaments: int
+) -> ReleaseState:
+    ratings = tools.round_half_away_from_zero(dumped_teams["rating"].values)
+    trbs = tools.round_half_away_from_zero(dumped_teams["trb"].values)
+    teams_list = [
+        {
+            "team_id": int(team_id),
+            "rating": int(rating),
+            "trb": int(trb),
+            "place": decimal.Decimal(f"{place:.1f}"),
+        }
+        for team_id, rating, trb, place in sorted(
+            zip(dumped_teams.index, ratings, trbs, dumped_teams["place"]), key=lambda team: -team[1]
+        )
+    ]
+    is_rated = players.data["rating"].values > 0
+    players_list = [
+        {"player_id": int(player_id), "rating": int(rating)}
+        for player_id, rating in zip(players.data.index[is_rated], players.data["rating"].values[is_rated])
+    ]
+    return ReleaseState(
+        release=release,
+        teams_list=teams_list,
+        players_list=players_list,
+        bonuses=players.bonuses.take_players(is_rated),
+        n_tournaments=n_tournaments,
+    )
+
+
+# Saves a just written release state to the snapshot store, along with the fingerprints that
+# load_release_state checks it against.
+def save_release_state(
+    snapshots: SnapshotStore, state: ReleaseState, q: float, release_hash: int, input_hash: Optional[int]
+):
+    bonuses = state.bonuses
+    arrays = {
+        "team_id": np.array([team["team_id"] for team in state.teams_list], dtype=np.int64),
+        "team_rating": np.array([team["rating"] for team in state.teams_list], dtype=np.int64),
+        "team_trb": np.array([team["trb"] for team in state.teams_list], dtype=np.int64),
+        "team_place": np.array([float(team["place"]) for team in state.teams_list], dtype=np.float64),
+        "player_id": np.array([player["player_id"] for player in state.players_list], dtype=np.int64),
+        "player_rating": np.array([player["rating"] for player in state.players_list], dtype=np.int64),
+        **{f"bonus_{column}": getattr(bonuses, column) for column in PlayerBonuses.COLUMNS},
+    }
+    if bonuses.offsets is not None:
+        arrays["bonus_offsets"] = bonuses.offsets
+    snapshots.save(
+        state.release.date,
+        arrays,
+        {
+            "release_id": state.release.id,
+            "release_hash": release_hash,
+            "state_hash": state.state_hash,
+            "input_hash": input_hash,
+            "calculation_version": CALCULATION_VERSION,
+            "q": q,
+            "n_tournaments": state.n_tournaments,
+        },
+    )
+
+
+# Reads the state of given release from the snapshot store. The snapshot is used only if the release
+# is still stored in our DB exactly as it was when the snapshot was saved: the same hash of its rows
+# and the same state and input fingerprints. Otherwise it is discarded and None is returned.
+def load_release_state(
+    snapshots: SnapshotStore, release: models.Release, source: DataSource = DEFAULT_SOURCE
+) -> Optional[ReleaseState]:
+    snapshot = snapshots.load(release.date)
+    if snapshot is None:
+        return None
+    arrays, meta = snapshot
+    stored_fingerprints = get_stored_fingerprints(release.id, [], source)
+    if (
+        meta["release_id"] != release.id
+        or meta["release_hash"] != release.hash
+        or meta["calculation_version"] != CALCULATION_VERSION
+        or meta["state_hash"] != stored_fingerprints.get(("state", None))
+        or meta["input_hash"] != stored_fingerprints.get(("input", None))
+    ):
+        logger.info(f"Snapshot of release {release.date} is outdated; discarding it")
+        snapshots.discard(release.date)
+        return None
+
+    teams_list = [
+        {"team_id": int(team_id), "rating": int(rating), "trb": int(trb), "place": decimal.Decimal(f"{place:.1f}")}
+        for team_id, rating, trb, place in zip(
+            arrays["team_id"], arrays["team_rating"], arrays["team_trb"], arrays["team_place"]
+        )
+    ]
+    players_list = [
+        {"player_id": int(player_id), "rating": int(rating)}
+        for player_id, rating in zip(arrays["player_id"], arrays["player_rating"])
+    ]
+    bonuses = PlayerBonuses(**{column: arrays[f"bonus_{column}"] for column in PlayerBonuses.COLUMNS})
+    bonuses.offsets = arrays.get("bonus_offsets")
+    logger.info(f"Read the state of release {release.date} from its snapshot")
+    return ReleaseState(
+        release=release,
+        teams_list=teams_list,
+        players_list=players_list,
+        bonuses=bonuses,
+        n_tournaments=meta["n_tournaments"],
+        unchanged=True,
+        state_hash=meta["state_hash"],
+    )
+
+
 # A.2.2: We only calculate rating for teams that have base roster in current season,
 # or that had it in previous season and new season started <=3 months ago.
-def teams_to_dump(release_date: datetime.date, teams: TeamRating) -> pd.DataFrame:
-    cur_season = db_tools.get_season(release_date)
-    teams_with_rosters = set(cur_season.season_roster_set.values_list("team_id", flat=True).distinct())
+def teams_to_dump(release_date: datetime.date, teams: TeamRating, source: DataSource = DEFAULT_SOURCE) -> pd.DataFrame:
+    cur_season = source.get_season(release_date)
+    teams_with_rosters = source.get_season_team_ids(cur_season)
     if cur_season.start + datetime.timedelta(days=90) >= release_date:
-        prev_season = db_tools.get_season(release_date - datetime.timedelta(days=180))
-        teams_with_rosters |= set(prev_season.season_roster_set.values_list("team_id", flat=True).distinct())
+        prev_season = source.get_season(release_date - datetime.timedelta(days=180))
+        teams_with_rosters |= source.get_season_team_ids(prev_season)
     teams.data[teams.data.index.isin(teams_with_rosters)]
     n_skipped_teams = len(teams.data[~teams.data.index.isin(teams_with_rosters)])
     if n_skipped_teams:
@@ -231,91 +406,613 @@ def teams_to_dump(release_date: datetime.date, teams: TeamRating) -> pd.DataFram
     return teams.data[teams.data.index.isin(teams_with_rosters)]
 
 
-# Reads teams and players for provided dates; finds tournaments for next release; calculates
-# new ratings and writes them to our DB.
-def calc_release(next_release_date: datetime.date):
+# Tables with the state that the next release is calculated from.
+STATE_TABLES = ("team_rating", "player_rating", "player_rating_by_tournament")
+
+
+# Fingerprints the state of a release: the rows of STATE_TABLES and Q.
+def state_fingerprint(table_rows: Dict[str, RowBatch], q: float) -> int:
+    state_rows = {table: table_rows[table] for table in STATE_TABLES}
+    state_rows["q"] = RowBatch(columns={"q": np.array([q], dtype=np.float64)})
+    return fingerprint(state_rows)
+
+
+class SeasonInputs:
+    """
+    Seasons and base rosters that the inputs of releases from first_date to last_date depend on (see
+    build_input_rows), read from source at once: each release looks up to 180 days back, so reading
+    them per release would read the same base rosters over and over.
+    """
+
+    def __init__(self, first_date: datetime.date, last_date: datetime.date, source: DataSource = DEFAULT_SOURCE):
+        self.first_date = first_date
+        self.last_date = last_date
+        first_to_read = first_date - datetime.timedelta(days=180)
+        self.seasons = source.get_seasons(first_to_read, last_date)
+        rosters_by_season = {season.id: [] for season in self.seasons}
+        for base_roster in source.get_base_rosters(first_to_read, last_date):
+            rosters_by_season[base_roster[0]].append(base_roster)
+        self.base_rosters = {
+            season_id: self._base_roster_rows(base_rosters) for season_id, base_rosters in rosters_by_season.items()
+        }
+
+    @staticmethod
+    def _base_roster_rows(base_rosters: List[tuple]) -> RowBatch:
+        start_dates = [base_roster[3] for base_roster in base_rosters]
+        end_dates = [base_roster[4] for base_roster in base_rosters]
+        return RowBatch(
+            columns={
+                **{
+                    column: np.array([base_roster[i] for base_roster in base_rosters], dtype=np.int64)
+                    for i, column in enumerate(["season_id", "team_id", "player_id"])
+                },
+                "start_date": np.array([date.toordinal() if date else 0 for date in start_dates], dtype=np.int64),
+                "end_date": np.array([date.toordinal() if date else 0 for date in end_dates], dtype=np.int64),
+            },
+            nulls={
+                "start_date": np.array([date is None for date in start_dates], dtype=bool),
+                "end_date": np.array([date is None for date in end_dates], dtype=bool),
+            },
+        )
+
+    def _check_release_date(self, release_date: datetime.date):
+        if not self.first_date <= release_date <= self.last_date:
+            raise ValueError(
+                f"Seasons are read for releases from {self.first_date} to {self.last_date}, not {release_date}"
+            )
+
+    def get_season(self, date: datetime.date) -> models.Season:
+        matching = [season for season in self.seasons if season.start <= date <= season.end]
+        if len(matching) != 1:
+            raise models.Season.DoesNotExist(f"There is no single season for {date}")
+        return matching[0]
+
+    def get_input_seasons(self, release_date: datetime.date) -> List[models.Season]:
+        """
+        returns the seasons that teams_to_dump and get_base_teams_for_players read for the release
+        """
+        self._check_release_date(release_date)
+        seasons = [self.get_season(release_date)]
+        if seasons[0].start + datetime.timedelta(days=90) >= release_date:
+            seasons.append(self.get_season(release_date - datetime.timedelta(days=180)))
+        return seasons
+
+    def get_base_roster_rows(self, release_date: datetime.date) -> RowBatch:
+        """
+        returns base rosters of all seasons that overlap the 180 days before the release
+        """
+        self._check_release_date(release_date)
+        first_date = release_date - datetime.timedelta(days=180)
+        return RowBatch.concat(
+            [
+                self.base_rosters[season.id]
+                for season in self.seasons
+                if season.start <= release_date and season.end >= first_date
+            ]
+        )
+
+
+# Builds the rows a release is calculated from: the state of the previous release (see state_fingerprint),
+# tournaments of the release with their results and rosters, and base rosters of the seasons that
+# the calculation may look at (up to 180 days before the release, see teams_to_dump). Seasons and
+# base rosters are taken from season_inputs if it is passed, e.g. to check many releases at once.
+def build_input_rows(
+    old_release: models.Release,
+    old_state_hash: Optional[int],
+    next_release_date: datetime.date,
+    tournament_rows: List[db_tools.TournamentRows],
+    source: DataSource = DEFAULT_SOURCE,
+    season_inputs: Optional[SeasonInputs] = None,
+) -> Dict[str, RowBatch]:
+    if season_inputs is None:
+        season_inputs = SeasonInputs(next_release_date, next_release_date, source)
+    tournaments = [rows.tournament for rows in tournament_rows]
+    team_scores = [team_score for rows in tournament_rows for team_score in rows.team_scores]
+    rosters = [roster for rows in tournament_rows for roster in rows.roster]
+    flags = [roster["flag"] for roster in rosters]
+    seasons = season_inputs.get_input_seasons(next_release_date)
+    titles = [team_score["title"] for team_score in team_scores]
+    team_names = [team_score["team_name"] for team_score in team_scores]
+    return {
+        "version": RowBatch(columns={"version": np.array([CALCULATION_VERSION], dtype=np.int64)}),
+        "release": RowBatch(
+            columns={
+                "id": np.array([old_release.id], dtype=np.int64),
+                "state_hash": np.array([old_state_hash or 0], dtype=np.int64),
+            },
+            nulls={"state_hash": np.array([old_state_hash is None])},
+        ),
+        "tournaments": RowBatch(
+            columns={
+                "id": np.array([tournament.id for tournament in tournaments], dtype=np.int64),
+                "typeoft_id": np.array([tournament.typeoft_id for tournament in tournaments], dtype=np.int64),
+                "maii_rating": np.array([tournament.maii_rating for tournament in tournaments], dtype=bool),
+                "start_datetime": np.array(
+                    [tournament.start_datetime.timestamp() for tournament in tournaments], dtype=np.float64
+                ),
+                "end_datetime": np.array(
+                    [tournament.end_datetime.timestamp() for tournament in tournaments], dtype=np.float64
+                ),
+            }
+        ),
+        "tournament_results": RowBatch(
+            columns={
+                **{
+                    column: np.array([team_score[column] for team_score in team_scores], dtype=dtype)
+                    for column, dtype in [
+                        ("id", np.int64),
+                        ("tournament_id", np.int64),
+                        ("team_id", np.int64),
+                        ("total", np.int64),
+                        ("position", np.float64),
+                    ]
+                },
+                # Team names decide heredity of rosters.
+                "title": np.array(titles, dtype=object),
+                "team_name": np.array(team_names, dtype=object),
+            },
+            nulls={
+                "title": np.array([title is None for title in titles], dtype=bool),
+                "team_name": np.array([team_name is None for team_name in team_names], dtype=bool),
+            },
+        ),
+        "tournament_rosters": RowBatch(
+            columns={
+                **{
+                    column: np.array([roster[column] for roster in rosters], dtype=np.int64)
+                    for column in ["tournament_id", "team_id", "player_id"]
+                },
+                "flag": np.array([ord(flag) if flag else 0 for flag in flags], dtype=np.int64),
+            },
+            nulls={"flag": np.array([not flag for flag in flags], dtype=bool)},
+        ),
+        "base_rosters": season_inputs.get_base_roster_rows(next_release_date),
+        "seasons": RowBatch(
+            columns={
+                "id": np.array([season.id for season in seasons], dtype=np.int64),
+                "start": np.array([season.start.toordinal() for season in seasons], dtype=np.int64),
+                "end": np.array([season.end.toordinal() for season in seasons], dtype=np.int64),
+            }
+        ),
+    }
+
+
+# Reads teams and players for provided dates (or takes them from prev_state, if the previous release
+# was just calculated, or from its snapshot, if snapshots has a valid one); finds tournaments for
+# next release (unless they are already loaded into tournament_rows); calculates new ratings and
+# writes them to our DB (and, with snapshots, saves the new state there). Everything is read from
+# and written to source: our DB by default. With diff, changed tables are updated row by row instead
+# of being rewritten.
+# Unless force is set, returns None without calculating anything if the inputs of the release
+# did not change since it was calculated last time.
+# The time of each stage is added to timer (a new one by default) and logged (see timing.log_release_stages).
+# Seasons and base rosters for the input fingerprint are taken from season_inputs, if it covers the release.
+# With workers > 1, pool is the pool of worker processes to use, if there is one already.
+def calc_release(
+    next_release_date: datetime.date,
+    prev_state: Optional[ReleaseState] = None,
+    tournament_rows: Optional[List[db_tools.TournamentRows]] = None,
+    diff: bool = False,
+    force: bool = False,
+    workers: int = 1,
+    writer: Optional["ReleaseWriter"] = None,
+    snapshots: Optional[SnapshotStore] = None,
+    source: DataSource = DEFAULT_SOURCE,
+    timer: Optional[StageTimer] = None,
+    season_inputs: Optional[SeasonInputs] = None,
+    pool: Optional[ProcessPoolExecutor] = None,
+) -> Optional[ReleaseState]:
+    timer = timer or StageTimer()
     old_release_date = tools.get_prev_release_date(next_release_date)
-    old_release = models.Release.objects.get(date=old_release_date)
-    initial_teams = get_team_rating(old_release.id)
-    next_release, _ = models.Release.objects.get_or_create(date=next_release_date)
+    if prev_state is None:
+        with timer("load_state"):
+            old_release = source.get_release(old_release_date)
+            if snapshots is not None:
+                prev_state = load_release_state(snapshots, old_release, source)
+    else:
+        if prev_state.release.date != old_release_date:
+            raise AssertionError(f"Previous state is for {prev_state.release.date}, not for {old_release_date}.")
+        old_release = prev_state.release
+    next_release = source.get_release(next_release_date, create=True)
+    if tournament_rows is None:
+        with timer("load_tournaments"):
+            tournament_rows = source.get_tournament_rows_by_release([next_release_date])[next_release_date]
+
+    # The last old release is read from the tables of the old rating system, so we do not
+    # fingerprint its inputs.
+    input_hash = None
+    if old_release_date != tools.LAST_OLD_RELEASE:
+        with timer("input_fingerprint"):
+            if prev_state is not None and prev_state.state_hash is not None:
+                # The previous release may still be waiting for its write (see ReleaseWriter).
+                old_state_hash = prev_state.state_hash
+            else:
+                old_state_hash = get_stored_fingerprints(old_release.id, [], source).get(("state", None))
+            input_hash = fingerprint(
+                build_input_rows(old_release, old_state_hash, next_release_date, tournament_rows, source, season_inputs)
+            )
+            stored_input_hash = get_stored_fingerprints(next_release.id, [], source).get(("input", None))
+        if input_hash == stored_input_hash and not force:
+            logger.info(f"Release {next_release.id} inputs unchanged; skipping calculation")
+            log_release_stages(next_release_date, next_release.id, timer, skipped=True)
+            return None
 
     logger.info(
         f"Making a step from release {old_release_date} (id {old_release.id}) to release {next_release_date} (id {next_release.id})"
+        + ("" if prev_state is None else " using the previous state from memory or its snapshot")
     )
-    initial_players = PlayerRating(release=old_release, release_for_squads=next_release)
-    initial_teams.update_q(initial_players)
-    if pd.isnull(initial_teams.q):
-        sys.exit("Q is nan! We cannot continue.")
-    initial_teams.calc_trb(initial_players)
-
-    changed_teams = db_tools.get_teams_with_new_players(old_release_date, next_release_date)
-    teams_with_updated_rating = initial_teams.update_ratings_for_changed_teams(changed_teams)
-    dump_rating_for_next_release(old_release, teams_with_updated_rating)
-
-    tournaments = get_tournaments_for_release(old_release, next_release)
+    with timer("load_state"):
+        if prev_state is None:
+            initial_teams = get_team_rating(old_release.id, source)
+        else:
+            initial_teams = TeamRating(teams_list=prev_state.teams_list, registry=prev_state.team_registry)
+        initial_players = PlayerRating(
+            release=old_release,
+            release_for_squads=next_release,
+            players_list=None if prev_state is None else prev_state.players_list,
+            bonuses=None if prev_state is None else prev_state.bonuses,
+            registry=None if prev_state is None else prev_state.player_registry,
+            source=source,
+        )
+    with timer("q_trb"):
+        initial_teams.update_q(initial_players)
+        if pd.isnull(initial_teams.q):
+            sys.exit("Q is nan! We cannot continue.")
+        initial_teams.calc_trb(initial_players)
+
+    with timer("changed_teams"):
+        changed_teams = source.get_teams_with_new_players(old_release_date, next_release_date)
+        teams_with_updated_rating = initial_teams.update_ratings_for_changed_teams(changed_teams)
+
+    with timer("tournament_init"):
+        tournaments = get_tournaments_for_release(old_release, next_release, tournament_rows, source)
     logger.info(f"Fetched {len(tournaments)} tournaments")
     new_teams, new_players = make_step_for_teams_and_players(
-        initial_teams, initial_players, tournaments, new_release=next_release
+        initial_teams, initial_players, tournaments, new_release=next_release, workers=workers, timer=timer, pool=pool
     )
     logger.info("Made a step for teams and players")
-    new_teams.data["place"] = tools.calc_places(new_teams.data["rating"].values)
+    with timer("team_places"):
+        new_teams.data["place"] = tools.calc_places(new_teams.data["rating"].values)
 
     # Build every row we would write, then fingerprint it. The fingerprint covers
     # all written columns, so if it matches the stored one nothing changed and we
     # can skip the (expensive) delete+reinsert entirely.
-    tournament_result_rows = {tournament.id: build_tournament_result_rows(tournament) for tournament in tournaments}
-    table_rows = {
-        "tournament_result": [row for rows in tournament_result_rows.values() for row in rows],
-        "player_rating": build_player_rating_rows(next_release.id, new_players),
-        "team_rating": build_team_rating_rows(next_release.id, teams_to_dump(next_release_date, new_teams)),
-        "player_rating_by_tournament": build_player_rating_by_tournament_rows(next_release.id, new_players),
-        "tournament_in_release": build_tournaments_in_release_rows(next_release.id, tournaments),
-    }
-    release_hash = fingerprint(table_rows)
+    with timer("build_rows"):
+        tournament_result_rows = {tournament.id: build_tournament_result_rows(tournament) for tournament in tournaments}
+        dumped_teams = teams_to_dump(next_release_date, new_teams, source)
+        table_rows = {
+            "tournament_result": RowBatch.concat(list(tournament_result_rows.values())),
+            "player_rating": build_player_rating_rows(next_release.id, new_players),
+            "team_rating": build_team_rating_rows(next_release.id, dumped_teams),
+            "player_rating_by_tournament": build_player_rating_by_tournament_rows(next_release.id, new_players),
+            "tournament_in_release": build_tournaments_in_release_rows(next_release.id, tournaments),
+        }
+    with timer("fingerprint"):
+        release_hash = fingerprint(table_rows)
+        state_hash = state_fingerprint(table_rows, new_teams.q)
+        stored_fingerprints = get_stored_fingerprints(next_release.id, list(tournament_result_rows), source)
+    with timer("build_state"):
+        new_state = build_release_state(next_release, dumped_teams, new_players, len(tournaments))
+    new_state.team_registry, new_state.player_registry = new_teams.registry, new_players.registry
+    new_state.unchanged = state_hash == stored_fingerprints.get(("state", None))
+    new_state.state_hash = state_hash
+    release_fingerprints = {("state", None): state_hash}
+    if input_hash is not None:
+        release_fingerprints[("input", None)] = input_hash
+
+    # Everything below only writes to source, so with a writer it runs while the next release is calculated.
+    def write():
+        with timer("write"):
+            source.save_ratings_for_next_release(old_release, teams_with_updated_rating)
+            write_release(
+                next_release,
+                new_teams.q,
+                table_rows,
+                tournament_result_rows,
+                release_hash,
+                release_fingerprints,
+                stored_fingerprints,
+                diff,
+                source,
+            )
+        if snapshots is not None:
+            with timer("save_snapshot"):
+                save_release_state(snapshots, new_state, new_teams.q, release_hash, input_hash)
+        log_release_stages(next_release_date, next_release.id, timer, n_tournaments=len(tournaments))
+
+    if writer is None:
+        write()
+    else:
+        writer.submit(write)
+    return new_state
+
+
+# Writes the rows of a just calculated release, skipping the tables and tournaments whose fingerprints
+# did not change, and saves the fingerprints.
+def write_release(
+    next_release: models.Release,
+    q: float,
+    table_rows: Dict[str, RowBatch],
+    tournament_result_rows: Dict[int, RowBatch],
+    release_hash: int,
+    release_fingerprints: Dict[FingerprintKey, int],
+    stored_fingerprints: Dict[FingerprintKey, int],
+    diff: bool,
+    source: DataSource = DEFAULT_SOURCE,
+):
     if release_hash == next_release.hash:
         logger.info(f"Release {next_release.id} unchanged; skipping write")
-        return len(tournaments)
+        source.save_fingerprints(
+            next_release.id,
+            {key: value for key, value in release_fingerprints.items() if stored_fingerprints.get(key) != value},
+        )
+        return
 
-    logger.info("hashes are different, updating release")
-    with transaction.atomic():
-        for tournament in tournaments:
-            delete_tournament_result(tournament.id)
-            db_tools.fast_insert("tournament_result", tournament_result_rows[tournament.id])
+    # Something changed: compare per-table and per-tournament fingerprints with the stored
+    # ones and rewrite only the tables and tournaments that differ.
+    fingerprints = {
+        ("tournament_result", tournament_id): table_fingerprint("tournament_result", rows)
+        for tournament_id, rows in tournament_result_rows.items()
+    }
+    fingerprints.update(
+        {
+            (table, None): table_fingerprint(table, rows)
+            for table, rows in table_rows.items()
+            if table != "tournament_result"
+        }
+    )
+    changed = {key: value for key, value in fingerprints.items() if stored_fingerprints.get(key) != value}
+    changed_tournaments = [tournament_id for _, tournament_id in changed if tournament_id is not None]
+    changed_tables = [table for table, tournament_id in changed if tournament_id is None]
+    logger.info(
+        f"hashes are different, updating release: {len(changed_tournaments)} of {len(tournament_result_rows)} "
+        f"tournaments, tables {changed_tables}"
+    )
+    with source.atomic():
+        for tournament_id in changed_tournaments:
+            source.rewrite_rows(
+                "tournament_result", tournament_result_rows[tournament_id], "tournament_id", tournament_id, diff
+            )
         logger.info("Saved tournament bonuses")
-        delete_previous_results(next_release.id)
-        logger.info("Deleted previous results")
-        db_tools.fast_insert("player_rating", table_rows["player_rating"])
-        db_tools.fast_insert("team_rating", table_rows["team_rating"])
-        db_tools.fast_insert("player_rating_by_tournament", table_rows["player_rating_by_tournament"])
-        db_tools.fast_insert("tournament_in_release", table_rows["tournament_in_release"])
+        for table in changed_tables:
+            source.rewrite_rows(table, table_rows[table], "release_id", next_release.id, diff)
+        source.save_fingerprints(next_release.id, {**changed, **release_fingerprints})
         logger.info(f"Saved release {next_release.id}")
 
     next_release.updated_at = timezone.now()
     next_release.hash = release_hash
-    next_release.q = new_teams.q
-    next_release.save()
+    next_release.q = q
+    source.save_release(next_release)
+
 
-    return len(tournaments)
+class ReleaseWriter:
+    """
+    Writes calculated releases to source in a separate thread (with its own connection to our DB, for
+    DjangoDataSource) while the main thread calculates the next release. Releases are written one at
+    a time in the order they are submitted, and at most one waits to be written: submitting the next
+    one waits for it. If a write fails, the exception is raised by the next submit(), wait() or
+    close(), which stops the chain.
+    """
 
+    def __init__(self, source: DataSource = DEFAULT_SOURCE):
+        self.source = source
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="release_writer")
+        self.pending: Optional[Future] = None
 
-# Calculates all releases starting from FIRST_NEW_RELEASE until current date
-def calc_all_releases(first_to_calc: datetime.date, last_to_calc: datetime.date = datetime.date.today()):
+    def submit(self, write: Callable[[], None]):
+        self.wait()
+        self.pending = self.executor.submit(self._write, write)
+
+    def _write(self, write: Callable[[], None]):
+        try:
+            write()
+        finally:
+            self.source.close()
+
+    def wait(self):
+        pending, self.pending = self.pending, None
+        if pending is not None:
+            pending.result()
+
+    def close(self, log_errors: bool = False):
+        """
+        waits for the pending write; with log_errors, its exception is logged instead of raised
+        """
+        try:
+            self.wait()
+        except Exception:
+            if not log_errors:
+                raise
+            logger.exception("Writing a release failed")
+        finally:
+            self.executor.shutdown()
+
+
+# source.get_tournament_rows_by_release for a thread other than the main one.
+def load_tournament_rows(
+    release_dates: List[datetime.date], source: DataSource = DEFAULT_SOURCE
+) -> Dict[datetime.date, List[db_tools.TournamentRows]]:
+    try:
+        return source.get_tournament_rows_by_release(release_dates)
+    finally:
+        source.close()
+
+
+# Returns dates of all releases from first_to_calc until the release after last_to_calc.
+def get_release_dates(first_to_calc: datetime.date, last_to_calc: datetime.date) -> List[datetime.date]:
+    last_day_to_calc = last_to_calc + datetime.timedelta(days=7)
+    release_dates = []
     next_release_date = first_to_calc
+    while next_release_date <= last_day_to_calc:
+        release_dates.append(next_release_date)
+        next_release_date += datetime.timedelta(days=7)
+    return release_dates
+
+
+# Finds the earliest release between first_to_check and (the release after) last_to_check whose inputs
+# changed since it was calculated, comparing input fingerprints (see build_input_rows) with the stored
+# ones. Tournaments are mapped to releases by their end dates. A release that is not in our DB yet
+# counts as changed. Returns None if all releases are up to date. Seasons and base rosters are read
+# once for all releases, unless season_inputs that covers them is passed.
+def find_first_changed_release(
+    first_to_check: datetime.date,
+    last_to_check: datetime.date = datetime.date.today(),
+    source: DataSource = DEFAULT_SOURCE,
+    season_inputs: Optional[SeasonInputs] = None,
+) -> Optional[datetime.date]:
+    release_dates = get_release_dates(first_to_check, last_to_check)
+    if season_inputs is None:
+        season_inputs = SeasonInputs(release_dates[0], release_dates[-1], source)
+    releases = {
+        release.date: release
+        for release in source.get_releases(tools.get_prev_release_date(first_to_check), release_dates[-1])
+    }
+    stored_hashes = {
+        (release_id, table): hash
+        for release_id, table, _, hash in source.get_fingerprints(
+            [release.id for release in releases.values()], [], table_names=["input", "state"]
+        )
+    }
+    for i in range(0, len(release_dates), RELEASES_PER_LOAD):
+        tournament_rows = source.get_tournament_rows_by_release(release_dates[i : i + RELEASES_PER_LOAD])
+        for next_release_date, rows in tournament_rows.items():
+            old_release = releases.get(tools.get_prev_release_date(next_release_date))
+            next_release = releases.get(next_release_date)
+            if old_release is None or next_release is None:
+                return next_release_date
+            old_state_hash = stored_hashes.get((old_release.id, "state"))
+            input_hash = fingerprint(
+                build_input_rows(old_release, old_state_hash, next_release_date, rows, source, season_inputs)
+            )
+            if input_hash != stored_hashes.get((next_release.id, "input")):
+                return next_release_date
+    return None
+
+
+# Calculates all releases starting from FIRST_NEW_RELEASE until current date.
+# In chained mode, only the release before first_to_calc is read from our DB; every next step
+# starts from the state calculated by the previous one. Tournaments are loaded in bulk, RELEASES_PER_LOAD
+# (or, pipelined, PIPELINED_RELEASES_PER_LOAD) releases at a time; seasons and base rosters for input
+# fingerprints are read once. Once a release comes out the same as stored, we stop and only continue
+# from the next release whose inputs changed (unless force is set).
+# With snapshots, every written release is also saved there, and a chain that has to start from
+# our DB (the first release, or one after skipped releases) starts from the snapshot instead. So an
+# interrupted run, started again, skips the written releases and resumes from the last snapshot.
+# Everything is read from and written to source: our DB by default, or e.g. an input bundle.
+# With profile_dir, the calculation of every release is profiled there (see timing.profiled).
+def calc_all_releases(
+    first_to_calc: datetime.date,
+    last_to_calc: datetime.date = datetime.date.today(),
+    chained: bool = True,
+    diff: bool = False,
+    force: bool = False,
+    workers: int = 1,
+    pipelined: bool = False,
+    snapshots: Optional[SnapshotStore] = None,
+    source: DataSource = DEFAULT_SOURCE,
+    profile_dir: Optional[str] = None,
+):
+    if pipelined and not chained:
+        raise ValueError("Releases can be pipelined only when they are chained in memory")
     time_started = datetime.datetime.now()
     n_releases_calculated = 0
+    n_releases_skipped = 0
     n_tournaments_total = 0
-    last_day_to_calc = last_to_calc + datetime.timedelta(days=7)
-    while next_release_date <= last_day_to_calc:
-        release_started = datetime.datetime.now()
-        n_tournaments = calc_release(next_release_date=next_release_date)
-        release_time = datetime.datetime.now() - release_started
-        logger.info(f"Release {next_release_date} done in {release_time}, included {n_tournaments} tournaments")
-        n_releases_calculated += 1
-        n_tournaments_total += n_tournaments
-        next_release_date += datetime.timedelta(days=7)
+    release_dates = get_release_dates(first_to_calc, last_to_calc)
+    releases_per_load = PIPELINED_RELEASES_PER_LOAD if pipelined else RELEASES_PER_LOAD
+    season_inputs = SeasonInputs(release_dates[0], release_dates[-1], source)
+
+    state = None
+    tournament_rows = {}
+    # With pipelined, the next batch of tournaments is read and the previous release is written
+    # in separate threads while a release is calculated.
+    reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tournament_reader") if pipelined else None
+    writer = ReleaseWriter(source) if pipelined else None
+    # Worker processes are started once for all releases.
+    pool = parallel.make_pool(workers) if workers > 1 else None
+    next_rows = None  # (index of the first release, Future) of the batch being read
+    i = 0
+    try:
+        while i < len(release_dates):
+            next_release_date = release_dates[i]
+            if next_release_date not in tournament_rows:
+                if next_rows is not None and next_rows[0] <= i < next_rows[0] + releases_per_load:
+                    tournament_rows = next_rows[1].result()
+                else:
+                    tournament_rows = source.get_tournament_rows_by_release(release_dates[i : i + releases_per_load])
+                next_rows = None
+                if reader is not None and i + releases_per_load < len(release_dates):
+                    next_first = i + releases_per_load
+                    next_rows = (
+                        next_first,
+                        reader.submit(
+                            load_tournament_rows, release_dates[next_first : next_first + releases_per_load], source
+                        ),
+                    )
+            release_started = datetime.datetime.now()
+            release_tournament_rows = tournament_rows.pop(next_release_date)
+            with profiled(profile_dir, next_release_date):
+                state = calc_release(
+                    next_release_date=next_release_date,
+                    prev_state=state if chained else None,
+                    tournament_rows=release_tournament_rows,
+                    diff=diff,
+                    force=force,
+                    workers=workers,
+                    writer=writer,
+                    snapshots=snapshots,
+                    source=source,
+                    season_inputs=season_inputs,
+                    pool=pool,
+                )
+            release_time = datetime.datetime.now() - release_started
+            # If the release was skipped, the next one reads it from our DB.
+            if state is None:
+                n_releases_skipped += 1
+                logger.info(f"Release {next_release_date} skipped in {release_time}")
+            else:
+                n_releases_calculated += 1
+                n_tournaments_total += state.n_tournaments
+                logger.info(
+                    f"Release {next_release_date} done in {release_time}, included {state.n_tournaments} tournaments"
+                )
+            i += 1
+
+            # The release is the same as stored, so the next releases start from the same state as last time
+            # and can only change if their own inputs did: we jump to the first such release, if any.
+            if not force and i < len(release_dates) and (state is None or state.unchanged):
+                # Both the check and a release without the previous state read what was written.
+                if writer is not None:
+                    writer.wait()
+                first_changed = find_first_changed_release(release_dates[i], last_to_calc, source, season_inputs)
+                n_converged = (len(release_dates) if first_changed is None else release_dates.index(first_changed)) - i
+                if n_converged:
+                    logger.info(
+                        f"Release {next_release_date} is unchanged; skipping {n_converged} releases "
+                        + ("until the end" if first_changed is None else f"until {first_changed}")
+                    )
+                    n_releases_skipped += n_converged
+                    i += n_converged
+                    state = None
+    except BaseException:
+        # The exception that stopped the loop must not be hidden by a failed write of the previous release.
+        if writer is not None:
+            writer.close(log_errors=True)
+        raise
+    finally:
+        if reader is not None:
+            reader.shutdown(cancel_futures=True)
+        if pool is not None:
+            pool.shutdown()
+        if writer is not None:
+            writer.close()
     time_spent = datetime.datetime.now() - time_started
-    logger.info(f"Done! Releases calculated: {n_releases_calculated}, tournaments included: {n_tournaments_total}")
     logger.info(
-        f"Total time spent: {time_spent}, time per release: {time_spent / n_releases_calculated}, "
+        f"Done! Releases calculated: {n_releases_calculated}, skipped as unchanged: {n_releases_skipped}, "
+        f"tournaments included: {n_tournaments_total}"
+    )
+    logger.info(
+        f"Total time spent: {time_spent}, "
+        f"time per release: {time_spent / n_releases_calculated if n_releases_calculated else 'n/a'}, "
         f"time per tournament: {time_spent / n_tournaments_total if n_tournaments_total else 'n/a'}"
     )
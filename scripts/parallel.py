@@ -0,0 +1,127 @@
+import multiprocessing
+import numpy as np
+import numpy.typing as npt
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+from .rosters import Rosters
+from .tools import calc_tech_ratings
+
+# This module is imported by worker processes, so it must not depend on Django.
+
+# (name of the shared memory block, {array name: (dtype, length, offset in the block)})
+SharedArraysSpec = Tuple[str, Dict[str, Tuple[str, int, int]]]
+
+
+class SharedArrays:
+    """
+    Numpy arrays copied into one shared memory block, so that worker processes can read them
+    without pickling. The process that creates them must call release() when the workers are done.
+    """
+
+    def __init__(self, arrays: Dict[str, npt.NDArray]):
+        layout = {}
+        size = 0
+        for name, array in arrays.items():
+            layout[name] = (array.dtype.str, len(array), size)
+            size += array.nbytes
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.spec: SharedArraysSpec = (self.shm.name, layout)
+        for name, view in self._views(self.shm, layout).items():
+            view[:] = arrays[name]
+
+    @staticmethod
+    def _views(shm: shared_memory.SharedMemory, layout) -> Dict[str, npt.NDArray]:
+        return {
+            name: np.ndarray((length,), dtype=dtype, buffer=shm.buf, offset=offset)
+            for name, (dtype, length, offset) in layout.items()
+        }
+
+    @staticmethod
+    def attach(spec: SharedArraysSpec) -> Tuple[shared_memory.SharedMemory, Dict[str, npt.NDArray]]:
+        shm = shared_memory.SharedMemory(name=spec[0])
+        return shm, SharedArrays._views(shm, spec[1])
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def make_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    returns a pool of worker processes for add_ratings. Workers are started by a fork server rather than
+    forked from us: we may have other threads running (see main.calc_all_releases), e.g. inside psycopg2
+    or holding the logging lock, and a process forked from them can deadlock.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver"))
+
+
+def lookup(sorted_ids: npt.NDArray, values: npt.NDArray, ids: npt.NDArray, default=0) -> npt.NDArray:
+    """
+    returns values of given ids (values[i] belongs to sorted_ids[i]), default for unknown ids
+    """
+    if len(sorted_ids) == 0:
+        return np.full(len(ids), default)
+    positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return np.where(sorted_ids[positions] == ids, values[positions], default)
+
+
+def _calc_ratings(
+    spec: SharedArraysSpec, q: float, tournaments: List[Tuple[Rosters, npt.NDArray]]
+) -> List[Tuple[npt.NDArray, npt.NDArray, npt.NDArray]]:
+    shm, arrays = SharedArrays.attach(spec)
+    try:
+        res = []
+        for rosters, team_ids in tournaments:
+            prs = lookup(arrays["player_ids"], arrays["player_ratings"], rosters.player_ids)
+            res.append(
+                (
+                    calc_tech_ratings(prs, rosters.indptr, q),
+                    lookup(arrays["team_ids"], arrays["team_ratings"], team_ids),
+                    lookup(arrays["team_ids"], arrays["team_trbs"], team_ids),
+                )
+            )
+        return res
+    finally:
+        del arrays
+        shm.close()
+
+
+def add_ratings(
+    tournaments: list, team_rating, player_rating, workers: int, pool: Optional[ProcessPoolExecutor] = None
+):
+    """
+    does Tournament.add_ratings for all tournaments in a pool of worker processes (in pool, or in a new one
+    made for this call). Players' and teams' ratings do not change during it, so they are put into shared
+    memory once, and every worker computes RT, R and RB of teams of its tournaments exactly as add_ratings would.
+    """
+    player_order = np.argsort(player_rating.data.index.values)
+    team_order = np.argsort(team_rating.data.index.values)
+    shared = SharedArrays(
+        {
+            "player_ids": player_rating.data.index.values[player_order].astype(np.int64),
+            "player_ratings": np.nan_to_num(player_rating.data["rating"].values[player_order].astype(np.float64)),
+            "team_ids": team_rating.data.index.values[team_order].astype(np.int64),
+            "team_ratings": team_rating.data["rating"].values[team_order].astype(np.float64),
+            "team_trbs": team_rating.data["trb"].values[team_order].astype(np.float64),
+        }
+    )
+    try:
+        chunks = [tournaments[i::workers] for i in range(workers)]
+        executor = pool or make_pool(workers)
+        try:
+            results = executor.map(
+                _calc_ratings,
+                [shared.spec] * workers,
+                [team_rating.q] * workers,
+                [[(t.get_rosters(), t.data.team_id.values.astype(np.int64)) for t in chunk] for chunk in chunks],
+            )
+            for chunk, chunk_results in zip(chunks, results):
+                for tournament, (rt, r, rb) in zip(chunk, chunk_results):
+                    tournament.set_ratings(rt, r, rb)
+        finally:
+            if pool is None:
+                executor.shutdown()
+    finally:
+        shared.release()
@@ -0,0 +1,147 @@
+import copy
+import numpy as np
+import numpy.typing as npt
+from typing import Optional
+
+from .constants import J
+
+
+class PlayerBonuses:
+    """
+    Players' bonuses for tournaments (the rows of player_rating_by_tournament) stored as parallel
+    arrays instead of one model instance per bonus.
+
+    The i-th bonus belongs to the player in row player_idx[i] of PlayerRating.data. After leave_top_n,
+    bonuses are grouped by player: the bonuses of the player in row k are offsets[k]:offsets[k + 1],
+    sorted by raw_cur_score descending. 0 in tournament_id or tournament_result_id means NULL.
+    """
+
+    COLUMNS = (
+        "player_idx",
+        "tournament_id",
+        "tournament_result_id",
+        "initial_score",
+        "weeks_since_tournament",
+        "raw_cur_score",
+        "cur_score",
+    )
+
+    def __init__(
+        self,
+        player_idx: npt.ArrayLike = (),
+        tournament_id: npt.ArrayLike = (),
+        initial_score: npt.ArrayLike = (),
+        weeks_since_tournament: npt.ArrayLike = (),
+        cur_score: npt.ArrayLike = (),
+        tournament_result_id: Optional[npt.ArrayLike] = None,
+        raw_cur_score: Optional[npt.ArrayLike] = None,
+    ):
+        n_bonuses = len(player_idx)
+        self.player_idx = np.asarray(player_idx, dtype=np.int64)
+        self.tournament_id = np.asarray(tournament_id, dtype=np.int64)
+        self.tournament_result_id = np.asarray(
+            np.zeros(n_bonuses) if tournament_result_id is None else tournament_result_id, dtype=np.int64
+        )
+        self.initial_score = np.asarray(initial_score, dtype=np.int64)
+        self.weeks_since_tournament = np.asarray(weeks_since_tournament, dtype=np.int64)
+        # Float value for better precision; NaN until reduce() is called for bonuses read from our DB.
+        self.raw_cur_score = np.asarray(
+            np.full(n_bonuses, np.nan) if raw_cur_score is None else raw_cur_score, dtype=np.float64
+        )
+        self.cur_score = np.asarray(cur_score, dtype=np.int64)
+        self.offsets = None
+        # Bonuses added by add() are kept aside until the arrays are needed, so that adding
+        # bonuses for every tournament of a release concatenates the arrays only once.
+        self._pending = []
+
+    def __len__(self):
+        self._flush()
+        return len(self.player_idx)
+
+    def copy(self):
+        new = copy.copy(self)
+        new._pending = list(self._pending)
+        return new
+
+    def add(self, player_idx: npt.ArrayLike, tournament_id: npt.ArrayLike, score: npt.ArrayLike):
+        """
+        adds bonuses for just played tournaments: their score is both initial and current score.
+        tournament_id is either one id for all bonuses or an id per bonus
+        """
+        self._pending.append(
+            PlayerBonuses(
+                player_idx=player_idx,
+                tournament_id=np.broadcast_to(tournament_id, len(player_idx)),
+                initial_score=score,
+                weeks_since_tournament=np.zeros(len(player_idx)),
+                cur_score=score,
+                raw_cur_score=score,
+            )
+        )
+        self.offsets = None
+
+    def _flush(self):
+        if not self._pending:
+            return
+        parts = [self] + self._pending
+        for column in self.COLUMNS:
+            setattr(self, column, np.concatenate([getattr(part, column) for part in parts]))
+        self._pending = []
+
+    # Multiplies all existing bonuses by J_i constant
+    def reduce(self):
+        self._flush()
+        self.weeks_since_tournament = self.weeks_since_tournament + 1
+        max_weeks = int(self.weeks_since_tournament.max(initial=0))
+        self.raw_cur_score = self.initial_score * decay_table(max_weeks)[self.weeks_since_tournament]
+        self.cur_score = np.rint(self.raw_cur_score).astype(np.int64)
+
+    # Removes all bonuses of each player except top n by raw_cur_score (keeping the current
+    # order on ties) and groups the rest by player.
+    def leave_top_n(self, n: int, n_players: int):
+        self._flush()
+        # lexsort is stable, so bonuses with equal scores keep their order, as in sorted().
+        order = np.lexsort((-self.raw_cur_score, self.player_idx))
+        sorted_player_idx = self.player_idx[order]
+        group_starts = np.searchsorted(sorted_player_idx, sorted_player_idx, side="left")
+        rank_in_group = np.arange(len(order)) - group_starts
+        self._take(order[rank_in_group < n])
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(self.player_idx, minlength=n_players))])
+
+    def sum_by_player(self, n_players: int) -> npt.ArrayLike:
+        self._flush()
+        if self.offsets is None:
+            return np.bincount(self.player_idx, weights=self.cur_score, minlength=n_players).astype(np.int64)
+        cumulative = np.concatenate([[0], np.cumsum(self.cur_score)])
+        return cumulative[self.offsets[1:]] - cumulative[self.offsets[:-1]]
+
+    def take_players(self, player_mask: npt.ArrayLike) -> "PlayerBonuses":
+        """
+        returns bonuses of players where player_mask is True, with player_idx renumbered
+        to the rows of PlayerRating.data[player_mask]
+        """
+        self._flush()
+        new = self.copy()
+        new._take(np.nonzero(player_mask[self.player_idx])[0])
+        new.player_idx = (np.cumsum(player_mask) - 1)[new.player_idx]
+        if self.offsets is not None:
+            new.offsets = np.concatenate([[0], np.cumsum(np.diff(self.offsets)[player_mask])])
+        return new
+
+    def _take(self, indices: npt.ArrayLike):
+        for column in self.COLUMNS:
+            setattr(self, column, getattr(self, column)[indices])
+
+
+_decay_table = np.ones(1)
+
+
+def decay_table(max_weeks: int) -> npt.ArrayLike:
+    """
+    returns array of J ** weeks for weeks from 0 to at least max_weeks. Values are computed by Python's
+    float power, exactly as they always were: np.power differs from it in the last bit for some weeks.
+    """
+    global _decay_table
+    if max_weeks >= len(_decay_table):
+        _decay_table = np.array([J**weeks for weeks in range(2 * max_weeks + 1)])
+    return _decay_table
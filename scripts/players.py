@@ -1,112 +1,189 @@
+import numpy as np
+import numpy.typing as npt
 import pandas as pd
-from typing import List
 import logging
+from typing import Optional
 
-from .tools import calc_tech_rating, get_age_in_weeks, DataFrameBacked
+from .id_registry import IdRegistry
+from .rosters import Rosters
+from .tools import calc_tech_ratings, get_age_in_weeks, group_offsets, DataFrameBacked
 from .constants import N_BEST_TOURNAMENTS_FOR_PLAYER_RATING
-from scripts import db_tools, tools
-from b import models
+from .player_bonuses import PlayerBonuses
+from .data_sources import DataSource, DEFAULT_SOURCE
+from scripts import tools
 
 logger = logging.getLogger(__name__)
 
 
 class PlayerRating(DataFrameBacked):
-    def __init__(self, release=None, release_for_squads=None, file_path=None):
+    def __init__(
+        self,
+        release=None,
+        release_for_squads=None,
+        players_list=None,
+        bonuses=None,
+        registry: Optional[IdRegistry] = None,
+        source: DataSource = DEFAULT_SOURCE,
+    ):
         if release is None:
             raise Exception("no release is passed")
         if release_for_squads is None:
             raise Exception("no release for squads is passed")
 
-        if file_path:
-            self.data = pd.DataFrame.from_csv(file_path, index_col=0)
-            return
-
         self.release = release
         self.release_for_squads = release_for_squads
-        self.players_dict = {
-            player_rating["player_id"]: player_rating | {"top_bonuses": []}
-            for player_rating in self.release.player_rating_set.values("player_id", "rating")
-        }
-
-        if self.release.date == tools.LAST_OLD_RELEASE:
-            self.load_last_old_release()
-        else:
-            for player_bonus in self.release.player_rating_by_tournament_set.all():
-                self.players_dict[player_bonus.player_id]["top_bonuses"].append(player_bonus)
+        self.registry = registry
+        self.source = source
+        # players_list and bonuses are passed when the previous step was just calculated in memory
+        # (see main.ReleaseState), so there is no need to read them back from the DB.
+        if players_list is None:
+            players_list = source.get_player_ratings(self.release.id)
         # adding base_team_ids
         self.data = (
-            pd.DataFrame(self.players_dict.values())
+            pd.DataFrame(players_list, columns=["player_id", "rating"])
             .set_index("player_id")
             .join(
-                db_tools.get_base_teams_for_players(self.release_for_squads.date),
+                source.get_base_teams_for_players(self.release_for_squads.date),
                 how="left",
             )
         )
+        if bonuses is not None:
+            self.bonuses = bonuses
+        elif self.release.date == tools.LAST_OLD_RELEASE:
+            self.bonuses = self.load_last_old_release()
+        else:
+            self.bonuses = self.load_bonuses()
+
+    def copy(self):
+        new = super().copy()
+        new.bonuses = self.bonuses.copy()
+        return new
 
     def update_places(self):
         self.data["place"] = self.data["rating"].rank(ascending=False, method="min").astype("Int32")
 
-    def load_last_old_release(self):
-        tournament_end_dates = db_tools.get_tournament_end_dates()
+    def get_player_idx(self, player_ids) -> npt.ArrayLike:
+        player_idx = self.get_rows(player_ids)
+        if (player_idx < 0).any():
+            raise KeyError(f"Players {list(np.asarray(player_ids)[player_idx < 0])} are not in the rating")
+        return player_idx
+
+    def load_bonuses(self) -> PlayerBonuses:
+        bonuses = self.source.get_player_bonuses(self.release.id)
+        return PlayerBonuses(
+            player_idx=self.get_player_idx(bonuses["player_id"].values),
+            tournament_id=bonuses["tournament_id"].values,
+            tournament_result_id=bonuses["tournament_result_id"].values,
+            initial_score=bonuses["initial_score"].values,
+            weeks_since_tournament=bonuses["weeks_since_tournament"].values,
+            cur_score=bonuses["cur_score"].values,
+        )
+
+    def load_last_old_release(self) -> PlayerBonuses:
+        tournament_end_dates = self.source.get_tournament_end_dates()
         age_in_weeks_by_tournament_id = {}
-        for item in models.Player_rating_by_tournament_old.objects.values(
-            "player_id", "tournament_id", "rating_original", "rating_now"
-        ):
-            if item["player_id"] in self.players_dict:
+        bonuses = []
+        for item in self.source.get_old_player_bonuses():
+            if item["player_id"] in self.data.index:
                 if item["tournament_id"] not in age_in_weeks_by_tournament_id:
                     age_in_weeks_by_tournament_id[item["tournament_id"]] = get_age_in_weeks(
                         tournament_end_dates[item["tournament_id"]],
                         self.release_for_squads.date,
                     )
-                bonus = models.Player_rating_by_tournament(
-                    release_id=self.release.id,
-                    player_id=item["player_id"],
-                    weeks_since_tournament=age_in_weeks_by_tournament_id[item["tournament_id"]],
-                    tournament_id=item["tournament_id"],
-                    initial_score=item["rating_original"],
-                    cur_score=item["rating_now"],
+                bonuses.append(
+                    (
+                        item["player_id"],
+                        item["tournament_id"],
+                        item["rating_original"],
+                        age_in_weeks_by_tournament_id[item["tournament_id"]],
+                        item["rating_now"],
+                    )
                 )
-                self.players_dict[item["player_id"]]["top_bonuses"].append(bonus)
+        player_ids, tournament_ids, initial_scores, weeks, cur_scores = zip(*bonuses) if bonuses else ([],) * 5
+        return PlayerBonuses(
+            player_idx=self.get_player_idx(list(player_ids)),
+            tournament_id=tournament_ids,
+            initial_score=initial_scores,
+            weeks_since_tournament=weeks,
+            cur_score=cur_scores,
+        )
 
-    def calc_rt(self, player_ids, q=None):
+    def add_new_players(self, player_ids: npt.ArrayLike, release_date):
         """
-        вычисляет тех рейтинг по списку id игроков
+        добавляет игроков с нулевым рейтингом (и их базовые команды на дату релиза) одним шагом
         """
-        prs = self.data.rating.reindex(player_ids).fillna(0).values
-        return calc_tech_rating(prs, q)
+        if len(player_ids) == 0:
+            return
+        new_players = (
+            pd.DataFrame({"player_id": player_ids, "rating": 0})
+            .set_index("player_id")
+            .join(self.source.get_base_teams_for_players(release_date), how="left")
+        )
+        self.data = pd.concat([self.data, new_players])
+
+    # tournament_id is either one id for all bonuses or an id per bonus.
+    def add_bonuses(self, player_ids, tournament_id: npt.ArrayLike, scores):
+        self.bonuses.add(self.get_player_idx(player_ids), tournament_id, scores)
+
+    def calc_rts(self, rosters: Rosters, q=None) -> npt.ArrayLike:
+        """
+        вычисляет тех рейтинг по каждому из составов
+        """
+        prs = np.nan_to_num(self.get_values("rating", rosters.player_ids).astype(np.float64))
+        return calc_tech_ratings(prs, rosters.indptr, q)
 
-    def calc_tech_rating_all_teams(self, q=None) -> pd.Series:
+    def calc_tech_rating_all_teams(self, q=None, min_players: int = 0) -> pd.Series:
         """
         Рассчитывает технический рейтинг по базовому составу для всех команд, у которых есть
-        хотя бы один приписанный к ним игрок
-        :return: pd.Series, name: rating, index: base_team_id, values: техрейтинги
+        хотя бы min_players (и не меньше одного) приписанных к ним игроков
+        :return: pd.Series, name: trb, index: base_team_id, values: техрейтинги
         """
-        res = self.data.groupby("base_team_id")["rating"].apply(lambda x: calc_tech_rating(x.values, q))
-        res.name = "trb"
-        return res
+        players = self.data.loc[self.data["base_team_id"].notna(), ["base_team_id", "rating"]].sort_values(
+            "base_team_id", kind="stable"
+        )
+        team_ids, offsets = group_offsets(players["base_team_id"].to_numpy(dtype=np.int64))
+        res = pd.Series(
+            calc_tech_ratings(players["rating"].values, offsets, q),
+            index=pd.Index(team_ids, name="base_team_id"),
+            name="trb",
+        )
+        return res[np.diff(offsets) >= min_players]
 
     # Multiplies all existing bonuses by J_i constant
     def reduce_rating(self):
-        def reduce_vector(
-            player_ratings: List[models.Player_rating_by_tournament],
-        ) -> List[models.Player_rating_by_tournament]:
-            for player_rating in player_ratings:
-                player_rating.recalc_cur_score()
-            return player_ratings
-
-        self.data["top_bonuses"] = self.data["top_bonuses"].map(reduce_vector)
+        self.bonuses.reduce()
 
     # Removes all bonuses except top 7 and updates rating for each player
     def recalc_rating(self):
-        def leave_top_N(
-            v: List[models.Player_rating_by_tournament],
-        ) -> List[models.Player_rating_by_tournament]:
-            return sorted(v, key=lambda x: -x.raw_cur_score)[:N_BEST_TOURNAMENTS_FOR_PLAYER_RATING]
-
-        self.data["top_bonuses"] = self.data["top_bonuses"].map(leave_top_N)
+        self.bonuses.leave_top_n(N_BEST_TOURNAMENTS_FOR_PLAYER_RATING, len(self.data))
+        self.data["rating"] = self.bonuses.sum_by_player(len(self.data))
+        self.update_places()
 
-        def sum_ratings_now(v: List[models.Player_rating_by_tournament]) -> int:
-            return sum(x.cur_score for x in v)
 
-        self.data["rating"] = self.data["top_bonuses"].map(sum_ratings_now)
-        self.update_places()
+class TechRatingMemo:
+    """
+    Technical ratings of rosters (PlayerRating.calc_rts) calculated during one release step, while
+    players' ratings stay the same. Keyed by the sorted roster and Q, as the same roster often plays
+    several tournaments of a release.
+    """
+
+    def __init__(self, player_rating: PlayerRating):
+        self.player_rating = player_rating
+        self.tech_ratings = {}
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def calc_rts(self, rosters: Rosters, q=None) -> npt.ArrayLike:
+        sorted_ids = rosters.player_ids[np.lexsort((rosters.player_ids, rosters.team_idx()))]
+        keys = [(sorted_ids[start:end].tobytes(), q) for start, end in zip(rosters.indptr[:-1], rosters.indptr[1:])]
+        # The first roster with each key that is not in the memo yet.
+        missing = {}
+        for i, key in enumerate(keys):
+            if key not in self.tech_ratings and key not in missing:
+                missing[key] = i
+        if missing:
+            tech_ratings = self.player_rating.calc_rts(rosters.take(list(missing.values())), q)
+            self.tech_ratings.update(zip(missing, tech_ratings))
+        self.n_misses += len(missing)
+        self.n_hits += len(keys) - len(missing)
+        return np.array([self.tech_ratings[key] for key in keys], dtype=np.float64)
@@ -0,0 +1,88 @@
+import numpy as np
+import numpy.typing as npt
+from dataclasses import dataclass
+from itertools import chain
+from typing import Iterable, List
+
+
+@dataclass
+class Rosters:
+    """
+    Rosters of teams in compressed sparse row form: the players of team i are
+    player_ids[indptr[i] : indptr[i + 1]], and is_base marks the players of its base roster.
+    """
+
+    indptr: npt.NDArray
+    player_ids: npt.NDArray
+    is_base: npt.NDArray
+
+    @staticmethod
+    def from_entries(team_idx: npt.ArrayLike, player_ids: npt.ArrayLike, is_base: npt.ArrayLike, n_teams: int):
+        """
+        builds rosters from roster entries in any order; players of each team keep the order of entries
+        :param team_idx: number of the team (0 to n_teams - 1) of each entry
+        """
+        team_idx = np.asarray(team_idx, dtype=np.int64)
+        order = np.argsort(team_idx, kind="stable")
+        return Rosters(
+            indptr=np.concatenate([[0], np.cumsum(np.bincount(team_idx, minlength=n_teams))]),
+            player_ids=np.asarray(player_ids, dtype=np.int64)[order],
+            is_base=np.asarray(is_base, dtype=bool)[order],
+        )
+
+    @staticmethod
+    def from_lists(rosters: Iterable[List[int]], is_base: bool = False):
+        rosters = list(rosters)
+        sizes = np.array([len(roster) for roster in rosters], dtype=np.int64)
+        return Rosters(
+            indptr=np.concatenate([[0], np.cumsum(sizes)]),
+            player_ids=np.fromiter(chain.from_iterable(rosters), dtype=np.int64, count=sizes.sum()),
+            is_base=np.full(sizes.sum(), is_base),
+        )
+
+    @staticmethod
+    def concat(rosters: List["Rosters"]) -> "Rosters":
+        """
+        returns rosters of the teams of all given rosters, one after another
+        """
+        sizes = np.concatenate([r.sizes() for r in rosters])
+        return Rosters(
+            indptr=np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64),
+            player_ids=np.concatenate([r.player_ids for r in rosters]),
+            is_base=np.concatenate([r.is_base for r in rosters]),
+        )
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def sizes(self) -> npt.NDArray:
+        return np.diff(self.indptr)
+
+    def team_idx(self) -> npt.NDArray:
+        """
+        returns the team of each player in player_ids
+        """
+        return np.repeat(np.arange(len(self)), self.sizes())
+
+    def members(self, team: int) -> npt.NDArray:
+        return self.player_ids[self.indptr[team] : self.indptr[team + 1]]
+
+    def take(self, teams: npt.ArrayLike) -> "Rosters":
+        """
+        returns rosters of given teams, in the given order
+        """
+        teams = np.asarray(teams, dtype=np.int64)
+        sizes = self.sizes()[teams]
+        indptr = np.concatenate([[0], np.cumsum(sizes)])
+        entries = np.arange(indptr[-1]) + np.repeat(self.indptr[:-1][teams] - indptr[:-1], sizes)
+        return Rosters(indptr=indptr, player_ids=self.player_ids[entries], is_base=self.is_base[entries])
+
+    def base(self) -> "Rosters":
+        """
+        returns base rosters of the same teams
+        """
+        return Rosters(
+            indptr=np.concatenate([[0], np.cumsum(np.bincount(self.team_idx()[self.is_base], minlength=len(self)))]),
+            player_ids=self.player_ids[self.is_base],
+            is_base=self.is_base[self.is_base],
+        )
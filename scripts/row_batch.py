@@ -0,0 +1,68 @@
+import numpy as np
+import numpy.typing as npt
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from .tools import round_half_away_from_zero
+
+
+@dataclass
+class RowBatch:
+    """
+    Rows to be written into one table, stored by column: columns[name] holds the value of every row,
+    and nulls[name] (if present) marks the rows where that column is NULL. Values already have the
+    type of the column in our DB: int64 for integer columns, float64 for numeric ones, bool for booleans.
+    """
+
+    columns: Dict[str, npt.NDArray]
+    nulls: Dict[str, npt.NDArray] = field(default_factory=dict)
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def is_null(self, column: str) -> npt.NDArray:
+        if column in self.nulls:
+            return self.nulls[column]
+        return np.zeros(len(self), dtype=bool)
+
+    def take(self, indices: npt.ArrayLike) -> "RowBatch":
+        return RowBatch(
+            columns={column: values[indices] for column, values in self.columns.items()},
+            nulls={column: is_null[indices] for column, is_null in self.nulls.items()},
+        )
+
+    @staticmethod
+    def concat(batches: List["RowBatch"]) -> "RowBatch":
+        batches = [batch for batch in batches if len(batch)]
+        if not batches:
+            return RowBatch(columns={})
+        return RowBatch(
+            columns={
+                column: np.concatenate([batch.columns[column] for batch in batches]) for column in batches[0].columns
+            },
+            nulls={
+                column: np.concatenate([batch.is_null(column) for batch in batches])
+                for column in set().union(*(batch.nulls for batch in batches))
+            },
+        )
+
+    def to_dicts(self) -> List[dict]:
+        """
+        returns the rows one by one, with None for NULL values
+        """
+        columns = {
+            column: np.where(self.is_null(column), None, values).tolist() for column, values in self.columns.items()
+        }
+        return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+
+def integer_column(values: npt.ArrayLike) -> npt.NDArray:
+    """
+    converts values for an integer column, rounding them as Postgres does when a float is written
+    into it. NaN become 0, so the caller must mark them as NULL if they are possible.
+    """
+    return np.nan_to_num(round_half_away_from_zero(values)).astype(np.int64)
+
+
+def numeric_column(values: npt.ArrayLike) -> npt.NDArray:
+    return np.asarray(values, dtype=np.float64)
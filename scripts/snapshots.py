@@ -0,0 +1,63 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+# Bump this after changing what is stored in a snapshot, so that old snapshots are ignored.
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotStore:
+    """
+    Keeps the state of calculated releases in a local directory: one subdirectory per release, named
+    by its date, with one .npy file per array and meta.json with everything else. Arrays are read
+    memory-mapped, so reading a snapshot costs almost nothing until the arrays are used.
+
+    The store knows nothing about what the arrays mean; main.save_release_state and
+    main.load_release_state decide that and whether a snapshot is still valid.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, release_date: datetime.date) -> str:
+        return os.path.join(self.directory, release_date.isoformat())
+
+    def save(self, release_date: datetime.date, arrays: Dict[str, npt.NDArray], meta: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        # The snapshot is written aside and then moved into place, so that a crash in the middle
+        # of writing never leaves a half-written snapshot.
+        tmp_path = tempfile.mkdtemp(prefix=f".{release_date.isoformat()}.", dir=self.directory)
+        for name, values in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(values), allow_pickle=False)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({**meta, "snapshot_version": SNAPSHOT_VERSION}, f)
+        self.discard(release_date)
+        os.rename(tmp_path, self.path(release_date))
+
+    def load(self, release_date: datetime.date) -> Optional[Tuple[Dict[str, npt.NDArray], dict]]:
+        """
+        returns the arrays and meta of the snapshot of given release, or None if there is none
+        """
+        path = self.path(release_date)
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        if meta.pop("snapshot_version", None) != SNAPSHOT_VERSION:
+            return None
+        arrays = {
+            file_name[: -len(".npy")]: np.load(os.path.join(path, file_name), mmap_mode="r", allow_pickle=False)
+            for file_name in os.listdir(path)
+            if file_name.endswith(".npy")
+        }
+        return arrays, meta
+
+    def discard(self, release_date: datetime.date):
+        shutil.rmtree(self.path(release_date), ignore_errors=True)
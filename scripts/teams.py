@@ -1,6 +1,8 @@
-from .tools import calc_tech_rating, DataFrameBacked
+from .id_registry import IdRegistry
+from .tools import DataFrameBacked
 from .tournament import Tournament
-from .players import PlayerRating
+from .players import PlayerRating, TechRatingMemo
+from .rosters import Rosters
 from .constants import (
     TOP_TEAMS_FOR_Q_CALCULATION,
     PLAYERS_IN_TEAM_FOR_Q_CALCULATION,
@@ -10,21 +12,17 @@ from .constants import (
 )
 import pandas as pd
 import numpy as np
-from typing import List, Tuple
+import numpy.typing as npt
+from typing import List, Optional, Tuple
 
 
 class TeamRating(DataFrameBacked):
-    def __init__(self, filename=None, teams_list=None):
-        if not (filename or teams_list):
-            raise Exception("provide release id, or file with rating, or list of dicts!")
+    def __init__(self, teams_list=None, registry: Optional[IdRegistry] = None):
+        if not teams_list:
+            raise Exception("provide list of dicts!")
         self.q = 1
-        if teams_list:
-            self.data = pd.DataFrame(teams_list)
-        else:
-            raw_rating = pd.read_csv(filename)
-            raw_rating = raw_rating[["Ид", "Место", "Рейтинг", "ТРК по БС"]]
-            raw_rating.columns = ["team_id", "place", "rating", "trb"]
-            self.data = raw_rating
+        self.registry = registry
+        self.data = pd.DataFrame(teams_list)
         self.data.set_index("team_id", inplace=True)
         self.data["prev_rating"] = 0
         self.data["prev_place"] = self.data["place"]
@@ -38,16 +36,9 @@ class TeamRating(DataFrameBacked):
         игроков в базовом составе.
         """
         top_h = self.data.iloc[:TOP_TEAMS_FOR_Q_CALCULATION]
-        top_h_ids = set(top_h.index)
-        rb_raws = (
-            players_release.data[players_release.data["base_team_id"].isin(top_h_ids)]
-            .groupby("base_team_id")["rating"]
-            .apply(
-                lambda x: (calc_tech_rating(x.values) if len(x.values) >= PLAYERS_IN_TEAM_FOR_Q_CALCULATION else None)
-            )
-            .dropna()
-        )
-        top_h = top_h.join(rb_raws, rsuffix="_raw", how="inner")
+        rb_raws = players_release.calc_tech_rating_all_teams(min_players=PLAYERS_IN_TEAM_FOR_Q_CALCULATION)
+        rb_raws.name = "rating"
+        top_h = top_h.join(rb_raws[rb_raws.index.isin(set(top_h.index))], rsuffix="_raw", how="inner")
         self.q = (top_h["rating"] / top_h["rating_raw"]).mean()
 
     def calc_c(self):
@@ -55,16 +46,17 @@ class TeamRating(DataFrameBacked):
         ratings[::-1].sort()
         return MAX_BONUS / ratings[:TEAMS_COUNT_FOR_BP].dot(2.0 ** np.arange(0, -TEAMS_COUNT_FOR_BP, -1))
 
-    def get_team_rating(self, team_id):
-        return self.data.rating.get(team_id, 0)
+    def get_team_rating(self, team_ids: npt.ArrayLike) -> npt.NDArray:
+        return self.get_values("rating", team_ids)
 
-    def get_trb(self, team_id):
-        return self.data.trb.get(team_id, 0)
+    def get_trb(self, team_ids: npt.ArrayLike) -> npt.NDArray:
+        return self.get_values("trb", team_ids)
 
     # Returns tuples of team IDs with changed rating along with new rating
     # TODO: add a separate test for this!
     def update_ratings_for_changed_teams(self, changed_teams) -> List[Tuple[int, int]]:
-        existing_teams = [t for t in changed_teams if t in set(self.data.index)]
+        changed_teams = np.asarray(changed_teams, dtype=np.int64)
+        existing_teams = changed_teams[self.get_rows(changed_teams) >= 0]
         self.data["rating"] = self.data["rating"].astype("float64")
         self.data["old_release_rating"] = self.data["rating"]
         self.data.loc[existing_teams, "rating"] = np.maximum(
@@ -77,19 +69,38 @@ class TeamRating(DataFrameBacked):
         self.data.drop(columns=["old_release_rating"], inplace=True)
         return res
 
-    def add_new_teams(self, tournament: Tournament, player_rating: PlayerRating):
-        new_teams = tournament.data.loc[
-            ~tournament.data.team_id.isin(set(self.data.index)),
-            ["team_id", "baseTeamMembers"],
-        ].set_index("team_id")
-        if len(new_teams.index) == 0:  # Otherwise some strange things happen in the next lines.
+    def add_new_teams(
+        self, tournament: Tournament, player_rating: PlayerRating, rt_memo: Optional[TechRatingMemo] = None
+    ):
+        self.add_all_new_teams([tournament], player_rating, rt_memo)
+
+    def add_all_new_teams(
+        self,
+        tournaments: List[Tournament],
+        player_rating: PlayerRating,
+        rt_memo: Optional[TechRatingMemo] = None,
+    ):
+        """
+        adds the teams that are not in the rating yet, with the starting rating based on their base roster
+        in the first of the tournaments they play in. The table is extended once for all tournaments.
+        """
+        if not tournaments:
+            return
+        team_ids = np.concatenate([tournament.data.team_id.values for tournament in tournaments]).astype(np.int64)
+        is_new = self.get_rows(team_ids) < 0
+        is_new[np.setdiff1d(np.arange(len(team_ids)), np.unique(team_ids, return_index=True)[1])] = False
+        if not is_new.any():  # Otherwise some strange things happen in the next lines.
             return
-        new_teams["trb"] = new_teams.baseTeamMembers.map(lambda x: player_rating.calc_rt(x, self.q))
+        base_rosters = Rosters.concat([tournament.get_rosters(base_only=True) for tournament in tournaments])
+        new_teams = pd.DataFrame(
+            {"trb": (rt_memo or player_rating).calc_rts(base_rosters.take(np.flatnonzero(is_new)), self.q)},
+            index=pd.Index(team_ids[is_new], name="team_id"),
+        )
         new_teams.fillna({"trb": 0}, inplace=True)
         new_teams["rating"] = new_teams["trb"] * NEW_TEAMS_LOWERING_COEFFICIENT
         new_teams["prev_rating"] = None
         new_teams["prev_place"] = None
-        self.data = pd.concat([self.data, new_teams.drop("baseTeamMembers", axis=1)])
+        self.data = pd.concat([self.data, new_teams])
 
     def calc_trb(self, player_rating: PlayerRating):
         self.data["trb"] = player_rating.calc_tech_rating_all_teams(q=self.q)
@@ -0,0 +1,63 @@
+import contextlib
+import cProfile
+import datetime
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+# Gets one JSON line per release from log_release_stages; dj/settings.py logs it without prefixes.
+logger = logging.getLogger(__name__)
+
+
+class StageTimer:
+    """
+    Wall-clock seconds spent in named stages: `with timer("stage"): ...` adds to the time of the stage.
+    Stages are kept in the order they first ran.
+    """
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def __call__(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + time.perf_counter() - started
+
+
+# Logs the stages of a release as one JSON line, e.g.
+# {"release_date": "2025-01-16", "release_id": 190, "skipped": false, "total": 12.3, "stages": {"load_state": 1.2, ...}}
+# where total is the sum of the stages.
+def log_release_stages(
+    release_date: datetime.date, release_id: Optional[int], timer: StageTimer, skipped: bool = False, **extra
+):
+    line = {
+        "release_date": release_date.isoformat(),
+        "release_id": release_id,
+        "skipped": skipped,
+        **extra,
+        "total": round(sum(timer.seconds.values()), 6),
+        "stages": {stage: round(seconds, 6) for stage, seconds in timer.seconds.items()},
+    }
+    logger.info(json.dumps(line))
+
+
+# Profiles the code inside with cProfile and dumps the stats to profile_dir/<release date>.prof (to be read
+# with pstats or snakeviz). Does nothing if profile_dir is None. Only the current thread is profiled.
+@contextlib.contextmanager
+def profiled(profile_dir: Optional[str], release_date: datetime.date):
+    if profile_dir is None:
+        yield
+        return
+    os.makedirs(profile_dir, exist_ok=True)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(profile_dir, f"{release_date.isoformat()}.prof"))
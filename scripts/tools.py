@@ -1,10 +1,10 @@
 import copy
 import numpy as np
-import pandas as pd
 import datetime
 import numpy.typing as npt
-from typing import Optional
+from typing import Optional, Tuple
 from .constants import TECHNICAL_RATING_DISTRIBUTION, TECHNICAL_RATING_RELEVANT_PLAYERS
+from .id_registry import IdRegistry
 
 
 class DataFrameBacked:
@@ -12,16 +12,50 @@ class DataFrameBacked:
 
     Provides a cheap replacement for ``copy.deepcopy``: it isolates the DataFrame
     structure (so column assignments and concats don't leak) and shallow-copies the
-    scalar attributes, without recursively copying every cell. Object cells (e.g. a
-    ``top_bonuses`` column of lists) stay shared, so callers must discard the
-    original after copying.
+    scalar attributes, without recursively copying every cell. Object cells (if any)
+    stay shared, so callers must discard the original after copying.
+
+    Rows of ``data`` are looked up by the ids in its index through ``registry`` (an
+    IdRegistry, shared by the copies and by a chain of releases): the dense numbers of
+    the ids are mapped to rows with a plain array, rebuilt only when the index changes.
     """
 
+    registry: Optional[IdRegistry] = None
+    _rows_index = None
+    _row_by_number = None
+
     def copy(self):
         new = copy.copy(self)
         new.data = self.data.copy()
         return new
 
+    def get_rows(self, ids: npt.ArrayLike) -> npt.NDArray:
+        """
+        returns the rows of data with given ids in its index, -1 for ids that are not there
+        """
+        if self.registry is None:
+            self.registry = IdRegistry()
+        if self._rows_index is not self.data.index:
+            numbers = self.registry.register(self.data.index.values)
+            self._row_by_number = np.full(len(self.registry), -1, dtype=np.int64)
+            self._row_by_number[numbers] = np.arange(len(numbers))
+            self._rows_index = self.data.index
+        numbers = self.registry.lookup(ids)
+        # Ids registered after the rows were mapped (e.g. by another rating) are not in data.
+        numbers[numbers >= len(self._row_by_number)] = -1
+        if len(self._row_by_number) == 0:
+            return numbers
+        return np.where(numbers >= 0, self._row_by_number[numbers], -1)
+
+    def get_values(self, column: str, ids: npt.ArrayLike, default=0) -> npt.NDArray:
+        """
+        returns values of the column for given ids, default for ids that are not in data
+        """
+        rows = self.get_rows(ids)
+        if len(self.data) == 0:
+            return np.full(len(rows), default)
+        return np.where(rows >= 0, self.data[column].values[rows], default)
+
 
 def rolling_window(a: npt.ArrayLike, window: int) -> npt.ArrayLike:
     a = np.append(a, np.zeros(window - 1))
@@ -40,6 +74,45 @@ def calc_tech_rating(players_ratings: npt.ArrayLike, q: Optional[float] = None):
     return tech_rating
 
 
+def calc_tech_ratings(players_ratings: npt.ArrayLike, offsets: npt.ArrayLike, q: Optional[float] = None):
+    """
+    calc_tech_rating for many rosters at once
+    :param players_ratings: ratings of players of all rosters, roster by roster
+    :param offsets: ratings of roster i are players_ratings[offsets[i] : offsets[i + 1]]
+    :param q: optional multiplier, as in calc_tech_rating
+    :return: array of technical ratings of all rosters
+    """
+    players_ratings = np.asarray(players_ratings, dtype="float64")
+    offsets = np.asarray(offsets, dtype="int64")
+    n_rosters = len(offsets) - 1
+    roster_idx = np.repeat(np.arange(n_rosters), np.diff(offsets))
+    order = np.lexsort((-players_ratings, roster_idx))
+    rank = np.arange(len(order)) - offsets[roster_idx]
+    is_relevant = rank < TECHNICAL_RATING_RELEVANT_PLAYERS
+    top_ratings = np.zeros((n_rosters, TECHNICAL_RATING_RELEVANT_PLAYERS))
+    top_ratings[roster_idx[is_relevant], rank[is_relevant]] = players_ratings[order][is_relevant]
+    raw_tech_ratings = np.zeros(n_rosters)
+    for i in range(TECHNICAL_RATING_RELEVANT_PLAYERS):
+        raw_tech_ratings += top_ratings[:, i] * TECHNICAL_RATING_DISTRIBUTION[i]
+    tech_ratings = np.round(raw_tech_ratings)
+    # Sums that are (almost) exactly halfway between integers are rounded according to the last bits,
+    # which depend on the summation order; for them, we repeat what calc_tech_rating does.
+    for i in np.nonzero(np.abs(raw_tech_ratings - np.floor(raw_tech_ratings) - 0.5) < 1e-6)[0]:
+        tech_ratings[i] = calc_tech_rating(players_ratings[offsets[i] : offsets[i + 1]])
+    if q is not None:
+        tech_ratings *= q
+    return tech_ratings
+
+
+def group_offsets(keys: npt.ArrayLike) -> Tuple[npt.ArrayLike, npt.ArrayLike]:
+    """
+    given sorted array of keys, returns unique keys and offsets of their groups: key i occupies
+    keys[offsets[i] : offsets[i + 1]], e.g. [3, 3, 5] -> ([3, 5], [0, 2, 3])
+    """
+    unique_keys, starts = np.unique(keys, return_index=True)
+    return unique_keys, np.append(starts, len(keys))
+
+
 def calc_places(points: npt.ArrayLike) -> npt.ArrayLike:
     """
     given array of numbers that are treated that same kind of results or rankings, computes the
@@ -47,22 +120,83 @@ def calc_places(points: npt.ArrayLike) -> npt.ArrayLike:
     :param points: input array of some kind of results
     :return: array of corresponding places
     """
-    points_pd = pd.DataFrame(data=points, columns=["points"])
-    points_pd.sort_values(by="points", ascending=False, inplace=True)
-    points_pd["raw_places"] = np.arange(1, len(points) + 1)
-    places_series = points_pd.groupby("points").raw_places.mean()
-    return places_series.loc[points].values
-
-
-def calc_score_real(predicted_scores: npt.ArrayLike, positions: npt.ArrayLike) -> npt.ArrayLike:
-    positions = positions - 1
-    pos_counts = pd.Series(positions).value_counts().reset_index()
-    pos_counts.columns = ["pos", "n_teams"]
-    pos_counts["bonus"] = pos_counts.apply(
-        lambda x: np.mean(predicted_scores[int(x.pos - (x.n_teams - 1) / 2) : int(x.pos + (x.n_teams - 1) / 2) + 1]),
-        axis=1,
+    points = np.asarray(points)
+    order = np.argsort(-points, kind="stable")
+    sorted_points = points[order]
+    # Teams with equal points occupy a run [start, end) of the sorted array and share the mean of
+    # places start + 1, ..., end.
+    run_starts = np.flatnonzero(np.concatenate([[True], sorted_points[1:] != sorted_points[:-1]]))
+    run_ends = np.append(run_starts[1:], len(points))
+    places = np.empty(len(points), dtype=np.float64)
+    places[order] = np.repeat((run_starts + 1 + run_ends) / 2, run_ends - run_starts)
+    return places
+
+
+def round_half_away_from_zero(values: npt.ArrayLike) -> npt.ArrayLike:
+    """
+    rounds values the same way Postgres does when a float is written into an integer column,
+    e.g. [2.5, -2.5, 1.49] -> [3, -3, 1] (np.round would give [2, -2, 1])
+    :param values: input array of floats
+    :return: array of rounded floats
+    """
+    values = np.asarray(values, dtype="float64")
+    magnitude = np.abs(values)
+    whole = np.floor(magnitude)
+    return np.copysign(whole + (magnitude - whole >= 0.5), values)
+
+
+def calc_score_real(
+    predicted_scores: npt.ArrayLike, positions: npt.ArrayLike, offsets: Optional[npt.ArrayLike] = None
+) -> npt.ArrayLike:
+    """
+    computes the real score of every team: n teams sharing a position (e.g. 2.5 for two teams at
+    places 2 and 3) get the mean of predicted_scores over the places they share
+    :param predicted_scores: predicted scores of teams sorted by position
+    :param positions: positions of the teams (1-based, possibly shared)
+    :param offsets: if passed, the arrays hold several tournaments: tournament i occupies
+        offsets[i] : offsets[i + 1], and each of them is computed separately
+    :return: array of rounded real scores
+    """
+    predicted_scores = np.asarray(predicted_scores, dtype=np.float64)
+    positions = np.asarray(positions) - 1
+    if offsets is None:
+        offsets = np.array([0, len(positions)])
+    sizes = np.diff(offsets)
+    tournament_idx = np.repeat(np.arange(len(sizes)), sizes)
+    # Groups of teams sharing a position in a tournament.
+    order = np.lexsort((positions, tournament_idx))
+    is_group_start = np.ones(len(order), dtype=bool)
+    is_group_start[1:] = (positions[order][1:] != positions[order][:-1]) | (
+        tournament_idx[order][1:] != tournament_idx[order][:-1]
     )
-    return np.round(pos_counts.set_index("pos").loc[positions, "bonus"].values)
+    group_starts = np.flatnonzero(is_group_start)
+    inverse = np.empty(len(order), dtype=np.int64)
+    inverse[order] = np.cumsum(is_group_start) - 1
+    pos = positions[order][group_starts]
+    n_teams = np.diff(np.append(group_starts, len(order)))
+    group_tournament = tournament_idx[order][group_starts]
+    length, base = sizes[group_tournament], offsets[group_tournament]
+
+    starts = base + _slice_bound(np.trunc(pos - (n_teams - 1) / 2), length)
+    ends = base + _slice_bound(np.trunc(pos + (n_teams - 1) / 2) + 1, length)
+    ends = np.maximum(ends, starts)
+    cumulative = np.concatenate([[0], np.cumsum(predicted_scores)])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = (cumulative[ends] - cumulative[starts]) / (ends - starts)
+    # The prefix sums may differ from np.mean in the last bits, which matters only when the mean is
+    # close to .5 and for NaN scores; those means are recomputed exactly as before.
+    recompute = ~(np.abs(np.abs(means - np.trunc(means)) - 0.5) > 1e-6)
+    for i in np.flatnonzero(recompute):
+        means[i] = predicted_scores[starts[i] : ends[i]].mean() if ends[i] > starts[i] else np.nan
+    return np.round(means[inverse])
+
+
+def _slice_bound(bounds: npt.ArrayLike, length: npt.ArrayLike) -> npt.ArrayLike:
+    """
+    converts float slice bounds to the indices Python's slicing would use for them
+    """
+    bounds = bounds.astype(np.int64)
+    return np.clip(np.where(bounds < 0, bounds + length, bounds), 0, length)
 
 
 # Find the gap between two releases in weeks.
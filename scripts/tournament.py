@@ -1,9 +1,8 @@
 import pandas as pd
 import numpy as np
 import logging
-from collections import defaultdict
 from dataclasses import dataclass
-from typing import Any, Optional, Tuple, Set, List, Dict
+from typing import Any, Optional, Tuple, List, Dict
 import numpy.typing as npt
 from .constants import (
     D2_MULTIPLIER,
@@ -17,7 +16,8 @@ from .constants import (
     STRICT_SYNCHRONOUS_TOURNAMENT_COEFFICIENT,
     SYNCHRONOUS_TOURNAMENT_COEFFICIENT,
 )
-from scripts import tools, roster_continuity
+from scripts import db_tools, tools, roster_continuity
+from .rosters import Rosters
 from b import models
 
 logger = logging.getLogger(__name__)
@@ -35,62 +35,71 @@ class RosterEntry:
 
 
 class Tournament:
-    def __init__(self, trnmt_from_db: models.Tournament, release: models.Release):
+    def __init__(
+        self,
+        trnmt_from_db: models.Tournament,
+        release: models.Release,
+        team_scores: Optional[List[dict]] = None,
+        roster: Optional[List[dict]] = None,
+    ):
+        """
+        :param team_scores, roster: rows from db_tools.get_team_scores and db_tools.get_rosters for this
+            tournament, if they are already loaded (e.g. for many releases at once); otherwise they are read here
+        """
         self.coeff = self.tournament_type_to_coeff(trnmt_from_db.typeoft_id)
         self.id = trnmt_from_db.id
         self.release_id = release.id
         self.is_in_maii_rating = trnmt_from_db.maii_rating
         self.continuity_rule = roster_continuity.select_rule(trnmt_from_db.start_datetime.date())
+        if team_scores is None:
+            team_scores = db_tools.get_team_scores([trnmt_from_db])
+        if roster is None:
+            roster = list(db_tools.get_rosters([trnmt_from_db]))
 
         teams = {}
         logger.debug(f"Loading tournament {self.id}...")
-        for team_score in trnmt_from_db.team_score_set.select_related("team"):
-            if team_score.position in (None, 0, 9999):
+        for team_score in team_scores:
+            if team_score["position"] in (None, 0, 9999):
                 if self.is_in_maii_rating:
                     logger.debug(
-                        f"Tournament {self.id}: team {team_score.id} ({team_score.team.title}) has incorrect place {team_score.position}! Skipping this team."
+                        f"Tournament {self.id}: team {team_score['id']} ({team_score['team_name']}) has incorrect place {team_score['position']}! Skipping this team."
                     )
                 continue
-            teams[team_score.team_id] = {
-                "team_id": team_score.team_id,
-                "name": team_score.team.title,
-                "current_name": team_score.title,
-                "questionsTotal": team_score.total,
-                "position": team_score.position,
-                "n_base": 0,
-                "n_legs": 0,
-                "teamMembers": [],
-                "baseTeamMembers": [],
+            teams[team_score["team_id"]] = {
+                "team_id": team_score["team_id"],
+                "name": team_score["team_name"],
+                "current_name": team_score["title"],
+                "questionsTotal": team_score["total"],
+                "position": team_score["position"],
             }
         if len(teams) == 0:
             raise EmptyTournamentException("There are no teams.")
         if any(team["position"] > len(teams) for team in teams.values()):
             raise EmptyTournamentException("There are teams with impossible positions")
 
-        rosters = list(trnmt_from_db.roster_set.all())
-        chosen_team_by_player = self.deduplicate_rosters(
-            [RosterEntry(tp.team_id, tp.player_id, tp.flag) for tp in rosters if tp.team_id in teams]
+        roster_team_ids = np.fromiter((tp["team_id"] for tp in roster), dtype=np.int64, count=len(roster))
+        roster_player_ids = np.fromiter((tp["player_id"] for tp in roster), dtype=np.int64, count=len(roster))
+        roster_is_base = np.fromiter((tp["flag"] == "Б" for tp in roster), dtype=bool, count=len(roster))
+        team_played = np.isin(roster_team_ids, np.fromiter(teams, dtype=np.int64, count=len(teams)))
+        chosen_team_ids = np.zeros(len(roster), dtype=np.int64)
+        chosen_team_ids[team_played] = self.choose_teams(
+            roster_team_ids[team_played], roster_player_ids[team_played], roster_is_base[team_played]
         )
-        for team_player in rosters:
-            if team_player.team_id not in teams:
-                logger.debug(
-                    f"Tournament {self.id}, team {team_player.team_id}: player {team_player.player_id} is in roster but the team did not play there!"
-                )
-                continue
-            if chosen_team_by_player[team_player.player_id] != team_player.team_id:
-                logger.debug(
-                    f"Tournament {self.id}: player {team_player.player_id} rostered on multiple teams; "
-                    f"keeping team {chosen_team_by_player[team_player.player_id]}, dropping from team {team_player.team_id}"
-                )
-                continue
-            teams[team_player.team_id]["teamMembers"].append(team_player.player_id)
-            if team_player.flag == "Б":
-                teams[team_player.team_id]["n_base"] += 1
-                teams[team_player.team_id]["baseTeamMembers"].append(team_player.player_id)
-            else:
-                teams[team_player.team_id]["n_legs"] += 1
-
-        teams_without_players = [team_id for team_id, team_data in teams.items() if len(team_data["teamMembers"]) == 0]
+        is_kept = team_played & (chosen_team_ids == roster_team_ids)
+        if logger.isEnabledFor(logging.DEBUG):
+            for i in np.flatnonzero(~is_kept):
+                if not team_played[i]:
+                    logger.debug(
+                        f"Tournament {self.id}, team {roster_team_ids[i]}: player {roster_player_ids[i]} is in roster but the team did not play there!"
+                    )
+                else:
+                    logger.debug(
+                        f"Tournament {self.id}: player {roster_player_ids[i]} rostered on multiple teams; "
+                        f"keeping team {chosen_team_ids[i]}, dropping from team {roster_team_ids[i]}"
+                    )
+
+        teams_with_players = set(roster_team_ids[is_kept].tolist())
+        teams_without_players = [team_id for team_id in teams if team_id not in teams_with_players]
         if teams_without_players:
             if len(teams_without_players) == len(teams):
                 raise EmptyTournamentException("All teams have no players")
@@ -99,14 +108,38 @@ class Tournament:
             teams = self.adjust_for_missing_rosters(teams_without_players, teams)
 
         self.data = pd.DataFrame(teams.values())
+        # Rows of self.data may be reordered; roster_idx is the number of the team's roster in self.rosters.
+        self.data["roster_idx"] = np.arange(len(self.data))
+        team_idx = pd.Index(self.data.team_id).get_indexer(roster_team_ids[is_kept])
+        self.rosters = Rosters.from_entries(
+            team_idx, roster_player_ids[is_kept], roster_is_base[is_kept], n_teams=len(self.data)
+        )
+        self.data["n_base"] = np.bincount(team_idx[roster_is_base[is_kept]], minlength=len(self.data))
+        self.data["n_legs"] = self.rosters.sizes() - self.data["n_base"].values
         self.data["heredity"] = self.continuity_rule.counts(
             self.data.n_base, self.data.n_legs, self.data.name == self.data.current_name
         )
 
-    def add_ratings(self, team_rating, player_rating):
-        self.data["rt"] = self.data.teamMembers.map(lambda x: player_rating.calc_rt(x, team_rating.q))
-        self.data["r"] = np.where(self.data.heredity, self.data.team_id.map(team_rating.get_team_rating), 0)
-        self.data["rb"] = np.where(self.data.heredity, self.data.team_id.map(team_rating.get_trb), 0)
+    def get_rosters(self, base_only: bool = False) -> Rosters:
+        """
+        returns rosters of the teams in the order of rows of self.data
+        """
+        rosters = self.rosters.take(self.data.roster_idx.values)
+        return rosters.base() if base_only else rosters
+
+    # rt_memo (players.TechRatingMemo for player_rating), if passed, is used to calculate RTs.
+    def add_ratings(self, team_rating, player_rating, rt_memo=None):
+        self.set_ratings(
+            rt=(rt_memo or player_rating).calc_rts(self.get_rosters(), team_rating.q),
+            r=team_rating.get_team_rating(self.data.team_id.values),
+            rb=team_rating.get_trb(self.data.team_id.values),
+        )
+
+    # Sets RT of teams and their R and RB from the release rating, and calculates their game rating.
+    def set_ratings(self, rt: npt.ArrayLike, r: npt.ArrayLike, rb: npt.ArrayLike):
+        self.data["rt"] = rt
+        self.data["r"] = np.where(self.data.heredity, r, 0)
+        self.data["rb"] = np.where(self.data.heredity, rb, 0)
         self.data["rg"] = np.where(self.data.rb, self.data.r * self.data.rt / self.data.rb, self.data.rt)
         self.data["rg"] = np.where(
             self.data.rt < self.data.rb,
@@ -116,65 +149,107 @@ class Tournament:
         self.data["expected_place"] = tools.calc_places(self.data["rg"].values)
 
     @staticmethod
-    def calculate_bonus_predictions(tournament_ratings: npt.ArrayLike, c=1):
+    def calculate_bonus_predictions(
+        tournament_ratings: npt.ArrayLike, c=1, offsets: Optional[npt.ArrayLike] = None
+    ) -> npt.ArrayLike:
         """
         produces array of bonuses based on the array of game ratings of participants
         :parameter tournament_ratings - sorted descending game ratings (rg) of teams
+        :parameter offsets - if passed, tournament_ratings holds several tournaments: tournament i
+            occupies offsets[i] : offsets[i + 1], and each of them is sorted separately
         """
-        raw_preds = np.round(
-            tools.rolling_window(tournament_ratings, TEAMS_COUNT_FOR_BP).dot(
-                2.0 ** np.arange(0, -TEAMS_COUNT_FOR_BP, -1)
-            )
-            * c
-        )
-        samesies = tournament_ratings[:-1] == tournament_ratings[1:]
-        for ind in np.nonzero(samesies)[0]:
-            raw_preds[ind + 1] = raw_preds[ind]
-        return raw_preds
-
-    def calc_d1(self):
-        d_one = self.data.score_real - self.data.score_pred
-        d_one[d_one < 0] *= D1_NEGATIVE_LOWERING_COEFFICIENT
-        return d_one
+        if offsets is None:
+            offsets = np.array([0, len(tournament_ratings)])
+        sizes = np.diff(offsets)
+        # Each tournament is followed by zeros in the window, as if it were the only one.
+        padded_offsets = offsets + np.arange(len(offsets)) * (TEAMS_COUNT_FOR_BP - 1)
+        padded = np.zeros(padded_offsets[-1] + TEAMS_COUNT_FOR_BP - 1)
+        rows = np.arange(len(tournament_ratings)) + np.repeat(padded_offsets[:-1] - offsets[:-1], sizes)
+        padded[rows] = tournament_ratings
+        windows = np.lib.stride_tricks.sliding_window_view(padded, TEAMS_COUNT_FOR_BP)[rows]
+        raw_preds = np.round(windows.dot(2.0 ** np.arange(0, -TEAMS_COUNT_FOR_BP, -1)) * c)
+        # Teams with equal ratings get the prediction of the first of them.
+        is_run_start = np.ones(len(tournament_ratings), dtype=bool)
+        is_run_start[1:] = tournament_ratings[1:] != tournament_ratings[:-1]
+        is_run_start[offsets[:-1][sizes > 0]] = True
+        return raw_preds[np.maximum.accumulate(np.where(is_run_start, np.arange(len(raw_preds)), 0))]
 
     def calc_bonuses(self, team_rating):
-        self.data.sort_values(by="rg", ascending=False, inplace=True)
-        self.data["score_pred"] = self.calculate_bonus_predictions(self.data.rg.values, c=team_rating.c)
-        self.data["score_real"] = tools.calc_score_real(self.data.score_pred.values, self.data.position.values)
-        self.data["D1"] = self.calc_d1()
-        self.data["D2"] = D2_MULTIPLIER * np.exp((self.data.score_real - MAX_BONUS) / D2_EXPONENT_DENOMINATOR)
-        self.data["bonus_raw"] = (self.coeff * (self.data["D1"] + self.data["D2"])).astype("float64")
-        self.data["bonus"] = self.data.bonus_raw
-        self.data.loc[
-            self.data.heredity & (self.data.n_legs >= MIN_LEGIONNAIRES_TO_REDUCE_BONUS),
-            "bonus",
-        ] *= 2 / self.data[self.data.heredity & (self.data.n_legs >= MIN_LEGIONNAIRES_TO_REDUCE_BONUS)]["n_legs"]
-        self.data.sort_values(by=["position", "name"], inplace=True)
+        self.calc_all_bonuses([self], team_rating)
+
+    @staticmethod
+    def calc_all_bonuses(tournaments: List["Tournament"], team_rating):
+        """
+        calculates bonuses for all tournaments of a release at once: their teams are stacked into one
+        table, every step is done for all of them and the results are split back by tournament
+        """
+        tournaments = [tournament for tournament in tournaments if len(tournament.data)]
+        if not tournaments:
+            return
+        data = pd.concat([tournament.data for tournament in tournaments])
+        sizes = np.array([len(tournament.data) for tournament in tournaments])
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+        tournament_idx = np.repeat(np.arange(len(tournaments)), sizes)
+
+        # Teams of each tournament sorted by rg descending.
+        data = data.iloc[np.lexsort((-data.rg.values, tournament_idx))]
+        score_pred = Tournament.calculate_bonus_predictions(data.rg.values, c=team_rating.c, offsets=offsets)
+        score_real = tools.calc_score_real(score_pred, data.position.values, offsets=offsets)
+        d_one = score_real - score_pred
+        d_one = np.where(d_one < 0, d_one * D1_NEGATIVE_LOWERING_COEFFICIENT, d_one)
+        d_two = D2_MULTIPLIER * np.exp((score_real - MAX_BONUS) / D2_EXPONENT_DENOMINATOR)
+        coeffs = np.repeat([tournament.coeff for tournament in tournaments], sizes)
+        bonus_raw = (coeffs * (d_one + d_two)).astype("float64")
+        n_legs = data.n_legs.values
+        with_legionnaires = data.heredity.values & (n_legs >= MIN_LEGIONNAIRES_TO_REDUCE_BONUS)
+        data = data.assign(
+            score_pred=score_pred,
+            score_real=score_real,
+            D1=d_one,
+            D2=d_two,
+            bonus_raw=bonus_raw,
+            bonus=np.where(with_legionnaires, bonus_raw * (2 / np.maximum(n_legs, 1)), bonus_raw),
+        )
+
+        # lexsort is stable, so teams with equal position and name keep their order by rg.
+        names = pd.factorize(data.name, sort=True)[0]
+        names[names < 0] = len(names)
+        data = data.iloc[np.lexsort((names, data.position.values, tournament_idx))]
+        for tournament, start, end in zip(tournaments, offsets[:-1], offsets[1:]):
+            tournament.data = data.iloc[start:end].copy()
 
     def apply_bonuses(self, team_rating, player_rating) -> Tuple[Any, Any]:
-        for i, team in self.data.iterrows():
-            if team["heredity"]:
-                team_rating.data.at[team["team_id"], "rating"] += team["bonus"]
-            for player_id in team["teamMembers"]:
-                bonus = models.Player_rating_by_tournament(
-                    release_id=self.release_id,
-                    player_id=player_id,
-                    weeks_since_tournament=0,
-                    tournament_id=self.id,
-                    initial_score=team["score_real"],
-                    cur_score=team["score_real"],
-                )
-                bonus.raw_cur_score = bonus.cur_score
-                player_rating.data.loc[player_id]["top_bonuses"].append(bonus)
+        return self.apply_all_bonuses([self], team_rating, player_rating)
+
+    @staticmethod
+    def apply_all_bonuses(tournaments: List["Tournament"], team_rating, player_rating) -> Tuple[Any, Any]:
+        """
+        adds bonuses of all tournaments to the ratings of their teams and to the players of their rosters,
+        in the order of tournaments and their teams
+        """
+        if not tournaments:
+            return team_rating, player_rating
+        teams = pd.concat([tournament.data[["team_id", "heredity", "bonus"]] for tournament in tournaments])
+        teams = teams[teams.heredity.values]
+        ratings = team_rating.data["rating"].to_numpy(dtype=np.float64, copy=True)
+        rows = team_rating.get_rows(teams.team_id.values)
+        # A missing team would get row -1, i.e. the bonus of the last team.
+        if (rows < 0).any():
+            raise KeyError(f"Teams {list(teams.team_id.values[rows < 0])} are not in the rating")
+        # np.add.at adds bonuses one by one, so a team playing several tournaments gets them in order.
+        np.add.at(ratings, rows, teams.bonus.values)
+        team_rating.data["rating"] = ratings
+
+        rosters = explode_rosters(tournaments)
+        player_rating.add_bonuses(rosters.player_id.values, rosters.tournament_id.values, rosters.score_real.values)
         return team_rating, player_rating
 
-    def get_new_player_ids(self, existing_players: Set[int]) -> Set[int]:
-        res = set()
-        for i, team in self.data.iterrows():
-            for player_id in team["teamMembers"]:
-                if player_id not in existing_players:
-                    res.add(player_id)
-        return res
+    @staticmethod
+    def get_new_player_ids(tournaments: List["Tournament"], existing_player_ids: npt.ArrayLike) -> npt.NDArray:
+        """
+        returns sorted ids of players who play in the tournaments but are not in existing_player_ids
+        """
+        return np.setdiff1d(explode_rosters(tournaments).player_id.values, existing_player_ids)
 
     @staticmethod
     def tournament_type_to_coeff(ttype: int) -> float:
@@ -193,15 +268,26 @@ class Tournament:
         A player rostered on several teams is kept on the base ("Б") team;
         if the flag ties (several base teams, or none), the smallest team_id wins.
         """
-        entries_by_player: Dict[int, List[RosterEntry]] = defaultdict(list)
-        for entry in roster_entries:
-            entries_by_player[entry.player_id].append(entry)
+        player_ids = np.array([entry.player_id for entry in roster_entries], dtype=np.int64)
+        chosen_team_ids = Tournament.choose_teams(
+            np.array([entry.team_id for entry in roster_entries], dtype=np.int64),
+            player_ids,
+            np.array([entry.flag == "Б" for entry in roster_entries], dtype=bool),
+        )
+        return dict(zip(player_ids.tolist(), chosen_team_ids.tolist()))
 
-        chosen: Dict[int, int] = {}
-        for player_id, entries in entries_by_player.items():
-            base_team_ids = sorted(entry.team_id for entry in entries if entry.flag == "Б")
-            chosen[player_id] = base_team_ids[0] if base_team_ids else min(entry.team_id for entry in entries)
-        return chosen
+    @staticmethod
+    def choose_teams(team_ids: npt.NDArray, player_ids: npt.NDArray, is_base: npt.NDArray) -> npt.NDArray:
+        """
+        deduplicate_rosters for roster entries given as arrays
+        :return: for each entry, the team its player counts for
+        """
+        # For each player, the base teams go first, then the teams by id.
+        order = np.lexsort((team_ids, ~is_base, player_ids))
+        sorted_player_ids = player_ids[order]
+        is_first = np.ones(len(order), dtype=bool)
+        is_first[1:] = sorted_player_ids[1:] != sorted_player_ids[:-1]
+        return team_ids[order][is_first][np.cumsum(is_first) - 1][np.argsort(order)]
 
     @staticmethod
     def adjust_for_missing_rosters(teams_without_rosters: List[int], teams: Dict):
@@ -230,3 +316,32 @@ class Tournament:
             del teams[team_id]
 
         return teams
+
+
+def explode_rosters(tournaments: List[Tournament]) -> pd.DataFrame:
+    """
+    returns a row per player of every team of the tournaments, in the order of tournaments, their teams
+    and rosters, with columns tournament_id, team_id, player_id and score_real (if bonuses are calculated)
+    """
+    if not tournaments:
+        return pd.DataFrame({"tournament_id": [], "team_id": [], "player_id": []}, dtype=np.int64)
+    rosters = [tournament.get_rosters() for tournament in tournaments]
+    n_players = np.concatenate([roster.sizes() for roster in rosters])
+    res = pd.DataFrame(
+        {
+            "tournament_id": np.repeat(
+                np.array([tournament.id for tournament in tournaments], dtype=np.int64),
+                [len(roster.player_ids) for roster in rosters],
+            ),
+            "team_id": np.repeat(
+                np.concatenate([tournament.data.team_id.values for tournament in tournaments]).astype(np.int64),
+                n_players,
+            ),
+            "player_id": np.concatenate([roster.player_ids for roster in rosters]),
+        }
+    )
+    if all("score_real" in tournament.data for tournament in tournaments):
+        res["score_real"] = np.repeat(
+            np.concatenate([tournament.data.score_real.values for tournament in tournaments]), n_players
+        )
+    return res
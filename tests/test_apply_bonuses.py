@@ -0,0 +1,81 @@
+import unittest
+from dotenv import load_dotenv
+
+load_dotenv("../.env.test")
+
+import django
+
+django.setup()
+
+import pandas as pd
+
+from scripts.player_bonuses import PlayerBonuses
+from scripts.players import PlayerRating
+from scripts.rosters import Rosters
+from scripts.teams import TeamRating
+from scripts.tournament import Tournament, explode_rosters
+
+
+def make_tournament(tournament_id, teams):
+    tournament = Tournament.__new__(Tournament)
+    tournament.id = tournament_id
+    tournament.data = pd.DataFrame(teams, columns=["team_id", "heredity", "bonus", "score_real", "players"])
+    tournament.rosters = Rosters.from_lists(tournament.data.pop("players"))
+    tournament.data["roster_idx"] = range(len(teams))
+    return tournament
+
+
+class TestApplyBonuses(unittest.TestCase):
+    def setUp(self):
+        self.tournaments = [
+            make_tournament(10, [(1, True, 100.25, 2000.0, [11, 12]), (2, False, 50.0, 1500.0, [21])]),
+            make_tournament(20, [(2, True, -30.5, 1000.0, [21, 12]), (1, True, 0.5, 900.0, [])]),
+        ]
+        self.team_rating = TeamRating(
+            teams_list=[
+                {"team_id": team_id, "rating": 6000 - 1000 * team_id, "trb": 0, "place": team_id}
+                for team_id in range(1, 16)
+            ]
+        )
+        self.player_rating = PlayerRating.__new__(PlayerRating)
+        self.player_rating.data = pd.DataFrame({"rating": [0, 0, 0]}, index=[11, 12, 21])
+        self.player_rating.bonuses = PlayerBonuses()
+
+    def test_explode_rosters(self):
+        rosters = explode_rosters(self.tournaments)
+        self.assertEqual([10, 10, 10, 20, 20], list(rosters.tournament_id))
+        self.assertEqual([1, 1, 2, 2, 2], list(rosters.team_id))
+        self.assertEqual([11, 12, 21, 21, 12], list(rosters.player_id))
+        self.assertEqual([2000, 2000, 1500, 1000, 1000], list(rosters.score_real))
+
+    def test_apply_all_bonuses(self):
+        Tournament.apply_all_bonuses(self.tournaments, self.team_rating, self.player_rating)
+        # Team 2 did not get its bonus for tournament 10, as it is not the same team there.
+        self.assertEqual([5000 + 100.25 + 0.5, 4000 - 30.5], list(self.team_rating.data.rating[:2]))
+        bonuses = self.player_rating.bonuses
+        self.assertEqual(5, len(bonuses))
+        self.assertEqual([0, 1, 2, 2, 1], list(bonuses.player_idx))
+        self.assertEqual([10, 10, 10, 20, 20], list(bonuses.tournament_id))
+        self.assertEqual([2000, 2000, 1500, 1000, 1000], list(bonuses.initial_score))
+
+    def test_same_as_one_by_one(self):
+        team_rating, player_rating = self.team_rating.copy(), self.player_rating.copy()
+        for tournament in self.tournaments:
+            tournament.apply_bonuses(team_rating, player_rating)
+        Tournament.apply_all_bonuses(self.tournaments, self.team_rating, self.player_rating)
+        self.assertEqual(list(team_rating.data.rating), list(self.team_rating.data.rating))
+        self.assertEqual(len(player_rating.bonuses), len(self.player_rating.bonuses))
+        self.assertEqual(list(player_rating.bonuses.tournament_id), list(self.player_rating.bonuses.tournament_id))
+
+    def test_team_missing_from_rating(self):
+        tournaments = [make_tournament(30, [(99, True, 10.0, 500.0, [11])])]
+        with self.assertRaises(KeyError):
+            Tournament.apply_all_bonuses(tournaments, self.team_rating, self.player_rating)
+        self.assertEqual(6000 - 15000, self.team_rating.data.rating.iloc[-1])
+
+    def test_get_new_player_ids(self):
+        self.assertEqual([12, 21], list(Tournament.get_new_player_ids(self.tournaments, [11, 30])))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from dotenv import load_dotenv
+
+load_dotenv("../.env.test")
+
+import django
+
+django.setup()
+
+import numpy as np
+
+from scripts import benchmark
+from scripts.data_sources import BundleDataSource
+
+TINY = benchmark.SeasonConfig(n_teams=60, n_players=500, n_regular=1, n_synchronous=2, n_strictly_synchronous=1)
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_generate_season(self):
+        tables = benchmark.generate_season(TINY, seed=1)
+        self.assertEqual(4, len(tables["tournaments"]))
+        rosters = tables["rosters"].columns
+        self.assertTrue(set(rosters["flag"]) <= {"Б", "Л"})
+        # A player plays at most once per team in a tournament.
+        entries = set(zip(rosters["tournament_id"], rosters["team_id"], rosters["player_id"]))
+        self.assertEqual(len(rosters["player_id"]), len(entries))
+        base = tables["season_rosters"].columns
+        base_entries = set(zip(base["team_id"], base["player_id"]))
+        is_base = rosters["flag"] == "Б"
+        self.assertTrue(set(zip(rosters["team_id"][is_base], rosters["player_id"][is_base])) <= base_entries)
+        self.assertTrue((~is_base).any())
+        source = BundleDataSource(tables)
+        rows = source.get_tournament_rows_by_release([benchmark.RELEASE_DATE])[benchmark.RELEASE_DATE]
+        self.assertEqual(4, len(rows))
+
+    def test_same_seed_same_season(self):
+        first = benchmark.generate_season(TINY, seed=3)
+        second = benchmark.generate_season(TINY, seed=3)
+        for table, rows in first.items():
+            for column, values in rows.columns.items():
+                np.testing.assert_array_equal(values, second[table].columns[column], err_msg=f"{table}.{column}")
+
+    def test_run_benchmark(self):
+        results = benchmark.run_benchmark([1, 2], TINY, seed=1)
+        self.assertEqual([1, 2], [run["scale"] for run in results["runs"]])
+        stages = results["runs"][1]["stages"]
+        # The stages of main.calc_release, including the ones around the step itself.
+        for stage in ["load_state", "input_fingerprint", "add_ratings", "calc_bonuses", "build_state", "write"]:
+            self.assertIn(stage, stages)
+        self.assertNotIn("fast_insert", stages)
+        self.assertEqual(120, results["runs"][1]["config"]["n_teams"])
+        self.assertTrue(benchmark.compare_results(results, results))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from dotenv import load_dotenv
+
+load_dotenv("../.env.test")
+
+import django
+
+django.setup()
+
+import numpy as np
+
+from scripts import tools
+from scripts.constants import TEAMS_COUNT_FOR_BP
+from scripts.tournament import Tournament
+
+
+class TestBonusPredictions(unittest.TestCase):
+    def test_ties_get_prediction_of_first_team(self):
+        preds = Tournament.calculate_bonus_predictions(np.array([4000.0, 2000, 2000, 2000, 1000]))
+        self.assertEqual([preds[1]] * 3, list(preds[1:4]))
+        self.assertGreater(preds[0], preds[1])
+        self.assertGreater(preds[1], preds[4])
+
+    def test_matches_rolling_window(self):
+        # The previous implementation for one tournament.
+        ratings = np.sort(np.random.default_rng(0).integers(0, 50, size=40) * 100.0)[::-1]
+        raw_preds = np.round(
+            tools.rolling_window(ratings, TEAMS_COUNT_FOR_BP).dot(2.0 ** np.arange(0, -TEAMS_COUNT_FOR_BP, -1)) * 0.9
+        )
+        for ind in np.nonzero(ratings[:-1] == ratings[1:])[0]:
+            raw_preds[ind + 1] = raw_preds[ind]
+        self.assertEqual(list(raw_preds), list(Tournament.calculate_bonus_predictions(ratings, c=0.9)))
+
+    def test_many_tournaments_same_as_one_by_one(self):
+        rng = np.random.default_rng(0)
+        ratings = [np.sort(rng.integers(0, 30, size=rng.integers(1, 60)) * 500.0)[::-1] for _ in range(50)]
+        # Tournaments whose last and next first ratings are equal must not be treated as ties.
+        ratings[1][0] = ratings[0][-1]
+        offsets = np.concatenate([[0], np.cumsum([len(r) for r in ratings])])
+        positions = [tools.calc_places(r) for r in ratings]
+
+        preds = Tournament.calculate_bonus_predictions(np.concatenate(ratings), c=1.1, offsets=offsets)
+        scores = tools.calc_score_real(preds, np.concatenate(positions), offsets=offsets)
+        for i, (r, p) in enumerate(zip(ratings, positions)):
+            expected_preds = Tournament.calculate_bonus_predictions(r, c=1.1)
+            self.assertEqual(list(expected_preds), list(preds[offsets[i] : offsets[i + 1]]))
+            self.assertEqual(list(tools.calc_score_real(expected_preds, p)), list(scores[offsets[i] : offsets[i + 1]]))
+
+
+if __name__ == "__main__":
+    unittest.main()
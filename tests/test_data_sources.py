@@ -0,0 +1,257 @@
+import datetime
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from dotenv import load_dotenv
+
+load_dotenv("../.env.test")
+
+import django
+
+django.setup()
+
+import numpy as np
+
+from b.models import Release
+from scripts import data_sources
+from scripts.changes import fingerprint
+from scripts.main import SeasonInputs, build_input_rows, calc_all_releases
+from scripts.row_batch import RowBatch
+
+PREV_RELEASE = datetime.date(2022, 1, 6)
+FIRST_TO_CALC = datetime.date(2022, 1, 13)
+LAST_TO_CALC = datetime.date(2022, 1, 20)
+N_TEAMS = 20
+PLAYERS_PER_TEAM = 6
+
+
+# A bundle with 20 teams of 6 players, and two tournaments of 10 teams a week.
+def make_bundle_tables():
+    team_ids = np.arange(1, N_TEAMS + 1)
+    player_ids = np.arange(1, N_TEAMS * PLAYERS_PER_TEAM + 1)
+    player_teams = np.repeat(team_ids, PLAYERS_PER_TEAM)
+    tournaments, team_scores, rosters = [], [], []
+    for week in range(3):
+        for i in range(2):
+            tournament_id = 10 * (week + 1) + i
+            end = datetime.datetime(2022, 1, 8, 12, tzinfo=datetime.timezone.utc) + datetime.timedelta(weeks=week)
+            tournaments.append((tournament_id, "Турнир", 2, True, end - datetime.timedelta(days=1), end))
+            playing = team_ids[i::2]
+            for position, team_id in enumerate(playing, start=1):
+                team_scores.append(
+                    (
+                        1000 * tournament_id + team_id,
+                        tournament_id,
+                        team_id,
+                        f"Команда {team_id}",
+                        40 - position,
+                        float(position),
+                        f"Команда {team_id}",
+                    )
+                )
+                for player_id in player_ids[player_teams == team_id]:
+                    rosters.append((tournament_id, team_id, player_id, "Б"))
+    return {
+        "bundle": RowBatch(
+            columns={
+                "first_to_calc": np.array([FIRST_TO_CALC.toordinal()]),
+                "last_to_calc": np.array([LAST_TO_CALC.toordinal()]),
+            }
+        ),
+        "release": RowBatch(columns={"id": np.array([1]), "date": np.array([PREV_RELEASE.toordinal()])}),
+        "team_rating": RowBatch(
+            columns={
+                "release_id": np.ones(N_TEAMS, dtype=np.int64),
+                "team_id": team_ids,
+                "rating": 10000 - 100 * team_ids,
+                "trb": 9000 - 100 * team_ids,
+                "place": team_ids.astype(np.float64),
+            }
+        ),
+        "player_rating": RowBatch(
+            columns={
+                "release_id": np.ones(len(player_ids), dtype=np.int64),
+                "player_id": player_ids,
+                "rating": 3000 - 10 * player_ids,
+            }
+        ),
+        "player_rating_by_tournament": RowBatch(
+            columns={
+                "release_id": np.ones(len(player_ids), dtype=np.int64),
+                "player_id": player_ids,
+                "tournament_id": np.full(len(player_ids), 1),
+                "tournament_result_id": np.zeros(len(player_ids), dtype=np.int64),
+                "initial_score": 3000 - 10 * player_ids,
+                "weeks_since_tournament": np.zeros(len(player_ids), dtype=np.int64),
+                "cur_score": 3000 - 10 * player_ids,
+            }
+        ),
+        "tournaments": RowBatch(
+            columns={
+                "id": np.array([t[0] for t in tournaments]),
+                "title": np.array([t[1] for t in tournaments]),
+                "typeoft_id": np.array([t[2] for t in tournaments]),
+                "maii_rating": np.array([t[3] for t in tournaments]),
+                "start_datetime": data_sources.datetime_column([t[4] for t in tournaments]),
+                "end_datetime": data_sources.datetime_column([t[5] for t in tournaments]),
+            }
+        ),
+        "team_scores": data_sources._rows_from_values(
+            team_scores,
+            {
+                "id": np.int64,
+                "tournament_id": np.int64,
+                "team_id": np.int64,
+                "title": str,
+                "total": np.int64,
+                "position": np.float64,
+                "team_name": str,
+            },
+            nullable=["position"],
+        ),
+        "rosters": data_sources._rows_from_values(
+            rosters,
+            {"tournament_id": np.int64, "team_id": np.int64, "player_id": np.int64, "flag": str},
+            nullable=["flag"],
+        ),
+        "seasons": RowBatch(
+            columns={
+                "id": np.array([1]),
+                "start": np.array([datetime.date(2021, 9, 1).toordinal()]),
+                "end": np.array([datetime.date(2022, 8, 31).toordinal()]),
+            }
+        ),
+        "season_rosters": RowBatch(
+            columns={
+                "season_id": np.ones(len(player_ids), dtype=np.int64),
+                "team_id": player_teams,
+                "player_id": player_ids,
+                "start_date": np.full(len(player_ids), datetime.date(2021, 9, 1).toordinal()),
+                "end_date": np.zeros(len(player_ids), dtype=np.int64),
+            },
+            nulls={
+                "start_date": np.zeros(len(player_ids), dtype=bool),
+                "end_date": np.ones(len(player_ids), dtype=bool),
+            },
+        ),
+    }
+
+
+class TestDataSource(unittest.TestCase):
+    def test_incomplete_source_cannot_be_created(self):
+        class ReleasesOnly(data_sources.DataSource):
+            def get_release(self, release_date, create=False):
+                return Release(date=release_date)
+
+        with self.assertRaises(TypeError):
+            ReleasesOnly()
+
+
+class TestBundleDataSource(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "inputs.npz")
+        data_sources.save_bundle(self.path, make_bundle_tables())
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_save_and_load(self):
+        tables = data_sources.load_bundle(self.path)
+        self.assertEqual(set(make_bundle_tables()), set(tables))
+        self.assertEqual([False] * 10, list(tables["rosters"].is_null("flag")[:10]))
+        self.assertEqual("Команда 1", tables["team_scores"].columns["title"][0])
+
+    def test_reads(self):
+        source = data_sources.BundleDataSource.load(self.path)
+        teams = source.get_team_ratings(1)
+        self.assertEqual({"team_id": 1, "rating": 9900, "trb": 8900, "place": 1}, teams[0])
+        self.assertEqual(1, source.get_base_teams_for_players(FIRST_TO_CALC)[6])
+        self.assertEqual(set(range(1, N_TEAMS + 1)), source.get_season_team_ids(source.get_season(FIRST_TO_CALC)))
+        rows = source.get_tournament_rows_by_release([FIRST_TO_CALC, LAST_TO_CALC])
+        self.assertEqual([10, 11], [tournament.tournament.id for tournament in rows[FIRST_TO_CALC]])
+        self.assertEqual(10, len(rows[FIRST_TO_CALC][0].team_scores))
+        self.assertEqual("Б", rows[FIRST_TO_CALC][0].roster[0]["flag"])
+
+    def test_calc_all_releases(self):
+        source = data_sources.BundleDataSource.load(self.path)
+        calc_all_releases(FIRST_TO_CALC, LAST_TO_CALC, source=source)
+        # The releases are created in the bundle, and the last one is the state read by the next step.
+        last_release = source.get_release(LAST_TO_CALC + datetime.timedelta(days=7))
+        self.assertIsNotNone(last_release.hash)
+        self.assertEqual(N_TEAMS, len(source.get_team_ratings(last_release.id)))
+        self.assertEqual(
+            {(release.id, "state") for release in source.get_releases(FIRST_TO_CALC, last_release.date)},
+            {
+                (release_id, table)
+                for release_id, table, _, _ in source.get_fingerprints(
+                    [release.id for release in source.releases.values()], [], table_names=["state"]
+                )
+            },
+        )
+
+    def test_stage_timings_and_profiles(self):
+        source = data_sources.BundleDataSource.load(self.path)
+        profile_dir = os.path.join(self.tmp_dir.name, "profiles")
+        with self.assertLogs("scripts.timing") as logs:
+            calc_all_releases(FIRST_TO_CALC, LAST_TO_CALC, source=source, profile_dir=profile_dir)
+        lines = [json.loads(record.getMessage()) for record in logs.records]
+        release_dates = [FIRST_TO_CALC, LAST_TO_CALC, LAST_TO_CALC + datetime.timedelta(days=7)]
+        self.assertEqual([date.isoformat() for date in release_dates], [line["release_date"] for line in lines])
+        for stage in ["load_state", "tournament_init", "add_ratings", "calc_bonuses", "recalc_rating", "team_places"]:
+            self.assertIn(stage, lines[-1]["stages"])
+        self.assertIn("write", lines[-1]["stages"])
+        self.assertAlmostEqual(sum(lines[-1]["stages"].values()), lines[-1]["total"], places=4)
+        self.assertEqual(sorted(f"{date.isoformat()}.prof" for date in release_dates), sorted(os.listdir(profile_dir)))
+
+    def test_same_without_chain(self):
+        # Without the chain, every release is read back from what the bundle source kept of the previous one.
+        chained, unchained = (
+            data_sources.BundleDataSource.load(self.path),
+            data_sources.BundleDataSource.load(self.path),
+        )
+        calc_all_releases(FIRST_TO_CALC, LAST_TO_CALC, source=chained)
+        calc_all_releases(FIRST_TO_CALC, LAST_TO_CALC, chained=False, source=unchained)
+        last_release_date = LAST_TO_CALC + datetime.timedelta(days=7)
+        self.assertEqual(chained.get_release(last_release_date).hash, unchained.get_release(last_release_date).hash)
+
+    def test_same_pipelined(self):
+        # Pipelined, tournaments are read in batches of PIPELINED_RELEASES_PER_LOAD ahead of the calculation.
+        plain, pipelined = (
+            data_sources.BundleDataSource.load(self.path),
+            data_sources.BundleDataSource.load(self.path),
+        )
+        calc_all_releases(FIRST_TO_CALC, LAST_TO_CALC, source=plain)
+        calc_all_releases(FIRST_TO_CALC, LAST_TO_CALC, pipelined=True, source=pipelined)
+        last_release_date = LAST_TO_CALC + datetime.timedelta(days=7)
+        self.assertEqual(plain.get_release(last_release_date).hash, pipelined.get_release(last_release_date).hash)
+
+    def test_season_inputs_give_same_input_rows(self):
+        source = data_sources.BundleDataSource.load(self.path)
+        release_dates = [FIRST_TO_CALC, LAST_TO_CALC]
+        season_inputs = SeasonInputs(FIRST_TO_CALC, LAST_TO_CALC, source)
+        old_release = source.get_release(PREV_RELEASE)
+        for release_date, rows in source.get_tournament_rows_by_release(release_dates).items():
+            self.assertEqual(
+                fingerprint(build_input_rows(old_release, None, release_date, rows, source)),
+                fingerprint(build_input_rows(old_release, None, release_date, rows, source, season_inputs)),
+            )
+        with self.assertRaises(ValueError):
+            season_inputs.get_base_roster_rows(LAST_TO_CALC + datetime.timedelta(days=7))
+
+    def test_base_rosters_read_once(self):
+        source = data_sources.BundleDataSource.load(self.path)
+        with mock.patch.object(source, "get_base_rosters", wraps=source.get_base_rosters) as get_base_rosters:
+            calc_all_releases(FIRST_TO_CALC, LAST_TO_CALC, source=source)
+        self.assertEqual(1, get_base_rosters.call_count)
+
+    def test_chain_must_start_from_the_bundle(self):
+        source = data_sources.BundleDataSource.load(self.path)
+        with self.assertRaises(Release.DoesNotExist):
+            calc_all_releases(LAST_TO_CALC, LAST_TO_CALC, source=source)
+
+
+if __name__ == "__main__":
+    unittest.main()
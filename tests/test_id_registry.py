@@ -0,0 +1,46 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from scripts.id_registry import IdRegistry
+from scripts.tools import DataFrameBacked
+
+
+class Rating(DataFrameBacked):
+    def __init__(self, ids, registry=None):
+        self.data = pd.DataFrame({"rating": np.arange(len(ids)) * 100}, index=ids)
+        self.registry = registry
+
+
+class TestIdRegistry(unittest.TestCase):
+    def test_register_and_lookup(self):
+        registry = IdRegistry()
+        self.assertEqual([-1, -1], list(registry.lookup([5, 7])))
+        self.assertEqual([1, 0, 1], list(registry.register([900, 30, 900])))
+        self.assertEqual([2, 1, 3], list(registry.register([40, 900, 1000])))
+        self.assertEqual([30, 900, 40, 1000], list(registry.ids))
+        self.assertEqual([3, -1, 0, -1, 2], list(registry.lookup([1000, 1001, 30, 1, 40])))
+
+    def test_get_rows(self):
+        rating = Rating([700, 100, 400])
+        self.assertEqual([1, -1, 0, 2], list(rating.get_rows([100, 200, 700, 400])))
+        self.assertEqual([0, 0, 100], list(rating.get_values("rating", [700, 200, 100])))
+
+    def test_rows_follow_index_changes(self):
+        registry = IdRegistry()
+        rating = Rating([700, 100], registry)
+        other = Rating([5, 6, 7], registry)
+        self.assertEqual([-1, 1], list(rating.get_rows([5, 100])))
+        self.assertEqual([2], list(other.get_rows([7])))
+        rating.data = pd.concat([pd.DataFrame({"rating": [50]}, index=[5]), rating.data])
+        self.assertEqual([0, 2], list(rating.get_rows([5, 100])))
+
+    def test_empty(self):
+        rating = Rating([])
+        self.assertEqual([-1], list(rating.get_rows([1])))
+        self.assertEqual([0], list(rating.get_values("rating", [1])))
+
+
+if __name__ == "__main__":
+    unittest.main()
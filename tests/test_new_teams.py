@@ -0,0 +1,59 @@
+import unittest
+from dotenv import load_dotenv
+
+load_dotenv("../.env.test")
+
+import django
+
+django.setup()
+
+import pandas as pd
+
+from scripts.players import PlayerRating
+from scripts.rosters import Rosters
+from scripts.teams import TeamRating
+from scripts.tournament import Tournament
+
+
+def make_tournament(teams):
+    tournament = Tournament.__new__(Tournament)
+    tournament.data = pd.DataFrame({"team_id": [team_id for team_id, _ in teams], "roster_idx": range(len(teams))})
+    tournament.rosters = Rosters.from_lists([players for _, players in teams], is_base=True)
+    return tournament
+
+
+class TestNewTeams(unittest.TestCase):
+    def setUp(self):
+        self.team_rating = TeamRating(
+            teams_list=[
+                {"team_id": team_id, "rating": 6000 - 100 * team_id, "trb": 0, "place": team_id}
+                for team_id in range(1, 16)
+            ]
+        )
+        self.team_rating.q = 0.9
+        self.player_rating = PlayerRating.__new__(PlayerRating)
+        self.player_rating.data = pd.DataFrame({"rating": [9000, 7000, 5000]}, index=[11, 12, 13])
+        # Team 100 is new in both tournaments, with different base rosters.
+        self.tournaments = [
+            make_tournament([(1, [11]), (100, [11, 12])]),
+            make_tournament([(200, [13]), (100, [13]), (2, [12])]),
+        ]
+
+    def test_same_as_one_by_one(self):
+        team_rating = self.team_rating.copy()
+        for tournament in self.tournaments:
+            team_rating.add_new_teams(tournament, self.player_rating)
+        self.team_rating.add_all_new_teams(self.tournaments, self.player_rating)
+        pd.testing.assert_frame_equal(team_rating.data, self.team_rating.data)
+
+    def test_rating_from_first_tournament(self):
+        self.team_rating.add_all_new_teams(self.tournaments, self.player_rating)
+        self.assertEqual([100, 200], list(self.team_rating.data.index[15:]))
+        self.assertEqual(
+            list(self.player_rating.calc_rts(Rosters.from_lists([[11, 12], [13]]), 0.9)),
+            list(self.team_rating.data.trb[15:]),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+from dotenv import load_dotenv
+
+load_dotenv("../.env.test")
+
+import django
+
+django.setup()
+
+import numpy as np
+import pandas as pd
+
+from scripts import parallel
+from scripts.players import PlayerRating
+from scripts.rosters import Rosters
+from scripts.teams import TeamRating
+from scripts.tournament import Tournament
+
+
+class TestParallel(unittest.TestCase):
+    def make_tournaments(self, rng):
+        tournaments = []
+        for _ in range(7):
+            tournament = Tournament.__new__(Tournament)
+            team_ids = rng.choice(40, size=rng.integers(1, 20), replace=False) + 1
+            tournament.data = pd.DataFrame(
+                {"team_id": team_ids, "heredity": rng.random(len(team_ids)) < 0.8, "roster_idx": range(len(team_ids))}
+            )
+            tournament.rosters = Rosters.from_lists(
+                [list(rng.choice(300, size=rng.integers(0, 9), replace=False)) for _ in team_ids]
+            )
+            tournaments.append(tournament)
+        return tournaments
+
+    def test_same_as_serial(self):
+        rng = np.random.default_rng(0)
+        team_rating = TeamRating(
+            teams_list=[
+                {"team_id": team_id, "rating": rng.integers(0, 10000), "trb": rng.integers(0, 10000), "place": 0}
+                for team_id in range(1, 30)
+            ]
+        )
+        team_rating.q = 0.87
+        player_rating = PlayerRating.__new__(PlayerRating)
+        player_rating.data = pd.DataFrame({"rating": rng.integers(0, 9000, size=250)}, index=np.arange(250))
+
+        serial = self.make_tournaments(np.random.default_rng(1))
+        for tournament in serial:
+            tournament.add_ratings(team_rating, player_rating)
+        in_parallel = self.make_tournaments(np.random.default_rng(1))
+        parallel.add_ratings(in_parallel, team_rating, player_rating, workers=3)
+        for expected, tournament in zip(serial, in_parallel):
+            for column in ("rt", "r", "rb", "rg", "expected_place"):
+                self.assertEqual(list(expected.data[column]), list(tournament.data[column]))
+
+    def test_shared_pool(self):
+        rng = np.random.default_rng(2)
+        team_rating = TeamRating(
+            teams_list=[
+                {"team_id": team_id, "rating": rng.integers(0, 10000), "trb": rng.integers(0, 10000), "place": 0}
+                for team_id in range(1, 42)
+            ]
+        )
+        team_rating.q = 0.9
+        player_rating = PlayerRating.__new__(PlayerRating)
+        player_rating.data = pd.DataFrame({"rating": rng.integers(0, 9000, size=300)}, index=np.arange(300))
+
+        expected = self.make_tournaments(np.random.default_rng(3))
+        parallel.add_ratings(expected, team_rating, player_rating, workers=2)
+        with parallel.make_pool(2) as pool:
+            # The same pool serves several releases.
+            for _ in range(2):
+                in_pool = self.make_tournaments(np.random.default_rng(3))
+                parallel.add_ratings(in_pool, team_rating, player_rating, workers=2, pool=pool)
+                for tournament, pooled in zip(expected, in_pool):
+                    self.assertEqual(list(tournament.data["rt"]), list(pooled.data["rt"]))
+
+    def test_lookup(self):
+        self.assertEqual(
+            [20, 0, 10, 0], list(parallel.lookup(np.array([1, 5]), np.array([10, 20]), np.array([5, 6, 1, 0])))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
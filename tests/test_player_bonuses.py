@@ -0,0 +1,81 @@
+import unittest
+
+import numpy as np
+
+from scripts.constants import J
+from scripts.player_bonuses import PlayerBonuses
+
+
+class TestPlayerBonuses(unittest.TestCase):
+    def setUp(self):
+        # Player 0 has three bonuses, player 1 has none, player 2 has two.
+        self.bonuses = PlayerBonuses(
+            player_idx=[2, 0, 0, 2, 0],
+            tournament_id=[10, 11, 12, 13, 14],
+            initial_score=[1000, 2000, 1500, 1000, 2000],
+            weeks_since_tournament=[0, 3, 1, 0, 3],
+            cur_score=[1000, 1941, 1485, 1000, 1941],
+        )
+
+    def test_reduce(self):
+        self.bonuses.reduce()
+        self.assertEqual([1, 4, 2, 1, 4], list(self.bonuses.weeks_since_tournament))
+        self.assertEqual(2000 * J**4, self.bonuses.raw_cur_score[1])
+        self.assertEqual([round(1000 * J), round(2000 * J**4), round(1500 * J**2)], list(self.bonuses.cur_score[:3]))
+
+    def test_leave_top_n_keeps_order_on_ties(self):
+        self.bonuses.reduce()
+        self.bonuses.leave_top_n(2, n_players=3)
+        self.assertEqual([0, 0, 2, 2], list(self.bonuses.player_idx))
+        self.assertEqual([11, 14, 10, 13], list(self.bonuses.tournament_id))
+        self.assertEqual([0, 2, 2, 4], list(self.bonuses.offsets))
+        self.assertEqual(
+            [2 * round(2000 * J**4), 0, 2 * round(1000 * J)],
+            list(self.bonuses.sum_by_player(3)),
+        )
+
+    def test_add(self):
+        self.bonuses.add(np.array([1, 2]), 20, np.array([500.0, 700.0]))
+        self.assertEqual(7, len(self.bonuses))
+        self.assertEqual([20, 20], list(self.bonuses.tournament_id[5:]))
+        self.assertEqual([0, 0], list(self.bonuses.weeks_since_tournament[5:]))
+        self.assertEqual([500, 700], list(self.bonuses.cur_score[5:]))
+
+    def test_take_players(self):
+        taken = self.bonuses.take_players(np.array([False, True, True]))
+        self.assertEqual([1, 1], list(taken.player_idx))
+        self.assertEqual([10, 13], list(taken.tournament_id))
+        self.assertEqual(5, len(self.bonuses))
+
+    def test_matches_per_player_sorting(self):
+        # The previous implementation: a list of bonuses per player, decayed one by one,
+        # sorted by the raw score and truncated to top 7.
+        rng = np.random.default_rng(0)
+        n_players, n_bonuses = 300, 3000
+        player_idx = rng.integers(0, n_players, size=n_bonuses)
+        initial_score = rng.integers(0, 40, size=n_bonuses) * 50
+        weeks = rng.integers(0, 400, size=n_bonuses)
+        bonuses = PlayerBonuses(
+            player_idx=player_idx,
+            tournament_id=np.arange(n_bonuses),
+            initial_score=initial_score,
+            weeks_since_tournament=weeks,
+            cur_score=np.zeros(n_bonuses),
+        )
+        bonuses.reduce()
+        bonuses.leave_top_n(7, n_players)
+
+        expected_by_player = {player: [] for player in range(n_players)}
+        for i in range(n_bonuses):
+            raw_score = initial_score[i] * (J ** int(weeks[i] + 1))
+            expected_by_player[player_idx[i]].append((i, raw_score, round(raw_score)))
+        for player, player_bonuses in expected_by_player.items():
+            top = sorted(player_bonuses, key=lambda x: -x[1])[:7]
+            start, end = bonuses.offsets[player], bonuses.offsets[player + 1]
+            self.assertEqual([x[0] for x in top], list(bonuses.tournament_id[start:end]))
+            self.assertEqual([x[1] for x in top], list(bonuses.raw_cur_score[start:end]))
+            self.assertEqual(sum(x[2] for x in top), bonuses.sum_by_player(n_players)[player])
+
+
+if __name__ == "__main__":
+    unittest.main()
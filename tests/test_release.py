@@ -9,8 +9,9 @@ import django
 
 django.setup()
 
-from scripts.main import calc_release, calc_all_releases
+from scripts.main import calc_release, calc_all_releases, find_first_changed_release
 from b.models import (
+    Fingerprint,
     Team_rating,
     Tournament_in_release,
     Player_rating_by_tournament,
@@ -125,7 +126,7 @@ class TestReleases(unittest.TestCase):
         team_rows_before = Team_rating.objects.filter(release=release_before).count()
 
         with self.assertLogs("scripts.main", level="INFO") as logs:
-            calc_release(self.release_date)
+            calc_release(self.release_date, force=True)
 
         self.assertTrue(any("skipping write" in message for message in logs.output))
 
@@ -134,3 +135,39 @@ class TestReleases(unittest.TestCase):
         self.assertEqual(release_before.hash, release_after.hash)
         self.assertEqual(player_rows_before, Player_rating.objects.filter(release=release_after).count())
         self.assertEqual(team_rows_before, Team_rating.objects.filter(release=release_after).count())
+
+    def test_unchanged_inputs_skip_calculation(self):
+        with self.assertLogs("scripts.main", level="INFO") as logs:
+            calc_all_releases(self.release_date, self.release_date + timedelta(days=14))
+
+        # The first release is skipped by its inputs; the rest are not even looked at.
+        self.assertEqual(1, sum("inputs unchanged; skipping calculation" in message for message in logs.output))
+        self.assertTrue(any("skipped as unchanged: 4" in message for message in logs.output))
+
+    def test_no_changed_releases_after_calculation(self):
+        self.assertIsNone(find_first_changed_release(self.release_date, self.release_date + timedelta(days=14)))
+
+    def test_chained_releases_match_releases_read_from_db(self):
+        # setUpClass calculated these releases in chained mode. Recalculating each of them from the
+        # previous release stored in our DB must produce exactly the same rows, so every write is skipped.
+        with self.assertLogs("scripts.main", level="INFO") as logs:
+            calc_all_releases(self.release_date, self.release_date + timedelta(days=14), chained=False, force=True)
+
+        self.assertEqual(4, sum("skipping write" in message for message in logs.output))
+
+    def test_diff_mode_restores_only_changed_rows(self):
+        Player_rating.objects.filter(release=self.release, player_id=77673).update(rating=1)
+        Team_rating.objects.filter(release=self.release, team_id=45556).delete()
+        player_ids_before = set(Player_rating.objects.filter(release=self.release).values_list("id", flat=True))
+        # Make the stored fingerprints stale, so that the release is written again.
+        Fingerprint.objects.filter(release=self.release).delete()
+        Release.objects.filter(pk=self.release.pk).update(hash=0)
+
+        calc_release(self.release_date, diff=True)
+
+        self.assertEqual(12433, Player_rating.objects.get(release=self.release, player_id=77673).rating)
+        self.assertEqual(10734, Team_rating.objects.get(release=self.release, team_id=45556).rating)
+        # Player rows were updated in place rather than reinserted.
+        self.assertEqual(
+            player_ids_before, set(Player_rating.objects.filter(release=self.release).values_list("id", flat=True))
+        )
@@ -0,0 +1,49 @@
+import threading
+import unittest
+from dotenv import load_dotenv
+
+load_dotenv("../.env.test")
+
+import django
+
+django.setup()
+
+from scripts.main import ReleaseWriter
+
+
+class TestReleaseWriter(unittest.TestCase):
+    def test_writes_in_order_in_another_thread(self):
+        written = []
+        writer = ReleaseWriter()
+        for release in range(5):
+            writer.submit(lambda release=release: written.append((release, threading.current_thread().name)))
+        writer.close()
+        self.assertEqual(list(range(5)), [release for release, _ in written])
+        self.assertNotIn(threading.current_thread().name, {thread for _, thread in written})
+
+    def test_failed_write_stops_the_chain(self):
+        written = []
+
+        def fail():
+            raise RuntimeError("write failed")
+
+        writer = ReleaseWriter()
+        writer.submit(fail)
+        with self.assertRaises(RuntimeError):
+            writer.submit(lambda: written.append(1))
+        writer.close()
+        self.assertEqual([], written)
+
+    def test_close_can_log_failed_write(self):
+        def fail():
+            raise RuntimeError("write failed")
+
+        writer = ReleaseWriter()
+        writer.submit(fail)
+        with self.assertLogs("scripts.main", level="ERROR"):
+            writer.close(log_errors=True)
+        writer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+from scripts.rosters import Rosters
+
+
+class TestRosters(unittest.TestCase):
+    def setUp(self):
+        # Entries of teams 1, 0, 1, 2, 1: team 0 has one player, team 1 three, team 2 one.
+        self.rosters = Rosters.from_entries(
+            team_idx=[1, 0, 1, 2, 1],
+            player_ids=[10, 20, 11, 30, 12],
+            is_base=[True, True, False, False, True],
+            n_teams=4,
+        )
+
+    def test_from_entries_keeps_order_of_entries(self):
+        self.assertEqual([0, 1, 4, 5, 5], list(self.rosters.indptr))
+        self.assertEqual([20, 10, 11, 12, 30], list(self.rosters.player_ids))
+        self.assertEqual([10, 11, 12], list(self.rosters.members(1)))
+        self.assertEqual([], list(self.rosters.members(3)))
+        self.assertEqual([0, 1, 1, 1, 2], list(self.rosters.team_idx()))
+
+    def test_take(self):
+        taken = self.rosters.take([2, 1, 3, 1])
+        self.assertEqual([0, 1, 4, 4, 7], list(taken.indptr))
+        self.assertEqual([30, 10, 11, 12, 10, 11, 12], list(taken.player_ids))
+        self.assertEqual([False, True, False, True, True, False, True], list(taken.is_base))
+
+    def test_base(self):
+        base = self.rosters.base()
+        self.assertEqual([0, 1, 3, 3, 3], list(base.indptr))
+        self.assertEqual([20, 10, 12], list(base.player_ids))
+
+    def test_from_lists(self):
+        rosters = Rosters.from_lists([[5, 6], [], [7]])
+        self.assertEqual([0, 2, 2, 3], list(rosters.indptr))
+        self.assertEqual([5, 6, 7], list(rosters.player_ids))
+        self.assertEqual(3, len(rosters))
+
+    def test_concat(self):
+        rosters = Rosters.concat([self.rosters, Rosters.from_lists([[5, 6]], is_base=True)])
+        self.assertEqual([0, 1, 4, 5, 5, 7], list(rosters.indptr))
+        self.assertEqual([20, 10, 11, 12, 30, 5, 6], list(rosters.player_ids))
+        self.assertEqual([True, True], list(rosters.is_base[5:]))
+
+
+if __name__ == "__main__":
+    unittest.main()
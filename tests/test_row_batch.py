@@ -0,0 +1,81 @@
+import unittest
+
+import numpy as np
+
+from scripts.changes import fingerprint, table_fingerprint
+from scripts.row_batch import RowBatch, integer_column
+
+
+class TestRowBatch(unittest.TestCase):
+    def setUp(self):
+        self.batch = RowBatch(
+            columns={
+                "team_id": np.array([1, 2, 3]),
+                "rating": integer_column([1000.5, -20.5, np.nan]),
+                "place": np.array([1.0, 2.5, 0.0]),
+            },
+            nulls={"rating": np.array([False, False, True])},
+        )
+
+    def test_integer_column_rounds_half_away_from_zero(self):
+        self.assertEqual([1001, -21, 0], list(self.batch.columns["rating"]))
+
+    def test_to_dicts(self):
+        self.assertEqual(
+            [
+                {"team_id": 1, "rating": 1001, "place": 1.0},
+                {"team_id": 2, "rating": -21, "place": 2.5},
+                {"team_id": 3, "rating": None, "place": 0.0},
+            ],
+            self.batch.to_dicts(),
+        )
+
+    def test_concat(self):
+        other = RowBatch(columns={column: values[:1] for column, values in self.batch.columns.items()})
+        joined = RowBatch.concat([self.batch, RowBatch(columns={}), other])
+        self.assertEqual(4, len(joined))
+        self.assertEqual([False, False, True, False], list(joined.is_null("rating")))
+        self.assertEqual(self.batch.to_dicts() + other.to_dicts(), joined.to_dicts())
+
+    def test_fingerprint_ignores_row_order(self):
+        self.assertEqual(
+            fingerprint({"team_rating": self.batch}),
+            fingerprint({"team_rating": self.batch.take(np.array([2, 0, 1]))}),
+        )
+
+    def test_fingerprint_covers_values_nulls_and_tables(self):
+        base = fingerprint({"team_rating": self.batch})
+        self.assertNotEqual(base, fingerprint({"tournament_result": self.batch}))
+
+        changed_value = RowBatch(columns=dict(self.batch.columns), nulls=self.batch.nulls)
+        changed_value.columns["place"] = np.array([1.0, 2.0, 0.0])
+        self.assertNotEqual(base, fingerprint({"team_rating": changed_value}))
+
+        not_null = RowBatch(columns=self.batch.columns)
+        self.assertNotEqual(base, fingerprint({"team_rating": not_null}))
+
+        # Values swapped between rows of one column.
+        swapped = RowBatch(columns=dict(self.batch.columns), nulls=self.batch.nulls)
+        swapped.columns["team_id"] = np.array([2, 1, 3])
+        self.assertNotEqual(base, fingerprint({"team_rating": swapped}))
+
+    def test_fingerprint_is_sum_of_table_fingerprints(self):
+        tables = {"team_rating": self.batch, "tournament_result": self.batch.take(np.array([0, 1]))}
+        total = sum(table_fingerprint(table, batch) for table, batch in tables.items())
+        self.assertEqual((total + (1 << 63)) % (1 << 64) - (1 << 63), fingerprint(tables))
+
+    def test_fingerprint_covers_strings(self):
+        def titles(values):
+            return RowBatch(
+                columns={"title": np.array(values, dtype=object)},
+                nulls={"title": np.array([value is None for value in values])},
+            )
+
+        base = fingerprint({"tournament_results": titles(["Команда", "Team"])})
+        self.assertEqual(base, fingerprint({"tournament_results": titles(["Team", "Команда"])}))
+        self.assertNotEqual(base, fingerprint({"tournament_results": titles(["Команда 2", "Team"])}))
+        self.assertNotEqual(base, fingerprint({"tournament_results": titles([None, "Team"])}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from scripts.snapshots import SnapshotStore
+
+
+class TestSnapshotStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = SnapshotStore(os.path.join(self.tmp_dir.name, "snapshots"))
+        self.date = datetime.date(2022, 3, 10)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_save_and_load(self):
+        self.store.save(
+            self.date,
+            {"team_id": np.array([3, 1, 2]), "team_place": np.array([1.0, 2.5, 2.5])},
+            {"release_id": 7, "input_hash": None},
+        )
+        arrays, meta = self.store.load(self.date)
+        self.assertEqual({"release_id": 7, "input_hash": None}, meta)
+        self.assertEqual([3, 1, 2], list(arrays["team_id"]))
+        self.assertEqual([1.0, 2.5, 2.5], list(arrays["team_place"]))
+        self.assertIsInstance(arrays["team_id"], np.memmap)
+
+    def test_save_replaces_previous_snapshot(self):
+        self.store.save(self.date, {"team_id": np.array([1]), "player_id": np.array([2])}, {"release_id": 7})
+        self.store.save(self.date, {"team_id": np.array([4])}, {"release_id": 8})
+        arrays, meta = self.store.load(self.date)
+        self.assertEqual({"team_id"}, set(arrays))
+        self.assertEqual(8, meta["release_id"])
+        self.assertEqual([self.date.isoformat()], os.listdir(self.store.directory))
+
+    def test_missing_and_discarded_snapshots(self):
+        self.assertIsNone(self.store.load(self.date))
+        self.store.save(self.date, {"team_id": np.array([1])}, {})
+        self.store.discard(self.date)
+        self.assertIsNone(self.store.load(self.date))
+
+
+if __name__ == "__main__":
+    unittest.main()
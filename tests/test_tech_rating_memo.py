@@ -0,0 +1,37 @@
+import unittest
+from dotenv import load_dotenv
+
+load_dotenv("../.env.test")
+
+import django
+
+django.setup()
+
+import pandas as pd
+
+from scripts.players import PlayerRating, TechRatingMemo
+from scripts.rosters import Rosters
+
+
+class TestTechRatingMemo(unittest.TestCase):
+    def setUp(self):
+        self.player_rating = PlayerRating.__new__(PlayerRating)
+        self.player_rating.data = pd.DataFrame({"rating": [9000, 7000, 5000, 3000]}, index=[1, 2, 3, 4])
+
+    def test_same_as_without_memo(self):
+        rosters = Rosters.from_lists([[1, 2, 3], [3, 2, 1], [4], [1, 2, 3, 4], []])
+        memo = TechRatingMemo(self.player_rating)
+        self.assertEqual(list(self.player_rating.calc_rts(rosters, 0.8)), list(memo.calc_rts(rosters, 0.8)))
+
+    def test_hits_and_misses(self):
+        memo = TechRatingMemo(self.player_rating)
+        memo.calc_rts(Rosters.from_lists([[1, 2], [2, 1], [3]]))
+        self.assertEqual((1, 2), (memo.n_hits, memo.n_misses))
+        memo.calc_rts(Rosters.from_lists([[3], [1, 2]]), q=0.5)
+        self.assertEqual((1, 4), (memo.n_hits, memo.n_misses))
+        memo.calc_rts(Rosters.from_lists([[3]]), q=0.5)
+        self.assertEqual((2, 4), (memo.n_hits, memo.n_misses))
+
+
+if __name__ == "__main__":
+    unittest.main()
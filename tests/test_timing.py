@@ -0,0 +1,62 @@
+import datetime
+import json
+import os
+import pstats
+import tempfile
+import time
+import unittest
+
+from scripts.timing import StageTimer, log_release_stages, profiled
+
+
+class TestTiming(unittest.TestCase):
+    def test_stage_timer_adds_up_stages(self):
+        timer = StageTimer()
+        with timer("load"):
+            time.sleep(0.01)
+        with timer("step"):
+            pass
+        with timer("load"):
+            time.sleep(0.01)
+        self.assertEqual(["load", "step"], list(timer.seconds))
+        self.assertGreaterEqual(timer.seconds["load"], 0.02)
+
+    def test_stage_timer_counts_failed_stage(self):
+        timer = StageTimer()
+        with self.assertRaises(ValueError):
+            with timer("write"):
+                raise ValueError
+        self.assertIn("write", timer.seconds)
+
+    def test_log_release_stages(self):
+        timer = StageTimer()
+        timer.seconds = {"load_state": 1.5, "write": 0.25}
+        with self.assertLogs("scripts.timing") as logs:
+            log_release_stages(datetime.date(2025, 1, 16), 190, timer, n_tournaments=80)
+        self.assertEqual(
+            {
+                "release_date": "2025-01-16",
+                "release_id": 190,
+                "skipped": False,
+                "n_tournaments": 80,
+                "total": 1.75,
+                "stages": {"load_state": 1.5, "write": 0.25},
+            },
+            json.loads(logs.records[0].getMessage()),
+        )
+
+    def test_profiled(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            profile_dir = os.path.join(tmp_dir, "profiles")
+            with profiled(profile_dir, datetime.date(2025, 1, 16)):
+                sorted(range(1000))
+            stats = pstats.Stats(os.path.join(profile_dir, "2025-01-16.prof"))
+            self.assertGreater(stats.total_calls, 0)
+
+    def test_not_profiled_without_dir(self):
+        with profiled(None, datetime.date(2025, 1, 16)):
+            pass
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,32 @@
 import unittest
 import datetime
 
+import numpy as np
+import pandas as pd
+
 from scripts import tools
 
 
+# The previous pandas implementations of calc_places and calc_score_real.
+def calc_places_pandas(points):
+    points_pd = pd.DataFrame(data=points, columns=["points"])
+    points_pd.sort_values(by="points", ascending=False, inplace=True)
+    points_pd["raw_places"] = np.arange(1, len(points) + 1)
+    places_series = points_pd.groupby("points").raw_places.mean()
+    return places_series.loc[points].values
+
+
+def calc_score_real_pandas(predicted_scores, positions):
+    positions = positions - 1
+    pos_counts = pd.Series(positions).value_counts().reset_index()
+    pos_counts.columns = ["pos", "n_teams"]
+    pos_counts["bonus"] = pos_counts.apply(
+        lambda x: np.mean(predicted_scores[int(x.pos - (x.n_teams - 1) / 2) : int(x.pos + (x.n_teams - 1) / 2) + 1]),
+        axis=1,
+    )
+    return np.round(pos_counts.set_index("pos").loc[positions, "bonus"].values)
+
+
 class TestTools(unittest.TestCase):
     def test_get_releases_difference(self):
         self.assertEqual(
@@ -80,6 +103,62 @@ class TestTools(unittest.TestCase):
         with self.assertRaises(AssertionError) as _:
             tools.get_prev_release_date(datetime.date(2020, 4, 1))
 
+    def test_round_half_away_from_zero(self):
+        self.assertEqual(
+            [3, -3, 1, 2, 0, 10734],
+            list(tools.round_half_away_from_zero([2.5, -2.5, 1.49, 1.5, 0.49999999999999994, 10733.5])),
+        )
+
+    def test_calc_tech_ratings_matches_calc_tech_rating(self):
+        rng = np.random.default_rng(0)
+        offsets = np.concatenate([[0], np.cumsum(rng.integers(0, 20, size=5000))])
+        ratings = rng.integers(0, 15000, size=offsets[-1]).astype("float64")
+        for q in (None, 0.87):
+            self.assertEqual(
+                [tools.calc_tech_rating(ratings[start:end], q) for start, end in zip(offsets[:-1], offsets[1:])],
+                list(tools.calc_tech_ratings(ratings, offsets, q)),
+            )
+
+    def test_group_offsets(self):
+        keys, offsets = tools.group_offsets(np.array([3, 3, 5, 8, 8, 8]))
+        self.assertEqual([3, 5, 8], list(keys))
+        self.assertEqual([0, 2, 3, 6], list(offsets))
+
+    def test_calc_places(self):
+        self.assertEqual([4, 2.5, 1, 2.5], list(tools.calc_places(np.array([100, 200, 300, 200]))))
+
+    def test_calc_places_matches_pandas(self):
+        rng = np.random.default_rng(0)
+        for _ in range(300):
+            n_teams = rng.integers(1, 400)
+            points = rng.integers(0, rng.integers(1, 2 * n_teams + 1), size=n_teams).astype("float64")
+            if rng.random() < 0.5:
+                points = points * 1000 + rng.random(n_teams)
+            self.assertEqual(list(calc_places_pandas(points)), list(tools.calc_places(points)))
+
+    def test_calc_score_real(self):
+        self.assertEqual(
+            [300, 150, 150, 20], list(tools.calc_score_real(np.array([300, 200, 100, 20]), np.array([1, 2.5, 2.5, 4])))
+        )
+
+    def test_calc_score_real_matches_pandas(self):
+        rng = np.random.default_rng(0)
+        for i in range(300):
+            n_teams = rng.integers(1, 400)
+            predicted_scores = np.sort(rng.random(n_teams) * 5000)[::-1]
+            if i % 3 == 0:
+                # Means exactly at .5 are rounded to even, so they must match to the last bit.
+                predicted_scores = np.round(predicted_scores * 2) / 2
+            places = np.sort(rng.integers(0, rng.integers(1, n_teams + 1), size=n_teams))
+            positions = tools.calc_places(-places)
+            if i % 10 == 0:
+                # Inconsistent positions, e.g. when some teams are missing from the results.
+                positions = np.sort(rng.choice([1, 2, 2.5, 3, 4.5, 7, 50, 500], size=n_teams))
+            # NaN (an empty range of places) counts as equal here.
+            np.testing.assert_array_equal(
+                calc_score_real_pandas(predicted_scores, positions), tools.calc_score_real(predicted_scores, positions)
+            )
+
 
 if __name__ == "__main__":
     unittest.main()